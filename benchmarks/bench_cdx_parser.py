@@ -0,0 +1,73 @@
+"""
+Micro-benchmark of the cdx line parsers. Generates a gzip compressed cdx
+file in the style of tests/resources/domain-nl-0000.gz and compares the
+previous regex + json.loads code path with the fast path parser.
+
+Run from the repository root: python -m benchmarks.bench_cdx_parser
+"""
+import gzip
+import json
+import os
+import random
+import tempfile
+import timeit
+from argparse import ArgumentParser
+
+from urbansearch.gathering import cdx, gathering
+
+LINE = ('{{"urlkey": "nl,example{0})/", "timestamp": "20170430124049", '
+        '"status": "{1}", "url": "http://example{0}.nl/", "filename": '
+        '"crawl-data/CC-MAIN-2017-17/segments/1492917125532.90/warc/'
+        'CC-MAIN-20170423031205-00548-ip-10-145-167-34.ec2.internal.warc.gz",'
+        ' "length": "{2}", "mime": "text/html", "offset": "{3}", '
+        '"digest": "3I42H3S6NNFQ2MSVX7XZKYAYSCX5QB{0:02d}"}}')
+
+
+def _lines(n, ok_ratio):
+    rnd = random.Random(42)
+    return [LINE.format(i % 100,
+                        '200' if rnd.random() < ok_ratio else '301',
+                        rnd.randint(500, 50000), rnd.randint(0, 10 ** 9))
+            for i in range(n)]
+
+
+def _old(lines):
+    pd = gathering.PageDownloader
+    return [json.loads(x, object_hook=pd._remove_keys) for x in lines
+            if pd._useful_str_responsecode(x)]
+
+
+def _new(lines):
+    parse = cdx.parse_index
+    return [i for i in map(parse, lines) if i is not None]
+
+
+def run(num_lines, ok_ratio, repeat):
+    lines = _lines(num_lines, ok_ratio)
+    assert _old(lines) == _new(lines)
+
+    for name, func in (('regex + json.loads', _old),
+                       ('cdx.parse_index', _new)):
+        best = min(timeit.repeat(lambda: func(lines), number=1,
+                                 repeat=repeat))
+        print('{:20} {:10.0f} lines/s'.format(name, num_lines / best))
+
+    path = os.path.join(tempfile.mkdtemp(), 'cdx-00000.gz')
+    with gzip.open(path, 'wt') as f:
+        f.write('\n'.join(lines))
+    best = min(timeit.repeat(lambda: list(cdx.iter_gz_indices(path)),
+                             number=1, repeat=repeat))
+    print('{:20} {:10.0f} lines/s (including decompression)'
+          .format('cdx.iter_gz_indices', num_lines / best))
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='CDX line parser benchmark')
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--ok-ratio', type=float, default=0.7,
+                        help='Fraction of lines with status 200')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.lines, args.ok_ratio, args.repeat)
@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of the mention matching of the co-occurrence checker.
+Generates long pages of words that start with or contain short city names,
+like Een for Ee, with a given fraction of city names, and compares the
+previous pairwise word boundary logic, which only checked the end of
+names, with CoOccurrenceChecker._mentions.
+
+Run from the repository root: python -m benchmarks.bench_cooccurrence
+"""
+import ahocorasick
+import random
+import timeit
+from argparse import ArgumentParser
+
+from urbansearch.filtering.cooccurrence import CoOccurrenceChecker
+
+CITIES = ['Ee', 'Ede', 'Epe', 'Ens', 'Urk', 'Oss', 'Ter Apel', 'Den Haag',
+          'Den Helder', 'Amsterdam', 'Amsterdam Zuidoost', "'s-Gravenhage",
+          'Bergen op Zoom']
+WORDS = ['een', 'de', 'het', 'van', 'op', 'Zoom', 'Een', 'Eerste', 'Eden',
+         'Ensemble', 'Ossendrecht', 'Urker.', 'Amsterdammers', 'Eemnes,',
+         'NieuwAmsterdam', 'Ede-Wageningen']
+
+
+def _pages(n, words_per_page, density):
+    rnd = random.Random(42)
+    return [' '.join(rnd.choice(CITIES if rnd.random() < density else WORDS)
+                     for _ in range(words_per_page))
+            for _ in range(n)]
+
+
+def _old_automaton(cities):
+    automaton = ahocorasick.Automaton()
+    for city in cities:
+        automaton.add_word(city, city)
+    automaton.make_automaton()
+    return automaton
+
+
+def _old(automaton, page):
+    names = automaton.iter(page)
+
+    prev_end, prev_name = next(names, (None, None))
+    for end, name in names:
+        if page[prev_end + 1] in 'abcdefghijklmnopqrstuvwxyz':
+            prev_end, prev_name = end, name
+        elif abs(end - prev_end) < len(name):
+            longer = name if len(name) > len(prev_name) else prev_name
+            yield longer
+            prev_end, prev_name = next(names, (None, None))
+        else:
+            yield prev_name
+            prev_end, prev_name = end, name
+
+    if prev_name:
+        yield prev_name
+
+
+def run(num_pages, words_per_page, density, repeat):
+    pages = _pages(num_pages, words_per_page, density)
+    checker = CoOccurrenceChecker(CITIES, cache_dir='')
+    automaton = _old_automaton(CITIES)
+
+    for name, func in (('pairwise boundaries',
+                        lambda page: list(_old(automaton, page))),
+                       ('_mentions', checker._mentions)):
+        best = min(timeit.repeat(lambda: [func(p) for p in pages], number=1,
+                                 repeat=repeat))
+        print('{:20} {:10.0f} pages/s'.format(name, num_pages / best))
+
+    best = min(timeit.repeat(lambda: [checker.check(p) for p in pages],
+                             number=1, repeat=repeat))
+    print('{:20} {:10.0f} pages/s'.format('check', num_pages / best))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Co-occurrence matching benchmark')
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--words', type=int, default=20000,
+                        help='Number of words per page')
+    parser.add_argument('--density', type=float, default=0.02,
+                        help='Fraction of words that are city names')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.pages, args.words, args.density, args.repeat)
@@ -0,0 +1,73 @@
+"""
+Benchmark of the HTML to text extractors. Compares the text produced by the
+stream extractor with the BeautifulSoup extractor and measures the number
+of pages per second of both. Pages are generated, or read from a directory
+of HTML files with --pages.
+
+Run from the repository root: python -m benchmarks.bench_extractors
+"""
+import os
+import random
+import timeit
+from argparse import ArgumentParser
+
+from urbansearch.gathering import extractors
+
+WORDS = ('Delft', 'Rotterdam', 'station', 'de', 'het', 'een', 'winkel',
+         'fiets', 'werk', 'school', 'café', 'naar', '&amp;', '&eacute;')
+BLOCKS = (
+    '<p class="tekst">{0}</p>\n',
+    '<div id="b{1}"><span>{0}</span> <a href="/{1}">{0}</a></div>\n',
+    '<ul>\n  <li>{0}</li>\n  <li>{0}<br>{0}</li>\n</ul>\n',
+    '<script type="text/javascript">var x{1} = "<p>{0}</p>";</script>\n',
+    '<!-- {0} -->\n<table><tr><td>{0}</td><td>{1}</td></tr></table>\n',
+    '<style>.c{1} {{ color: red; }}</style><img src="{1}.png" alt="{0}">\n',
+)
+
+
+def _pages(n, blocks):
+    rnd = random.Random(42)
+    pages = []
+    for i in range(n):
+        body = ''.join(
+            rnd.choice(BLOCKS).format(
+                ' '.join(rnd.choice(WORDS) for _ in range(20)), j)
+            for j in range(blocks))
+        pages.append('<!DOCTYPE html>\n<html><head><title>Pagina {0}</title>'
+                     '<meta charset="utf-8"></head>\n<body>\n{1}</body>'
+                     '</html>\n'.format(i, body).encode('utf-8'))
+    return pages
+
+
+def _read_pages(directory):
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as f:
+            pages.append(f.read())
+    return pages
+
+
+def run(pages, repeat):
+    stream = extractors.get_extractor('stream')
+    soup = extractors.get_extractor('soup')
+
+    equal = sum(stream.extract(p) == soup.extract(p) for p in pages)
+    print('{} of {} pages give equal text'.format(equal, len(pages)))
+
+    for name, extractor in (('soup', soup), ('stream', stream)):
+        best = min(timeit.repeat(
+            lambda: [extractor.extract(p) for p in pages],
+            number=1, repeat=repeat))
+        print('{:10} {:10.0f} pages/s'.format(name, len(pages) / best))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='HTML to text extractor benchmark')
+    parser.add_argument('--pages', help='Directory of HTML files')
+    parser.add_argument('--num-pages', type=int, default=500)
+    parser.add_argument('--blocks', type=int, default=60,
+                        help='Number of HTML blocks per generated page')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(_read_pages(args.pages) if args.pages else
+        _pages(args.num_pages, args.blocks), args.repeat)
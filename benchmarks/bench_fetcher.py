@@ -0,0 +1,69 @@
+"""
+Offline throughput benchmark of the WARC part fetchers. Serves a generated
+WARC file from a local stand-in server that delays every response to
+simulate network latency, then compares the blocking PageDownloader with
+the AsyncFetcher. Reading the same file as a local copy is measured as
+well.
+
+Run from the repository root: python -m benchmarks.bench_fetcher
+"""
+import shutil
+import tempfile
+import timeit
+from argparse import ArgumentParser
+
+from tests.cc_server import StandInServer, write_warc
+from urbansearch.gathering import fetcher, gathering
+
+WARC = 'crawl-data/bench/warc/bench.warc.gz'
+
+
+def _pages(n):
+    return [('http://page{}.nl/'.format(i),
+             '<html><body>{}</body></html>'.format('Delft Rotterdam ' * 200))
+            for i in range(n)]
+
+
+def run(num_records, delay, in_flight):
+    root = tempfile.mkdtemp()
+    server = StandInServer(root, delay=delay).start()
+    try:
+        indices = write_warc(root, WARC, _pages(num_records))
+
+        pd = gathering.PageDownloader()
+        pd.cc_data_prefix = server.url
+        start = timeit.default_timer()
+        for index in indices:
+            pd.download_warc_part(index)
+        sequential = timeit.default_timer() - start
+
+        f = fetcher.AsyncFetcher(max_in_flight=in_flight,
+                                 cc_data=server.url)
+        start = timeit.default_timer()
+        list(f.fetch_iter(indices))
+        concurrent = timeit.default_timer() - start
+        f.close()
+
+        pd.cc_data_prefix = root
+        start = timeit.default_timer()
+        list(pd.download_warc_parts(indices))
+        local = timeit.default_timer() - start
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+
+    print('records: {}, simulated latency: {} s'.format(num_records, delay))
+    print('PageDownloader: {:8.1f} records/s'.format(num_records /
+                                                      sequential))
+    print('AsyncFetcher:   {:8.1f} records/s ({} in flight)'
+          .format(num_records / concurrent, in_flight))
+    print('Local files:    {:8.1f} records/s'.format(num_records / local))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='WARC fetcher benchmark')
+    parser.add_argument('--records', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.02)
+    parser.add_argument('--in-flight', type=int, default=50)
+    args = parser.parse_args()
+    run(args.records, args.delay, args.in_flight)
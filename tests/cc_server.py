@@ -0,0 +1,200 @@
+"""
+Offline stand-in for the Common Crawl data server. Serves files from a local
+directory over HTTP/1.1 (keep-alive) and honours single byte ranges, which is
+all the gathering code needs. Also contains helpers to write WARC files made
+up of one gzip member per record and cdx shards made up of gzip blocks, like
+the files Common Crawl publishes.
+"""
+import gzip
+import hashlib
+import base64
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)')
+
+WARC_HEADER = ('WARC/1.0\r\n'
+               'WARC-Type: response\r\n'
+               'WARC-Target-URI: {url}\r\n'
+               'WARC-Payload-Digest: sha1:{digest}\r\n'
+               'Content-Type: application/http; msgtype=response\r\n'
+               'Content-Length: {length}\r\n'
+               '\r\n')
+
+HTTP_HEADER = ('HTTP/1.1 200 OK\r\n'
+               'Content-Type: text/html; charset=UTF-8\r\n'
+               'Content-Length: {length}\r\n'
+               '\r\n')
+
+
+def page_digest(payload):
+    """
+    Computes a Common Crawl style digest (base32 encoded SHA-1).
+
+    :param payload: The payload bytes
+    :return: The digest as string
+    """
+    return base64.b32encode(hashlib.sha1(payload).digest()).decode('ascii')
+
+
+def make_record(url, html):
+    """
+    Creates an uncompressed WARC response record for a HTML page.
+
+    :param url: The target URI of the record
+    :param html: The HTML page, as string
+    :return: The record as bytes
+    """
+    payload = html.encode('utf-8')
+    http = HTTP_HEADER.format(length=len(payload)).encode('ascii') + payload
+    header = WARC_HEADER.format(url=url, digest=page_digest(payload),
+                                length=len(http))
+    return header.encode('ascii') + http + b'\r\n\r\n'
+
+
+def write_warc(directory, filename, pages):
+    """
+    Writes a WARC file with one gzip member per page and returns the
+    CDX-like indices pointing into it.
+
+    :param directory: The directory acting as data root
+    :param filename: Path of the WARC file, relative to directory
+    :param pages: A list of (url, html) tuples
+    :return: A list of index dictionaries, in file order
+    """
+    path = os.path.join(directory, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    indices = []
+    with open(path, 'wb') as f:
+        for url, html in pages:
+            member = gzip.compress(make_record(url, html))
+            indices.append({'digest': page_digest(html.encode('utf-8')),
+                            'filename': filename,
+                            'offset': str(f.tell()),
+                            'length': str(len(member))})
+            f.write(member)
+    return indices
+
+
+def write_cdx_shard(directory, filename, lines, block_lines):
+    """
+    Writes a cdx shard as gzip blocks of block_lines lines each and returns
+    the cluster.idx lines of the blocks.
+
+    :param directory: The directory acting as data root
+    :param filename: Name of the shard, relative to directory
+    :param lines: Sorted cdx lines, starting with the SURT key and timestamp
+    :param block_lines: Number of lines per gzip block
+    :return: A list of cluster.idx lines, without line endings
+    """
+    path = os.path.join(directory, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cluster = []
+    with open(path, 'wb') as f:
+        for i in range(0, len(lines), block_lines):
+            block = lines[i:i + block_lines]
+            member = gzip.compress(''.join(l + '\n' for l in block)
+                                   .encode('utf-8'))
+            key = ' '.join(block[0].split(' ', 2)[:2])
+            cluster.append('{}\t{}\t{}\t{}\t{}'.format(
+                key, filename, f.tell(), len(member), len(cluster) + 1))
+            f.write(member)
+    return cluster
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if server.delay:
+                time.sleep(server.delay)
+            with server.lock:
+                throttle = server.throttle > 0
+                server.throttle -= throttle
+            if throttle:
+                self.send_error(503)
+                return
+            self._send_file()
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _send_file(self):
+        path = os.path.join(self.server.root, self.path.lstrip('/'))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2) or len(data) - 1)
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, start + len(body) - 1, len(data)))
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        # Keep the test output clean
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server serving a local directory as if it were the Common
+    Crawl data bucket. Keeps request statistics, and can simulate network
+    latency by delaying every response and throttling by answering the next
+    throttle requests with 503.
+    """
+    daemon_threads = True
+
+    def __init__(self, root, delay=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.root = root
+        self.delay = delay
+        self.throttle = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.bytes_sent = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(*self.server_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def handle_error(self, request, client_address):
+        # Clients abort streamed transfers, that is not an error
+        pass
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,26 @@
+import pytest
+
+from tests.cc_server import StandInServer
+from urbansearch.gathering import rate_control
+
+
+@pytest.fixture
+def cc_data(tmpdir):
+    """ Empty directory acting as a local copy of the Common Crawl data. """
+    return str(tmpdir.mkdir('cc_data'))
+
+
+@pytest.fixture
+def cc_server(cc_data):
+    """ Stand-in Common Crawl data server serving the cc_data directory. """
+    server = StandInServer(cc_data).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def rate_controller():
+    """ Fresh shared rate controller, so no test inherits a lowered limit. """
+    rate_control._shared = None
+    yield
+    rate_control._shared = None
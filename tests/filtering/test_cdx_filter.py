@@ -0,0 +1,74 @@
+import pytest
+
+from urbansearch.filtering import cdx_filter
+
+
+def _index(**metadata):
+    index = {'digest': 'A', 'filename': 'a.warc.gz', 'offset': '0',
+             'length': '1000', 'mime': 'text/html',
+             'mime-detected': 'text/html', 'languages': 'nld',
+             'url': 'http://www.delft.nl/'}
+    index.update(metadata)
+    return index
+
+
+def test_from_config_disabled():
+    assert cdx_filter.from_config() is None
+
+
+def test_inactive():
+    f = cdx_filter.CdxFilter()
+    assert not f.active
+    assert f.keys == ()
+    assert f.check(_index()) is None
+
+
+@pytest.mark.parametrize('metadata, rule', [
+    ({}, None),
+    ({'length': '5000'}, 'length'),
+    ({'mime-detected': 'application/pdf'}, 'mime'),
+    ({'mime-detected': 'text/plain'}, None),
+    ({'mime-detected': 'text/plain', 'mime': 'image/png'}, None),
+    ({'languages': 'eng,deu'}, 'language'),
+    ({'languages': 'eng,nld'}, None),
+    ({'url': 'http://www.delft.com/'}, 'url_include'),
+    ({'url': 'http://www.delft.nl/image.jpg'}, 'url_exclude'),
+])
+def test_check(metadata, rule):
+    f = cdx_filter.CdxFilter(mimes=['text/*', 'application/xhtml+xml'],
+                             languages=['nld'], url_include=[r'\.nl/'],
+                             url_exclude=[r'\.jpg$', r'/login'],
+                             max_length=2000)
+    assert f.check(_index(**metadata)) == rule
+
+
+def test_check_missing_metadata():
+    f = cdx_filter.CdxFilter(mimes=['text/html'], languages=['nld'],
+                             url_include=['delft'])
+    assert f.check({'digest': 'A', 'length': '10'}) is None
+
+
+def test_filter():
+    f = cdx_filter.CdxFilter(mimes=['text/html'], languages=['nld'])
+    indices = [_index(), _index(mime='image/png', **{'mime-detected': ''}),
+               _index(languages='eng'), _index(languages='eng')]
+    accepted = list(f.filter(indices))
+
+    assert accepted == [{'digest': 'A', 'filename': 'a.warc.gz',
+                         'offset': '0', 'length': '1000',
+                         'url': 'http://www.delft.nl/'}]
+    assert f.stats() == {'length': 0, 'mime': 1, 'language': 2,
+                         'url_include': 0, 'url_exclude': 0, 'passed': 1}
+
+
+def test_filter_flushes(monkeypatch):
+    monkeypatch.setattr(cdx_filter, 'FLUSH_INTERVAL', 2)
+    f = cdx_filter.CdxFilter(max_length=10)
+    long_index = _index(length='100')
+    indices = f.filter([long_index, long_index, _index(length='10'),
+                        long_index])
+    next(indices)
+    assert f.stats()['length'] == 2
+    list(indices)
+    assert f.stats()['length'] == 3
+    assert f.stats()['passed'] == 1
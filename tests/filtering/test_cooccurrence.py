@@ -1,4 +1,8 @@
+import random
+import re
+
 import pytest
+from unittest.mock import patch
 import os
 import config
 from urbansearch.filtering import cooccurrence
@@ -74,3 +78,264 @@ def test_exclude_lowercase():
     expected = None
     actual = c.check('amsterdam en rotterdam zijn zo verkeerd geschreven')
     assert actual == expected
+
+
+def test_may_cooccur():
+    html = b'<p>Rotterdam</p> en <b>Den Haag</b>'
+    assert c.may_cooccur(html)
+    assert c.may_cooccur(memoryview(html))
+    assert c.may_cooccur(html.decode())
+
+
+def test_may_cooccur_single_city():
+    assert not c.may_cooccur(b'<p>Rotterdam, Rotterdam en Rotterdammers</p>')
+    assert not c.may_cooccur(b'<p>Caf\xc3\xa9</p>')
+    assert not c.may_cooccur(None)
+
+
+def test_may_cooccur_superset():
+    # Amsterdam and Amsterdam Zuidoost share their probe
+    assert c.check('Amsterdam') is None
+    assert c.may_cooccur(b'Amsterdam')
+
+
+def test_may_cooccur_non_ascii():
+    checker = cooccurrence.CoOccurrenceChecker(cities=['Den Haag', 'Éé',
+                                                       'À'])
+    assert checker.may_cooccur(b'nothing')
+
+
+def test_may_cooccur_encoded():
+    checker = cooccurrence.CoOccurrenceChecker(cities=["'s-Hertogenbosch",
+                                                       'Sint-Oedenrode'])
+    page = "'s-Hertogenbosch en Sint-Oedenrode"
+    assert checker.check(page)
+    assert checker.may_cooccur(page.encode('utf-8'))
+
+
+CITIES = ['Delft', 'De Bilt', 'Utrecht']
+
+
+@pytest.fixture
+def automata(monkeypatch):
+    # Automata loaded by earlier tests are forgotten
+    monkeypatch.setattr(cooccurrence, '_automata', {})
+
+
+def test_cache_key():
+    assert cooccurrence.cache_key(CITIES) == \
+        cooccurrence.cache_key(CITIES[::-1] + CITIES[:1])
+    assert cooccurrence.cache_key(CITIES) != \
+        cooccurrence.cache_key(CITIES[:2])
+
+
+def test_automata_shared_in_process(automata):
+    a = cooccurrence.CoOccurrenceChecker(CITIES, cache_dir='')
+    b = cooccurrence.CoOccurrenceChecker(CITIES, cache_dir='')
+    assert a.automaton is b.automaton
+
+
+@patch('urbansearch.filtering.cooccurrence.db_utils')
+def test_automata_cached(mock_db, automata, tmpdir):
+    mock_db.city_names.return_value = CITIES
+    cooccurrence.CoOccurrenceChecker(cache_dir=str(tmpdir))
+    assert os.listdir(str(tmpdir)) == [cooccurrence.CACHE_FILE]
+
+    cooccurrence._automata.clear()
+    mock_db.reset_mock()
+    with patch('urbansearch.filtering.cooccurrence._build') as mock_build:
+        checker = cooccurrence.CoOccurrenceChecker(cache_dir=str(tmpdir))
+    assert not mock_build.called
+    assert not mock_db.city_names.called
+    assert checker.check('Delft en De Bilt') == ['Delft', 'De Bilt']
+    assert checker.may_cooccur(b'Delft en De Bilt')
+
+
+@patch('urbansearch.filtering.cooccurrence.db_utils')
+def test_city_list_not_cached(mock_db, automata, tmpdir):
+    mock_db.city_names.return_value = CITIES
+    cooccurrence.CoOccurrenceChecker(['Leiden', 'Gouda'],
+                                     cache_dir=str(tmpdir))
+    assert os.listdir(str(tmpdir)) == []
+
+    # A later checker of the default cities doesn't get the list
+    checker = cooccurrence.CoOccurrenceChecker(cache_dir=str(tmpdir))
+    assert checker.cities == CITIES
+    assert os.listdir(str(tmpdir)) == [cooccurrence.CACHE_FILE]
+
+
+@patch('urbansearch.filtering.cooccurrence.db_utils')
+def test_build_cache(mock_db, automata, tmpdir):
+    mock_db.city_names.return_value = CITIES
+    path = cooccurrence.build_cache(str(tmpdir))
+    assert os.path.basename(path) == cooccurrence.CACHE_FILE
+
+    mock_db.reset_mock()
+    checker = cooccurrence.CoOccurrenceChecker(cache_dir=str(tmpdir))
+    assert not mock_db.city_names.called
+    assert checker.cities == CITIES
+
+
+@patch('urbansearch.filtering.cooccurrence.db_utils')
+def test_empty_cache_uses_database(mock_db, automata, tmpdir):
+    mock_db.city_names.return_value = CITIES
+    checker = cooccurrence.CoOccurrenceChecker(cache_dir=str(tmpdir))
+    assert checker.cities == CITIES
+    assert len(os.listdir(str(tmpdir))) == 1
+
+
+@patch('urbansearch.filtering.cooccurrence.db_utils')
+def test_other_version_ignored(mock_db, automata, tmpdir):
+    mock_db.city_names.return_value = CITIES
+    path = cooccurrence.build_cache(str(tmpdir))
+    with patch('urbansearch.filtering.cooccurrence.CACHE_VERSION',
+               cooccurrence.CACHE_VERSION + 1):
+        assert cooccurrence._load(path) is None
+
+
+@patch('urbansearch.filtering.cooccurrence.db_utils')
+def test_unreadable_cache_rebuilt(mock_db, automata, tmpdir):
+    mock_db.city_names.return_value = CITIES
+    path = cooccurrence.build_cache(str(tmpdir))
+    with open(path, 'wb') as f:
+        f.write(b'broken')
+    checker = cooccurrence.CoOccurrenceChecker(cache_dir=str(tmpdir))
+    assert checker.check('Delft en Utrecht') == ['Delft', 'Utrecht']
+
+
+def test_check_many():
+    pages = ['Amsterdam and Rotterdam',
+             'Only Rotterdam',
+             'Den Haag, Rotterdam, Den Haag']
+    matrix = c.check_many(pages)
+
+    assert matrix.shape == (3, len(c.columns))
+    for page, row in zip(pages, matrix.toarray()):
+        cities = [city for city, i in c.columns.items() if row[i]]
+        assert sorted(cities) == sorted(c.check(page) or [])
+    assert matrix.max() == 1
+
+
+def test_check_many_counts():
+    matrix = c.check_many(['Den Haag, Rotterdam, Den Haag'], counts=True)
+    assert matrix[0, c.columns['Den Haag']] == 2
+    assert matrix[0, c.columns['Rotterdam']] == 1
+
+
+def test_check_many_no_pages():
+    assert c.check_many([]).shape == (0, len(c.columns))
+
+
+def test_check_many_type_error():
+    with pytest.raises(TypeError):
+        c.check_many([b'Amsterdam'])
+
+
+def test_pair_counts():
+    matrix = c.check_many(['Amsterdam and Rotterdam',
+                           'Rotterdam and Den Haag and Amsterdam',
+                           'Den Haag, Rotterdam, Den Haag'], counts=True)
+    pairs = cooccurrence.pair_counts(matrix)
+
+    a, r, d = (c.columns[city] for city in ('Amsterdam', 'Rotterdam',
+                                            'Den Haag'))
+    assert pairs[a, r] == pairs[r, a] == 2
+    assert pairs[d, r] == 2
+    assert pairs[r, r] == 3
+
+
+BOUNDARY_CITIES = ['Ee', 'Een', 'Bommel', 'Delft', 'Amsterdam',
+                   'Amsterdam Zuidoost', 'Zuidoost', 'Den Haag', 'Haag',
+                   "'s-Hertogenbosch", 'Bergen op Zoom']
+boundary = cooccurrence.CoOccurrenceChecker(BOUNDARY_CITIES, cache_dir='')
+
+
+@pytest.mark.parametrize('page, expected', [
+    # Leading and trailing word boundaries
+    ('ZaltBommel en Delft', ['Delft']),
+    ('Delftse Bommel', ['Bommel']),
+    ('Delft2 en 3Bommel', []),
+    ('Delft en Bommel', ['Delft', 'Bommel']),
+    ('(Delft),Bommel.', ['Delft', 'Bommel']),
+    ('Delft_Bommel', []),
+    ('Delft-Bommel', ['Delft', 'Bommel']),
+    ('\u201cDelft\u201d\xa0Bommel\u2026', ['Delft', 'Bommel']),
+    ('Delft\u00e9 Bommel', ['Bommel']),
+    ('Een Ee in Eeklo', ['Een', 'Ee']),
+    # Names that don't start or end with a letter
+    ("'s-Hertogenbosch en Delft", ["'s-Hertogenbosch", 'Delft']),
+    ("d's-Hertogenbosch", []),
+    # Overlapping names, the leftmost longest is taken
+    ('Amsterdam Zuidoost', ['Amsterdam Zuidoost']),
+    ('Den Haag Zuidoost', ['Den Haag', 'Zuidoost']),
+    ('Haag en Den Haag', ['Haag', 'Den Haag']),
+    ('Amsterdam Amsterdam Zuidoost', ['Amsterdam', 'Amsterdam Zuidoost']),
+    ('Bergen op Bergen op Zoom', ['Bergen op Zoom']),
+    ('Den Den Haag', ['Den Haag']),
+    # Adjacent names share the separator
+    ('Delft Bommel Delft', ['Delft', 'Bommel', 'Delft']),
+    ('', []),
+])
+def test_mentions(page, expected):
+    assert list(boundary._mentions(page)) == expected
+
+
+def _reference_mentions(cities, page):
+    # Slow reference: a regular expression per city, matching whole words,
+    # and the leftmost longest of overlapping matches
+    matches = []
+    for city in cities:
+        pattern = re.compile(r'(?<!\w){0}(?!\w)'.format(re.escape(city)))
+        for start in range(len(page)):
+            m = pattern.match(page, start)
+            if m:
+                matches.append((start, -len(city), city))
+    result = []
+    last = 0
+    for start, length, city in sorted(matches):
+        if start >= last:
+            result.append(city)
+            last = start - length
+    return result
+
+
+def test_mentions_match_reference():
+    rnd = random.Random(42)
+    tokens = BOUNDARY_CITIES + ['Eeklo', 'Amsterdammers', 'NieuwAmsterdam',
+                                'Den', 'den', 's', 'op', 'Zoom', 'Delft1',
+                                'é', 'Ée']
+    separators = [' ', ', ', '-', "'", '. ', '  ', '_', '\n', '']
+    for _ in range(300):
+        page = ''.join(rnd.choice(tokens) + rnd.choice(separators)
+                       for _ in range(rnd.randint(1, 12)))
+        assert list(boundary._mentions(page)) == \
+            _reference_mentions(BOUNDARY_CITIES, page), page
+
+
+def test_matches_positions():
+    page = 'In Den Haag en Delft'
+    assert [page[start:end] for start, end, _ in boundary._matches(page)] \
+        == ['Den Haag', 'Delft']
+
+
+def test_check_snippets():
+    page = 'In Amsterdam en\n\nRotterdam wonen mensen, Amsterdam is groot'
+    occurrences, snippets = c.check_snippets(page, width=6)
+    assert occurrences == c.check(page)
+    # Whitespace is collapsed after taking the context
+    assert snippets == {'Amsterdam': ['In Amsterdam en R',
+                                      'nsen, Amsterdam is gr'],
+                        'Rotterdam': ['m en Rotterdam wonen']}
+
+
+def test_check_snippets_limit():
+    page = ' '.join(['Amsterdam Rotterdam'] * 10)
+    _, snippets = c.check_snippets(page, width=0, limit=2)
+    assert snippets == {'Amsterdam': ['Amsterdam'] * 2,
+                        'Rotterdam': ['Rotterdam'] * 2}
+
+
+def test_check_snippets_no_cooccurrence():
+    assert c.check_snippets('Amsterdam en Amsterdam') == (None, None)
+    with pytest.raises(TypeError):
+        c.check_snippets(None)
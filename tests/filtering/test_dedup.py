@@ -0,0 +1,121 @@
+from multiprocessing import Process
+from unittest.mock import patch
+
+from urbansearch.filtering import dedup
+
+
+def _index(digest):
+    return {'digest': digest, 'filename': 'a.warc.gz', 'offset': '0',
+            'length': '1000'}
+
+
+def test_from_config_disabled():
+    assert dedup.from_config() is None
+
+
+@patch('urbansearch.filtering.dedup.db_utils')
+@patch('config.get')
+def test_from_config_seeded(mock_config, mock_db):
+    mock_config.return_value = {'capacity': 100, 'seed_from_db': True}
+    mock_db.index_digests.return_value = ['A', 'B']
+
+    digests = dedup.from_config()
+
+    assert digests.seen('A')
+    assert not digests.seen('C')
+
+
+def test_size():
+    digests = dedup.DigestFilter(1000, 0.01)
+    # About 9.6 bits and 7 hashes per digest
+    assert 9500 < digests.bits < 9700
+    assert digests.hashes == 7
+
+
+def test_seen():
+    digests = dedup.DigestFilter(100)
+    assert not digests.seen('A')
+    # Checking does not remember the digest
+    assert not digests.seen('A')
+    digests.add(['A'])
+    assert digests.seen('A')
+    assert not digests.seen('B')
+    stats = digests.stats()
+    assert stats['checked'] == 4
+    assert stats['duplicates'] == 1
+    assert 0 < stats['fill'] < 1
+
+
+def test_error_rate():
+    digests = dedup.DigestFilter(2000, 0.01)
+    digests.seed('seed{0}'.format(i) for i in range(1000))
+    digests.add('new{0}'.format(i) for i in range(1000))
+    # The filter is at capacity
+    false_positives = sum(digests.seen('other{0}'.format(i))
+                          for i in range(1000))
+    assert false_positives < 20
+
+
+def test_filter():
+    digests = dedup.DigestFilter(100)
+    digests.add(['C'])
+    indices = [_index('A'), _index('B'), _index('A'), {'filename': 'x'},
+               _index('C')]
+    assert list(digests.filter(indices)) == indices[:2] + indices[3:4]
+    assert digests.stats()['duplicates'] == 2
+    # The yielded digests are not remembered
+    assert list(digests.filter(indices[:1])) == indices[:1]
+
+
+def _add(digests, digest):
+    digests.add([digest])
+    digests.commit()
+
+
+def test_shared_with_forked_processes():
+    digests = dedup.DigestFilter(100)
+    worker = Process(target=_add, args=(digests, 'A'))
+    worker.start()
+    worker.join()
+    assert digests.seen('A')
+    assert digests.stats()['checked'] == 1
+
+
+def test_exact_set_corrects_false_positives(tmpdir):
+    # A filter of a single bit takes every digest for a seen one
+    digests = dedup.DigestFilter(1, 0.5, str(tmpdir.join('digests.db')))
+    digests.bits = 1
+    digests.add(['A'])
+    assert not digests.seen('B')
+    assert digests.seen('A')
+    stats = digests.stats()
+    assert stats['false_positives'] == 1
+    assert stats['duplicates'] == 1
+
+
+def test_exact_set_kept_over_restarts(tmpdir):
+    path = str(tmpdir.join('digests.db'))
+    digests = dedup.DigestFilter(100, path=path)
+    digests.add(['A'])
+    digests.commit()
+    digests.add(['B'])
+    # B was not committed before the restart
+    digests = dedup.DigestFilter(100, path=path)
+    assert digests.seen('A')
+    assert not digests.seen('B')
+
+
+def test_exact_set_shared_with_forked_processes(tmpdir):
+    path = str(tmpdir.join('digests.db'))
+    digests = dedup.DigestFilter(100, path=path)
+    digests.add(['A'])
+    worker = Process(target=_add, args=(digests, 'B'))
+    worker.start()
+    worker.join()
+    assert digests.seen('A')
+    assert digests.seen('B')
+    assert digests.stats()['false_positives'] == 0
+    # Only the digests committed by the worker are kept
+    digests = dedup.DigestFilter(100, path=path)
+    assert not digests.seen('A')
+    assert digests.seen('B')
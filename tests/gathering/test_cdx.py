@@ -0,0 +1,121 @@
+import gzip
+import os
+import types
+
+import pytest
+
+import config
+from urbansearch.gathering import cdx
+from urbansearch.utils import gz_utils
+
+LINES = [
+    'nl,tudelft)/ 20170323161043 {"url": "http://www.tudelft.nl/", '
+    '"status": "200", "digest": "A", "length": "10", "offset": "0", '
+    '"filename": "a.warc.gz"}',
+    'nl,tudelft)/x 20170323161043 {"url": "http://www.tudelft.nl/x", '
+    '"status": "404", "digest": "B", "length": "10", "offset": "10", '
+    '"filename": "a.warc.gz"}',
+    '{"url": "http://www.delft.nl/", "status": "200", "digest": "C", '
+    '"length": "10", "offset": "20", "filename": "a.warc.gz"}',
+    '{"url": "broken", "status": "200", "digest": ',
+]
+
+
+def _write_gz(tmpdir, lines):
+    path = os.path.join(str(tmpdir), 'cdx-00000.gz')
+    with gzip.open(path, 'wt') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def test_useful_line():
+    assert cdx.useful_line(LINES[0])
+    assert not cdx.useful_line(LINES[1])
+    assert not cdx.useful_line('')
+
+
+def test_parse_line_prefixed():
+    assert cdx.parse_line(LINES[0])['digest'] == 'A'
+    assert cdx.parse_line(LINES[2])['digest'] == 'C'
+
+
+def test_parse_index():
+    assert cdx.parse_index(LINES[0]) == {'digest': 'A', 'length': '10',
+                                         'offset': '0',
+                                         'filename': 'a.warc.gz'}
+
+
+def test_parse_index_status():
+    assert cdx.parse_index(LINES[1]) is None
+    assert cdx.parse_index('') is None
+
+
+def test_parse_index_extra():
+    line = ('{"urlkey": "nl,0-0)/", "status": "200", "mime": "text/html", '
+            '"languages": "nld,eng", "filename": "f", "length": "1", '
+            '"offset": "2", "digest": "D"}')
+    index = cdx.parse_index(line, extra=('mime', 'languages'))
+    assert index['mime'] == 'text/html'
+    assert index['languages'] == 'nld,eng'
+    assert 'mime' not in cdx.parse_index(line)
+
+
+def test_parse_index_escaped():
+    line = ('{"url": "http://a.nl/\\"x\\"/caf\\u00e9", "status": "200", '
+            '"filename": "f", "length": "1", "offset": "2", "digest": "D"}')
+    index = cdx.parse_index(line, extra=('url',))
+    assert index['url'] == 'http://a.nl/"x"/caf\u00e9'
+    assert index['digest'] == 'D'
+    assert 'url' not in cdx.parse_index(line)
+
+
+def test_parse_index_malformed():
+    with pytest.raises(ValueError):
+        cdx.parse_index(LINES[3])
+
+
+def test_parse_index_equals_json():
+    path = os.path.join(config.get('resources', 'test'), 'indices.txt')
+    with open(path) as f:
+        for line in f:
+            full = cdx.parse_line(line)
+            expected = {k: full[k] for k in cdx.INDEX_KEYS}
+            assert cdx.parse_index(line) == expected
+
+
+def test_iter_gz_indices(tmpdir):
+    indices = cdx.iter_gz_indices(_write_gz(tmpdir, LINES))
+    assert isinstance(indices, types.GeneratorType)
+    assert [i['digest'] for i in indices] == ['A', 'C']
+    assert 'url' not in next(cdx.iter_gz_indices(_write_gz(tmpdir, LINES)))
+
+
+def test_iter_gz_indices_full(tmpdir):
+    indices = list(cdx.iter_gz_indices(_write_gz(tmpdir, LINES), full=True))
+    assert [i['url'] for i in indices] == ['http://www.tudelft.nl/',
+                                           'http://www.delft.nl/']
+
+
+def test_iter_gz_indices_resource():
+    path = os.path.join(config.get('resources', 'test'), 'domain-nl-0000.gz')
+    indices = list(cdx.iter_gz_indices(path))
+    assert len(indices) == 1
+    assert indices[0]['digest'] == '3I42H3S6NNFQ2MSVX7XZKYAYSCX5QBYJ'
+
+
+def test_iter_gz_indices_corrupt(tmpdir):
+    path = os.path.join(str(tmpdir), 'corrupt.gz')
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(LINES[0].encode())[:-12])
+    assert list(cdx.iter_gz_indices(path)) == []
+
+
+def test_iter_gz_indices_range(tmpdir):
+    path = os.path.join(str(tmpdir), 'cdx-00000.gz')
+    with open(path, 'wb') as f:
+        for line in LINES[:3]:
+            f.write(gzip.compress((line + '\n').encode('utf-8')))
+    ranges = gz_utils.split_members(path, 3)
+    assert len(ranges) == 3
+    assert [i['digest'] for r in ranges for i in cdx.iter_gz_indices(r)] == \
+        ['A', 'C']
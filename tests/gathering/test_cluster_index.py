@@ -0,0 +1,114 @@
+import json
+import os
+from queue import Queue
+
+import pytest
+
+from tests.cc_server import write_cdx_shard, write_warc
+from urbansearch.gathering import (cluster_index, gathering,
+                                   indices_selector, rate_control)
+
+DOMAINS = ['be', 'de', 'fr', 'nl', 'uk']
+
+
+def _cdx_line(domain, i, index=None):
+    surt = '{},site{:05d})/'.format(domain, i)
+    index = index or {'filename': 'test.warc.gz', 'offset': str(i),
+                      'length': '10', 'digest': 'D{}'.format(i)}
+    return '{} 20170430124049 {}'.format(surt, json.dumps(
+        dict({'url': 'http://site{}.{}/'.format(i, domain),
+              'status': '200'}, **index)))
+
+
+@pytest.fixture
+def cluster(cc_data):
+    lines = sorted(_cdx_line(d, i) for d in DOMAINS for i in range(2000))
+    idx = (write_cdx_shard(cc_data, 'cdx-00000.gz', lines[:5000], 100) +
+           write_cdx_shard(cc_data, 'cdx-00001.gz', lines[5000:], 100))
+    path = os.path.join(cc_data, 'cluster.idx')
+    with open(path, 'w') as f:
+        f.write('\n'.join(idx) + '\n')
+    return cluster_index.ClusterIndex(path, cc_data)
+
+
+def test_surt_prefixes():
+    assert cluster_index.surt_prefixes('nl') == ('nl,',)
+    assert cluster_index.surt_prefixes('www.TUDelft.nl') == \
+        ('nl,tudelft,www)', 'nl,tudelft,www,')
+
+
+def test_find_blocks(cluster):
+    blocks = cluster.find_blocks(['nl,'])
+    # 2000 keys in blocks of 100, plus the block before
+    assert 20 <= len(blocks) <= 21
+    assert [b.filename for b in blocks] == sorted(b.filename for b in blocks)
+    assert cluster.find_blocks(['zz,']) == cluster.blocks[-1:]
+    assert cluster.find_blocks(['aa,']) == []
+
+
+def test_find_blocks_single_site(cluster):
+    blocks = cluster.find_blocks(
+        cluster_index.surt_prefixes('site01234.nl'))
+    assert len(blocks) == 1
+    indices = list(cluster_index.iter_block_indices(
+        blocks[0], cluster_index.surt_prefixes('site01234.nl')))
+    assert [i['offset'] for i in indices] == ['1234']
+
+
+def test_iter_block_indices(cluster):
+    prefixes = ['nl,']
+    indices = [index for block in cluster.find_blocks(prefixes)
+               for index in cluster_index.iter_block_indices(block, prefixes)]
+    assert len(indices) == 2000
+    assert set(indices[0]) == {'filename', 'offset', 'length', 'digest'}
+
+
+def test_iter_block_indices_remote(cluster, cc_server):
+    prefixes = ['nl,']
+    blocks = [b._replace(location=cc_server.url)
+              for b in cluster.find_blocks(prefixes)]
+    indices = [index for block in blocks
+               for index in cluster_index.iter_block_indices(block, prefixes)]
+    assert len(indices) == 2000
+
+    shards = sum(os.path.getsize(os.path.join(cc_server.root, name))
+                 for name in ('cdx-00000.gz', 'cdx-00001.gz'))
+    assert cc_server.bytes_sent < 0.25 * shards
+
+
+def test_read_block_retries_throttled(cluster, cc_server):
+    block = cluster.find_blocks(['nl,'])[0]._replace(location=cc_server.url)
+    pd = gathering.PageDownloader()
+    pd.rate = rate_control.RateController(backoff_base=0.001)
+    cc_server.throttle = 2
+
+    assert cluster_index.read_block(block, pd)
+    assert cc_server.requests == 3
+    assert pd.rate.stats()['failures'] == 2
+
+
+def test_read_block_missing(cc_data):
+    block = cluster_index.ClusterBlock('nl,', cc_data, 'missing.gz', 0, 10)
+    assert cluster_index.read_block(block) is None
+
+
+def test_worker_blocks(cc_server, tmpdir):
+    pages = [('http://a.nl/', '<html><p>Delft en De Bilt</p></html>'),
+             ('http://b.nl/', '<html><p>Alleen Delft</p></html>')]
+    warc_indices = write_warc(cc_server.root, 'test.warc.gz', pages)
+    lines = [_cdx_line('nl', i, index) for i, index in enumerate(warc_indices)]
+    lines += [_cdx_line('uk', 0, warc_indices[0])]
+    cluster_lines = write_cdx_shard(str(tmpdir), 'cdx-00000.gz', lines, 1)
+    tmpdir.join('cluster.idx').write('\n'.join(cluster_lines))
+
+    cluster = cluster_index.ClusterIndex(str(tmpdir.join('cluster.idx')),
+                                         str(tmpdir))
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    queue = Queue()
+    ind_sel.worker(queue, cluster.find_blocks(['nl,']), prefixes=['nl,'])
+
+    assert queue.qsize() == 1
+    index, co_occ = queue.get()
+    assert index['offset'] == warc_indices[0]['offset']
+    assert co_occ == ['Delft', 'De Bilt']
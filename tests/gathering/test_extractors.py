@@ -0,0 +1,59 @@
+import pytest
+
+from urbansearch.gathering import extractors
+
+PAGES = [
+    '<html><body><p>Delft</p>  <p>en  Rotterdam</p></body></html>',
+    '<html>\r\n<head><title>T</title><style>p {}</style></head>\r\n'
+    '<body>a<script>var x = "<p>";</script>b</body>\r\n</html>\r\n',
+    '<p>Caf&eacute; &amp; &#233;&#x41; <br/>tekst</p>',
+    '<!DOCTYPE html><!-- commentaar --><pre>  \n  </pre><div>  \t </div>',
+    '<div>open <b>tags <i>zonder</div> eind',
+    '<p><![CDATA[data]]> na</p><?php echo 1; ?>',
+    '',
+]
+
+
+@pytest.mark.parametrize('html', PAGES)
+def test_stream_equals_soup(html):
+    stream = extractors.get_extractor('stream')
+    soup = extractors.get_extractor('soup')
+    assert stream.extract(html) == soup.extract(html)
+
+
+@pytest.mark.parametrize('html', PAGES)
+def test_stream_equals_soup_skip_tags(html):
+    skip_tags = ['head', 'script', 'link', 'meta', 'img', 'style', 'i']
+    stream = extractors.get_extractor('stream', skip_tags)
+    soup = extractors.get_extractor('soup', skip_tags)
+    assert stream.extract(html) == soup.extract(html)
+
+
+def test_extract_skips_script_and_style():
+    text = extractors.StreamExtractor().extract(PAGES[1])
+    assert 'var x' not in text
+    assert 'p {}' not in text
+    assert 'ab' in text
+
+
+def test_extract_bytes():
+    extractor = extractors.StreamExtractor()
+    html = '<p>Café</p>'
+    assert extractor.extract(html.encode('utf-8')) == 'Café'
+    assert extractor.extract(memoryview(html.encode('utf-8'))) == 'Café'
+    latin = html.encode('latin-1')
+    assert extractor.extract(latin) == extractors.SoupExtractor().extract(latin)
+
+
+def test_extract_unknown_entity():
+    extractor = extractors.StreamExtractor()
+    assert extractor.extract('<p>a &unknown; b</p>') == 'a &unknown; b'
+
+
+def test_get_extractor_config():
+    assert isinstance(extractors.get_extractor(), extractors.StreamExtractor)
+
+
+def test_get_extractor_unknown():
+    with pytest.raises(ValueError):
+        extractors.get_extractor('lxml')
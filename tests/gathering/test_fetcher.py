@@ -0,0 +1,161 @@
+import asyncio
+import base64
+import os
+from unittest.mock import patch
+
+import pytest
+
+import config
+from tests.cc_server import write_warc
+from urbansearch.gathering import fetcher, indices_selector, warc_cache
+
+WARC = 'crawl-data/segments/0/warc/test.warc.gz'
+PAGES = [('http://{}.nl/'.format(i),
+          '<html><body>Pagina {} over Delft en De Bilt</body></html>'
+          .format(i)) for i in range(20)]
+
+
+def test_fetch_iter(cc_server):
+    indices = write_warc(cc_server.root, WARC, PAGES)
+    f = fetcher.AsyncFetcher(max_in_flight=5, cc_data=cc_server.url)
+    results = list(f.fetch_iter(indices))
+    f.close()
+
+    assert len(results) == len(indices)
+    for index, data in results:
+        assert data.startswith(b'WARC/1.0')
+        assert PAGES[indices.index(index)][1].encode() in data
+
+
+def test_fetch_iter_reuses_connections(cc_server):
+    indices = write_warc(cc_server.root, WARC, PAGES)
+    f = fetcher.AsyncFetcher(max_connections=2, max_in_flight=10,
+                             cc_data=cc_server.url)
+    f.coalesce_gap = -1
+    list(f.fetch_iter(indices, batch_size=7))
+    f.close()
+
+    assert cc_server.requests == len(indices)
+    assert cc_server.max_active <= 2
+
+
+def test_fetch_iter_coalesces(cc_server):
+    indices = write_warc(cc_server.root, WARC, PAGES)
+    f = fetcher.AsyncFetcher(cc_data=cc_server.url)
+    f.coalesce_max_size = int(indices[5]['offset'])
+    results = list(f.fetch_iter(indices[::-1]))
+    f.close()
+
+    assert 1 < cc_server.requests < len(indices)
+    assert len(results) == len(indices)
+    assert all(data.startswith(b'WARC/1.0') for _, data in results)
+
+
+def test_fetch_many_bounded(cc_server):
+    cc_server.delay = 0.01
+    indices = write_warc(cc_server.root, WARC, PAGES)
+    f = fetcher.AsyncFetcher(max_connections=20, max_in_flight=3,
+                             cc_data=cc_server.url)
+    f.coalesce_gap = -1
+
+    async def collect():
+        results = []
+        async for result in f.fetch_many(indices):
+            results.append(result)
+        return results
+
+    loop = asyncio.new_event_loop()
+    results = loop.run_until_complete(collect())
+    loop.close()
+
+    assert len(results) == len(indices)
+    assert cc_server.max_active <= 3
+
+
+def test_fetch_iter_cached(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, WARC, PAGES)
+    cache = warc_cache.WarcCache(str(tmpdir.join('cache')), 2 ** 20)
+    f = fetcher.AsyncFetcher(cc_data=cc_server.url, cache=cache)
+    first = dict((i['offset'], d) for i, d in f.fetch_iter(indices))
+    requests_made = cc_server.requests
+    second = dict((i['offset'], d) for i, d in f.fetch_iter(indices))
+    f.close()
+
+    assert cc_server.requests == requests_made
+    assert second == first
+    assert cache.stats()['hits'] == len(indices)
+
+
+def test_fetch_iter_local(cc_data):
+    indices = write_warc(cc_data, WARC, PAGES)
+    f = fetcher.AsyncFetcher(cc_data=cc_data)
+    results = list(f.fetch_iter(indices))
+    f.close()
+
+    assert len(results) == len(indices)
+    for index, data in results:
+        assert PAGES[indices.index(index)][1].encode() in data
+
+
+def test_fetch_iter_streams_large_parts(cc_server):
+    large = ('http://groot.nl/', '<html><body>{}</body></html>'.format(
+        base64.b64encode(os.urandom(2 ** 20)).decode('ascii')))
+    indices = write_warc(cc_server.root, WARC, PAGES[:2] + [large])
+    f = fetcher.AsyncFetcher(cc_data=cc_server.url)
+    f.max_body_size = 1000
+
+    results = dict((i['offset'], data) for i, data in
+                   f.fetch_iter(indices))
+    f.close()
+
+    for (url, html), index in zip(PAGES[:2], indices):
+        assert html.encode() in results[index['offset']]
+    data = results[indices[2]['offset']]
+    assert len(data[data.index(b'<html'):]) == 1000
+    assert f.rate.stats()['bytes'] < int(indices[2]['length']) / 4
+
+
+def test_fetch_missing_file(cc_server):
+    f = fetcher.AsyncFetcher(cc_data=cc_server.url)
+    index = {'filename': 'missing.warc.gz', 'offset': '0', 'length': '10'}
+    results = list(f.fetch_iter([index]))
+    f.close()
+    assert results == [(index, None)]
+
+
+def test_fetch_connection_error():
+    f = fetcher.AsyncFetcher(cc_data='http://127.0.0.1:1/')
+    index = {'filename': 'some.warc.gz', 'offset': '0', 'length': '10'}
+    assert list(f.fetch_iter([index])) == [(index, None)]
+
+
+def test_indices_selector_with_fetcher(cc_server):
+    indices = write_warc(cc_server.root, WARC, PAGES[:3] + [
+        ('http://other.nl/', '<html><body>Alleen Delft</body></html>')])
+    f = fetcher.AsyncFetcher(cc_data=cc_server.url)
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'],
+                                               fetcher=f)
+    relevant = ind_sel._relevant_indices(indices, False, False)
+    f.close()
+    assert sorted(i['offset'] for i in relevant) == \
+        sorted(i['offset'] for i in indices[:3])
+
+
+def test_from_config_sync():
+    assert fetcher.from_config() is None
+
+
+def test_from_config_async():
+    get = config.get
+    with patch('config.get', side_effect=lambda entity, param: 'async'
+               if param == 'fetcher' else get(entity, param)):
+        f = fetcher.from_config()
+    assert isinstance(f, fetcher.AsyncFetcher)
+    assert f.max_in_flight == get('gathering', 'fetch_in_flight')
+
+
+@patch('config.get')
+def test_from_config_unknown(mock_config):
+    mock_config.return_value = 'threads'
+    with pytest.raises(ValueError):
+        fetcher.from_config()
@@ -1,3 +1,5 @@
+import base64
+import gzip
 import json
 import os
 import requests
@@ -5,7 +7,8 @@ import pytest
 from multiprocessing import Manager
 
 import config
-from urbansearch.gathering import gathering
+from tests.cc_server import make_record, write_warc
+from urbansearch.gathering import gathering, warc_cache
 
 pd = gathering.PageDownloader()
 
@@ -87,10 +90,149 @@ def test_worker_indices_from_gz_file():
     assert ind[0]['filename'] == exp
 
 
+def test_iter_indices_from_gz_file():
+    ind = pd.iter_indices_from_gz_file(
+        os.path.join(config.get('resources', 'test'), 'domain-nl-0000.gz'))
+    assert list(ind) == [{
+        'digest': '3I42H3S6NNFQ2MSVX7XZKYAYSCX5QBYJ',
+        'length': '621',
+        'offset': '808',
+        'filename': 'crawl-data/CC-MAIN-2017-17/segments/1492917125532.90/'
+                    'crawldiagnostics/CC-MAIN-20170423031205-00548-ip-10-'
+                    '145-167-34.ec2.internal.warc.gz'}]
+
+
 def test_download_warc_part_none():
     assert pd.download_warc_part(None) is None
 
 
+def test_download_warc_parts(cc_server):
+    pages = [('http://{}.nl/'.format(i), '<html>Pagina {}</html>'.format(i))
+             for i in range(5)]
+    indices = write_warc(cc_server.root, 'test.warc.gz', pages)
+    indices.append({'filename': 'missing.warc.gz', 'offset': '0',
+                    'length': '10'})
+    downloader = gathering.PageDownloader()
+    downloader.cc_data_prefix = cc_server.url
+
+    parts = list(downloader.download_warc_parts(indices))
+    assert cc_server.requests == 2
+    assert [index for index, _ in parts] == indices
+    for (url, html), (_, data) in zip(pages, parts):
+        assert html.encode() in data
+    assert parts[-1][1] is None
+
+
+def test_download_warc_parts_cached(cc_server, tmpdir):
+    pages = [('http://{}.nl/'.format(i), '<html>Pagina {}</html>'.format(i))
+             for i in range(5)]
+    indices = write_warc(cc_server.root, 'test.warc.gz', pages)
+    downloader = gathering.PageDownloader()
+    downloader.cc_data_prefix = cc_server.url
+    downloader.cache = warc_cache.WarcCache(str(tmpdir.join('cache')),
+                                            2 ** 20)
+
+    first = list(downloader.download_warc_parts(indices))
+    requests_made = cc_server.requests
+    second = list(downloader.download_warc_parts(indices))
+
+    assert cc_server.requests == requests_made
+    assert second == first
+    assert downloader.download_warc_part(indices[0]) == first[0][1]
+    assert cc_server.requests == requests_made
+    assert downloader.cache.stats()['hits'] == len(indices) + 1
+
+
+def test_download_warc_parts_local(cc_data):
+    pages = [('http://{}.nl/'.format(i), '<html>Pagina {}</html>'.format(i))
+             for i in range(5)]
+    indices = write_warc(cc_data, 'crawl-data/test.warc.gz', pages)
+    downloader = gathering.PageDownloader()
+    downloader.cc_data_prefix = cc_data
+
+    parts = list(downloader.download_warc_parts(indices[::-1]))
+    assert [index for index, _ in parts] == indices
+    for (url, html), (_, data) in zip(pages, parts):
+        assert html.encode() in data
+    assert downloader.download_warc_part(indices[2]) == parts[2][1]
+
+
+def _large_page(size):
+    # Barely compressible page, so its compressed part is large as well
+    return '<html><body>{}</body></html>'.format(
+        base64.b64encode(os.urandom(size)).decode('ascii'))
+
+
+def test_download_warc_part_streamed(cc_server, tmpdir):
+    pages = [('http://groot.nl/', _large_page(2 ** 20)),
+             ('http://klein.nl/', '<html>Delft</html>')]
+    indices = write_warc(cc_server.root, 'test.warc.gz', pages)
+    downloader = gathering.PageDownloader()
+    downloader.cc_data_prefix = cc_server.url
+    downloader.max_body_size = 1000
+    downloader.cache = warc_cache.WarcCache(str(tmpdir.join('cache')),
+                                            2 ** 22)
+
+    data = downloader.download_warc_part(indices[0])
+    body = data[data.index(b'<html'):]
+    assert len(body) == 1000
+    assert pages[0][1].encode().startswith(bytes(body))
+    # The transfer was aborted long before the end of the part
+    assert downloader.rate.stats()['bytes'] < int(indices[0]['length']) / 4
+    assert downloader.cache.get(indices[0]) is None
+
+    # Complete parts are cached
+    assert b'Delft' in downloader.download_warc_part(indices[1])
+    assert downloader.cache.get(indices[1]) is not None
+
+
+def test_download_warc_parts_streams_large_parts(cc_server):
+    pages = [('http://{}.nl/'.format(i), '<html>Pagina {}</html>'.format(i))
+             for i in range(4)]
+    pages.insert(2, ('http://groot.nl/', _large_page(2 ** 18)))
+    indices = write_warc(cc_server.root, 'test.warc.gz', pages)
+    downloader = gathering.PageDownloader()
+    downloader.cc_data_prefix = cc_server.url
+    downloader.max_body_size = 1000
+
+    parts = list(downloader.download_warc_parts(indices))
+
+    assert [index for index, _ in parts] == indices
+    assert cc_server.requests == 3
+    for (url, html), (_, data) in zip(pages, parts):
+        assert html.encode()[:1000] in data
+    assert len(parts[2][1]) < 2000
+
+
+def test_uncompress_gz():
+    member = gzip.compress(b'WARC/1.0')
+    assert pd._uncompress_gz(memoryview(member)) == b'WARC/1.0'
+    assert pd._uncompress_gz(member * 2) == b'WARC/1.0' * 2
+    assert pd._uncompress_gz(member[:-4]) is None
+    assert pd._uncompress_gz(b'WARC/1.0') is None
+
+
+def test_uncompress_gz_max_body():
+    record = make_record('http://a.nl/', '<html>Caf\u00e9 Delft</html>')
+    data = pd._uncompress_gz(gzip.compress(record), max_body=10)
+    assert data == record[:record.index(b'<html>') + 10]
+    assert pd.warc_html_to_text(data) == 'Caf'
+
+
+def test_warc_html_to_text_record():
+    # The body of a decoded part is used as is, without looking for <html
+    record = make_record('http://a.nl/', '<p>Delft</p>')
+    data = pd._uncompress_gz(gzip.compress(record))
+    assert pd.warc_html_to_text(data).strip() == 'Delft'
+
+
+def test_index_to_txt_wet():
+    index = {'digest': 'A', 'filename': 'a.warc.wet.gz', 'offset': '0',
+             'length': '10', 'source': 'wet'}
+    with pytest.raises(ValueError):
+        pd.index_to_txt(index)
+
+
 def test_index_to_txt():
     with open(os.path.join(config.get('resources', 'test'),
                            'text_output.txt'), "r") as text_file:
@@ -135,6 +277,21 @@ def test_run_worker():
     assert int(index['offset']) == 727926652
 
 
+def test_run_workers_each_file_once(tmpdir):
+    directory = tmpdir.mkdir('indices')
+    for n in range(5):
+        with gzip.open(str(directory.join('{}.gz'.format(n))), 'wt') as f:
+            f.write('nl,a)/ 2017 {"status": "200", "digest": "D' + str(n) +
+                    '", "length": "1", "offset": "0", "filename": "w"}\n')
+    queue = Manager().Queue()
+    pd.run_workers(2, str(directory), queue)
+
+    digests = []
+    while not queue.empty():
+        digests.append(queue.get_nowait()['digest'])
+    assert sorted(digests) == ['D0', 'D1', 'D2', 'D3', 'D4']
+
+
 def test_run_2_workers():
     man = Manager()
     queue = man.Queue()
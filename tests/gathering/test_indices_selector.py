@@ -1,7 +1,12 @@
+import gzip
+import json
 import os
 from multiprocessing import Manager
 
+from tests.cc_server import write_warc
+from urbansearch.filtering import cdx_filter, dedup
 from urbansearch.gathering import indices_selector
+from urbansearch.utils import checkpoint_utils
 import config
 
 
@@ -37,6 +42,259 @@ def test_relevant_indices_from_dir():
     assert int(relevant[0]['offset']) in [727926652, 808]
 
 
+def test_relevant_texts_from_file(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://a.nl/', '<html><p>Delft en De Bilt</p></html>'),
+        ('http://b.nl/', '<html><p>Alleen Delft</p></html>'),
+        ('http://c.nl/', '<html><p>Delft, <b>De Bilt</b></p></html>')])
+    _file = tmpdir.join('indices.txt')
+    _file.write('\n'.join('{"status": "200", ' + json.dumps(i)[1:]
+                           for i in indices))
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    texts = list(ind_sel.relevant_texts_from_file(str(_file)))
+
+    assert [index['offset'] for index, _, _, _ in texts] == \
+        [indices[0]['offset'], indices[2]['offset']]
+    assert texts[1][1] == ['Delft', 'De Bilt']
+    assert texts[1][2].strip() == 'Delft, De Bilt'
+
+
+def test_worker_snippets(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://a.nl/', '<html><p>Van Delft naar De Bilt</p></html>'),
+        ('http://b.nl/', '<html><p>Alleen Delft</p></html>')])
+    _file = tmpdir.join('indices.txt')
+    _file.write('\n'.join('{"status": "200", ' + json.dumps(i)[1:]
+                           for i in indices))
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'],
+                                               snippet_width=4)
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    queue = Manager().Queue()
+    ind_sel.worker(queue, [str(_file)])
+
+    index, co_occ, snippets = queue.get_nowait()
+    assert index['offset'] == indices[0]['offset']
+    assert co_occ == ['Delft', 'De Bilt']
+    assert snippets == {'Delft': ['Van Delft naa'],
+                        'De Bilt': ['aar De Bilt']}
+    assert queue.empty()
+
+
+def test_relevant_indices_cdx_filter(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://a.nl/', '<html><p>Delft en De Bilt</p></html>'),
+        ('http://b.nl/', '<html><p>Delft en De Bilt</p></html>')])
+    mimes = ['text/html', 'application/pdf']
+    _file = tmpdir.join('indices.gz')
+    with gzip.open(str(_file), 'wt') as f:
+        for index, mime in zip(indices, mimes):
+            f.write('{"status": "200", "mime": "' + mime + '", ' +
+                    json.dumps(index)[1:] + '\n')
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    ind_sel.page_downloader.coalesce_gap = -1
+    ind_sel.cdx_filter = cdx_filter.CdxFilter(mimes=['text/html'])
+    relevant = ind_sel.relevant_indices_from_file(str(_file))
+
+    assert relevant == [indices[0]]
+    assert cc_server.requests == 1
+    assert ind_sel.cdx_filter.stats()['mime'] == 1
+
+
+def test_relevant_indices_dedup(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://a.nl/', '<html><p>Delft en De Bilt</p></html>'),
+        ('http://b.nl/', '<html><p>Delft en De Bilt</p></html>')])
+    for index in indices:
+        index['digest'] = 'SAME'
+    _file = tmpdir.join('indices.txt')
+    _file.write('\n'.join('{"status": "200", ' + json.dumps(i)[1:]
+                           for i in indices))
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    ind_sel.page_downloader.coalesce_gap = -1
+    ind_sel.dedup = dedup.DigestFilter(100)
+    relevant = ind_sel.relevant_indices_from_file(str(_file))
+
+    assert [index['offset'] for index in relevant] == [indices[0]['offset']]
+    assert cc_server.requests == 1
+    assert ind_sel.dedup.stats()['duplicates'] == 1
+
+
+def test_worker_resumes_from_checkpoint(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://{}.nl/'.format(i), '<html><p>Delft en De Bilt</p></html>')
+        for i in range(5)])
+    done = tmpdir.join('done.txt')
+    done.write('{"status": "200", ' + json.dumps(indices[0])[1:])
+    _file = tmpdir.join('indices.txt')
+    _file.write('\n'.join('{"status": "200", ' + json.dumps(i)[1:]
+                           for i in indices))
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir.mkdir('cp')), 'test')
+    checkpoint.complete(str(done))
+    checkpoint.update(str(_file), 2)
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    ind_sel.page_downloader.coalesce_batch = 2
+    ind_sel.checkpoint = checkpoint
+    queue = Manager().Queue()
+    ind_sel.worker(queue, [str(done), str(_file)])
+
+    relevant = []
+    while not queue.empty():
+        relevant.append(queue.get_nowait()[0]['offset'])
+    assert relevant == [i['offset'] for i in indices[2:]]
+    assert checkpoint.done(str(_file))
+
+
+def test_iter_relevant_checkpoints_consumed_chunks(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://{}.nl/'.format(i), '<html><p>Delft en De Bilt</p></html>')
+        for i in range(5)])
+    _file = tmpdir.join('indices.txt')
+    _file.write('\n'.join('{"status": "200", ' + json.dumps(i)[1:]
+                           for i in indices))
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    ind_sel.page_downloader.coalesce_batch = 2
+    ind_sel.checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    results = ind_sel.iter_relevant(str(_file))
+
+    for _ in range(3):
+        next(results)
+    # Only the first chunk has been consumed completely
+    assert ind_sel.checkpoint.position(str(_file)) == 2
+
+
+def test_restart_with_dedup_and_checkpoint(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://{}.nl/'.format(i), '<html><p>Delft en De Bilt {}</p></html>'
+         .format(i)) for i in range(6)])
+    _file = tmpdir.join('indices.txt')
+    _file.write('\n'.join('{"status": "200", ' + json.dumps(i)[1:]
+                           for i in indices))
+
+    def selector():
+        ind_sel = indices_selector.IndicesSelector(
+            cities=['Delft', 'De Bilt'])
+        ind_sel.page_downloader.cc_data_prefix = cc_server.url
+        ind_sel.page_downloader.coalesce_batch = 2
+        ind_sel.dedup = dedup.DigestFilter(
+            100, path=str(tmpdir.join('digests.db')))
+        ind_sel.checkpoint = checkpoint_utils.Checkpoint(
+            str(tmpdir.join('cp')), 'test', interval=0)
+        return ind_sel
+
+    results = selector().iter_relevant(str(_file))
+    emitted = [next(results)[0]['offset'] for _ in range(5)]
+    # Crash while the third chunk is in progress
+    del results
+
+    results = selector().iter_relevant(str(_file))
+    emitted += [index['offset'] for index, _, _, _ in results]
+    # The third chunk is redone, nothing is lost
+    assert emitted == [i['offset'] for i in indices[:5]] + \
+        [i['offset'] for i in indices[4:]]
+
+
+def test_run_pipeline(cc_server, tmpdir):
+    pages = [('http://{}.nl/'.format(i), '<html><p>{}</p></html>'.format(
+        'Delft en De Bilt' if i % 3 == 0 else 'Alleen Delft'))
+        for i in range(30)]
+    indices = write_warc(cc_server.root, 'test.warc.gz', pages)
+    directory = tmpdir.mkdir('indices')
+    for n in range(3):
+        directory.join('indices{}.txt'.format(n)).write('\n'.join(
+            '{"status": "200", ' + json.dumps(i)[1:]
+            for i in indices[n::3]))
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    queue = Manager().Queue()
+    ind_sel.run_pipeline(str(directory), queue, fetchers=2, extractors=2,
+                         matchers=2, queue_size=4)
+
+    relevant = []
+    while not queue.empty():
+        index, co_occ = queue.get_nowait()
+        assert co_occ == ['Delft', 'De Bilt']
+        relevant.append(index['offset'])
+    assert sorted(relevant, key=int) == [i['offset'] for i in indices[::3]]
+
+    fetch, extract, match = [stage.stats() for stage in ind_sel.stages]
+    assert fetch['in'] == fetch['out'] == 30
+    assert extract['in'] == 30
+    assert extract['out'] == match['in'] == 10
+    assert match['out'] == 10
+    assert all(0 <= s['busy'] for s in (fetch, extract, match))
+
+
+def test_run_pipeline_snippets(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://a.nl/', '<html><p>Delft en De Bilt</p></html>')])
+    directory = tmpdir.mkdir('indices')
+    directory.join('indices.txt').write(
+        '{"status": "200", ' + json.dumps(indices[0])[1:])
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'],
+                                               snippet_width=3)
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    queue = Manager().Queue()
+    ind_sel.run_pipeline(str(directory), queue, fetchers=1, extractors=1,
+                         matchers=1)
+
+    index, co_occ, snippets = queue.get_nowait()
+    assert co_occ == ['Delft', 'De Bilt']
+    assert snippets == {'Delft': ['Delft en'], 'De Bilt': ['en De Bilt']}
+
+
+def test_run_pipeline_resumes_from_checkpoint(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://{}.nl/'.format(i), '<html><p>Delft en De Bilt</p></html>')
+        for i in range(6)])
+    directory = tmpdir.mkdir('indices')
+    _file = directory.join('indices.txt')
+    _file.write('\n'.join('{"status": "200", ' + json.dumps(i)[1:]
+                           for i in indices))
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir.mkdir('cp')), 'test')
+    checkpoint.update(str(_file), 2)
+    checkpoint.flush()
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    ind_sel.page_downloader.coalesce_batch = 2
+    ind_sel.checkpoint = checkpoint
+    queue = Manager().Queue()
+    ind_sel.run_pipeline(str(directory), queue, fetchers=1, extractors=2,
+                         matchers=2, queue_size=4)
+
+    relevant = []
+    while not queue.empty():
+        relevant.append(queue.get_nowait()[0]['offset'])
+    assert sorted(relevant, key=int) == [i['offset'] for i in indices[2:]]
+    # The fetch stage recorded the unit once all its parts were matched
+    reloaded = checkpoint_utils.Checkpoint(str(tmpdir.join('cp')), 'test')
+    assert reloaded.done(str(_file))
+
+
+def test_run_pipeline_no_join(tmpdir):
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    workers = ind_sel.run_pipeline(str(tmpdir), Manager().Queue(),
+                                   fetchers=1, extractors=2, matchers=3,
+                                   join=False)
+    assert len(workers) == 6
+    for worker in workers:
+        worker.join()
+    assert [s.stats()['in'] for s in ind_sel.stages] == [0, 0, 0]
+
+
 def test_run_worker():
     ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
     man = Manager()
@@ -0,0 +1,40 @@
+import os
+
+from tests.cc_server import write_warc
+from urbansearch.gathering import local_warc
+
+
+def test_is_local():
+    assert not local_warc.is_local('http://commoncrawl.s3.amazonaws.com/')
+    assert not local_warc.is_local('https://commoncrawl.s3.amazonaws.com/')
+    assert local_warc.is_local('/data/commoncrawl/')
+    assert local_warc.is_local('data')
+
+
+def test_read(cc_data):
+    with open(os.path.join(cc_data, 'a.warc.gz'), 'wb') as f:
+        f.write(b'0123456789')
+    reader = local_warc.LocalWarcReader(cc_data)
+    part = reader.read('a.warc.gz', 2, 5)
+    assert isinstance(part, memoryview)
+    assert part == b'2345'
+    assert reader.read('a.warc.gz', 8, 20) == b'89'
+
+
+def test_read_missing(cc_data):
+    reader = local_warc.LocalWarcReader(cc_data)
+    assert reader.read('missing.warc.gz', 0, 10) is None
+    open(os.path.join(cc_data, 'empty.warc.gz'), 'wb').close()
+    assert reader.read('empty.warc.gz', 0, 10) is None
+
+
+def test_read_max_open(cc_data):
+    indices = write_warc(cc_data, 'a.warc.gz', [('http://a.nl/', 'a')])
+    write_warc(cc_data, 'b.warc.gz', [('http://b.nl/', 'b')])
+    reader = local_warc.LocalWarcReader(cc_data, max_open=1)
+    length = int(indices[0]['length'])
+    part = reader.read('a.warc.gz', 0, length - 1)
+    reader.read('b.warc.gz', 0, 10)
+    assert list(reader._maps) == ['b.warc.gz']
+    # Views stay valid after the file is no longer kept mapped
+    assert len(part) == length
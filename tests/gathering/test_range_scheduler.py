@@ -0,0 +1,60 @@
+from urbansearch.gathering import range_scheduler
+
+
+def _index(filename, offset, length):
+    return {'filename': filename, 'offset': str(offset),
+            'length': str(length)}
+
+
+def test_coalesce_adjacent():
+    indices = [_index('a', 100, 50), _index('a', 0, 100), _index('a', 150, 10)]
+    ranges = range_scheduler.coalesce(indices, 0)
+    assert len(ranges) == 1
+    assert ranges[0].start == 0
+    assert ranges[0].end == 159
+    assert [int(i['offset']) for i in ranges[0].indices] == [0, 100, 150]
+
+
+def test_coalesce_gap():
+    indices = [_index('a', 0, 100), _index('a', 200, 100)]
+    assert len(range_scheduler.coalesce(indices, 99)) == 2
+    assert len(range_scheduler.coalesce(indices, 100)) == 1
+
+
+def test_coalesce_per_file():
+    indices = [_index('a', 0, 10), _index('b', 10, 10), _index('a', 10, 10)]
+    ranges = range_scheduler.coalesce(indices, 1000)
+    assert [(r.filename, len(r.indices)) for r in ranges] == [('a', 2),
+                                                              ('b', 1)]
+
+
+def test_coalesce_max_size():
+    indices = [_index('a', i * 10, 10) for i in range(10)]
+    ranges = range_scheduler.coalesce(indices, 0, max_size=30)
+    assert [len(r.indices) for r in ranges] == [3, 3, 3, 1]
+    assert all(r.end - r.start + 1 <= 30 for r in ranges)
+
+
+def test_coalesce_max_part():
+    indices = [_index('a', 0, 10), _index('a', 10, 50), _index('a', 60, 10),
+               _index('a', 70, 10)]
+    ranges = range_scheduler.coalesce(indices, 0, max_part=20)
+    assert [(r.start, r.end, len(r.indices)) for r in ranges] == [
+        (0, 9, 1), (10, 59, 1), (60, 79, 2)]
+
+
+def test_coalesce_disabled():
+    indices = [_index('a', i * 10, 10) for i in range(5)]
+    assert len(range_scheduler.coalesce(indices, -1)) == 5
+
+
+def test_coalesce_empty():
+    assert range_scheduler.coalesce([], 0) == []
+
+
+def test_split():
+    indices = [_index('a', 10, 3), _index('a', 16, 4)]
+    warc_range = range_scheduler.coalesce(indices, 10)[0]
+    parts = list(range_scheduler.split(warc_range, b'abcXYZWXYZ'))
+    assert [(i['offset'], bytes(m)) for i, m in parts] == [('10', b'abc'),
+                                                         ('16', b'WXYZ')]
@@ -0,0 +1,187 @@
+from multiprocessing import Process
+from unittest.mock import patch
+
+from tests.cc_server import write_warc
+from urbansearch.gathering import fetcher, gathering, rate_control
+
+WARC = 'crawl-data/test/warc/part-00000.warc.gz'
+PAGES = [('http://a.nl/', '<html><body>Delft</body></html>'),
+         ('http://b.nl/', '<html><body>Utrecht</body></html>')]
+
+
+def test_try_acquire_respects_limit():
+    rate = rate_control.RateController(initial=2)
+    assert rate.try_acquire()
+    assert rate.try_acquire()
+    assert not rate.try_acquire()
+    rate.release(True, 0.1)
+    assert rate.try_acquire()
+    assert rate.stats()['concurrency'] == 2
+
+
+def test_cancel_keeps_limit():
+    rate = rate_control.RateController(initial=1)
+    rate.try_acquire()
+    rate.cancel()
+    assert rate.limit == 1
+    assert rate.stats()['concurrency'] == 0
+
+
+def test_additive_increase():
+    rate = rate_control.RateController(initial=4, increase=1)
+    for _ in range(4):
+        rate.acquire()
+        rate.release(True, 0.1)
+    assert rate.limit == 4
+    for _ in range(2):
+        rate.acquire()
+        rate.release(True, 0.1)
+    # About one more request per round of limit requests
+    assert rate.limit == 5
+
+
+def test_increase_bounded():
+    rate = rate_control.RateController(initial=4, maximum=4)
+    for _ in range(20):
+        rate.acquire()
+        rate.release(True, 0.1)
+    assert rate.limit == 4
+
+
+def test_multiplicative_decrease_once_per_cooldown():
+    rate = rate_control.RateController(initial=16, decrease=0.5,
+                                       cooldown=60)
+    for _ in range(3):
+        rate.acquire()
+        rate.release(False)
+    assert rate.limit == 8
+
+
+def test_decrease_on_slow_request():
+    rate = rate_control.RateController(initial=16, target_latency=1,
+                                       cooldown=0)
+    rate.acquire()
+    rate.release(True, 5)
+    assert rate.limit == 8
+
+
+def test_decrease_bounded():
+    rate = rate_control.RateController(initial=4, minimum=2, cooldown=0)
+    for _ in range(5):
+        rate.acquire()
+        rate.release(False)
+    assert rate.limit == 2
+
+
+def test_backoff_jittered_and_bounded():
+    rate = rate_control.RateController(backoff_base=1, backoff_max=3)
+    delays = [rate.backoff(attempt) for attempt in range(5) for _ in
+              range(20)]
+    assert all(0 <= d <= 3 for d in delays)
+    assert len(set(delays)) > 1
+    assert rate.stats()['retries'] == 100
+
+
+def test_timeout_follows_latency():
+    rate = rate_control.RateController()
+    assert rate.timeout(3) == 3
+    for _ in range(50):
+        rate.acquire()
+        rate.release(True, 2)
+    assert rate.timeout(3) > 3
+
+
+def test_stats():
+    rate = rate_control.RateController(cooldown=0)
+    for success in (True, True, True, False):
+        rate.acquire()
+        rate.release(success, 0.1, 100)
+    stats = rate.stats()
+    assert stats['success_rate'] == 0.75
+    assert stats['successes'] == 3
+    assert stats['failures'] == 1
+    assert stats['bytes_per_sec'] > 0
+
+
+def _hold_slot(rate):
+    rate.acquire()
+
+
+def test_limit_shared_with_forked_processes():
+    rate = rate_control.RateController(initial=2)
+    workers = [Process(target=_hold_slot, args=(rate,)) for _ in range(2)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert rate.stats()['concurrency'] == 2
+    assert not rate.try_acquire()
+
+
+@patch('config.get')
+def test_shared(mock_config):
+    mock_config.return_value = {'initial': 5}
+    rate = rate_control.shared()
+    assert rate.limit == 5
+    assert rate_control.shared() is rate
+
+
+def test_page_downloader_retries_throttled(cc_server):
+    indices = write_warc(cc_server.root, WARC, PAGES)
+    pd = gathering.PageDownloader()
+    pd.cc_data_prefix = cc_server.url
+    pd.rate = rate_control.RateController(backoff_base=0.001)
+    cc_server.throttle = 2
+
+    assert b'Delft' in pd.download_warc_part(indices[0])
+    assert cc_server.requests == 3
+    assert pd.rate.stats()['failures'] == 2
+
+
+def test_page_downloader_gives_up(cc_server):
+    indices = write_warc(cc_server.root, WARC, PAGES)
+    pd = gathering.PageDownloader()
+    pd.cc_data_prefix = cc_server.url
+    pd.rate = rate_control.RateController(retries=2, backoff_base=0.001)
+    cc_server.throttle = 10
+
+    assert pd.download_warc_part(indices[0]) is None
+    assert cc_server.requests == 3
+
+
+def test_page_downloader_no_retry_missing(cc_server):
+    pd = gathering.PageDownloader()
+    pd.cc_data_prefix = cc_server.url
+    pd.rate = rate_control.RateController(backoff_base=0.001)
+    index = {'filename': 'missing.warc.gz', 'offset': '0', 'length': '10'}
+
+    assert pd.download_warc_part(index) is None
+    assert cc_server.requests == 1
+
+
+def test_fetcher_retries_throttled(cc_server):
+    indices = write_warc(cc_server.root, WARC, PAGES)
+    rate = rate_control.RateController(backoff_base=0.001)
+    f = fetcher.AsyncFetcher(cc_data=cc_server.url, rate=rate)
+    cc_server.throttle = 1
+
+    results = list(f.fetch_iter(indices[:1]))
+    f.close()
+
+    assert b'Delft' in results[0][1]
+    assert cc_server.requests == 2
+    assert rate.stats()['concurrency'] == 0
+
+
+def test_fetcher_bounded_by_rate_limit(cc_server):
+    cc_server.delay = 0.05
+    indices = write_warc(cc_server.root, WARC, PAGES * 10)
+    rate = rate_control.RateController(initial=2, maximum=2)
+    f = fetcher.AsyncFetcher(cc_data=cc_server.url, rate=rate)
+    f.coalesce_gap = -1
+
+    results = list(f.fetch_iter(indices))
+    f.close()
+
+    assert all(data for _, data in results)
+    assert cc_server.max_active <= 2
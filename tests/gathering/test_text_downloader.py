@@ -1,7 +1,12 @@
+import gzip
+import json
 import os
+from unittest.mock import patch
 
 import config
-from urbansearch.gathering import text_downloader
+from tests.cc_server import write_warc
+from urbansearch.gathering import indices_selector, text_downloader
+from urbansearch.utils import shard_utils
 
 
 def test_worker(tmpdir):
@@ -17,6 +22,64 @@ def test_worker(tmpdir):
             assert f.readlines()[10] == exp[10]
 
 
+def test_worker_numbers_files_over_units(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://{}.nl/'.format(i), '<html><p>Delft en De Bilt</p></html>')
+        for i in range(4)])
+    units = []
+    for n in range(2):
+        path = str(tmpdir.join('{}.gz'.format(n)))
+        with gzip.open(path, 'wt') as f:
+            for index in indices[n * 2:n * 2 + 2]:
+                f.write('{"status": "200", ' + json.dumps(index)[1:] + '\n')
+        units.append(path)
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    with patch('urbansearch.gathering.text_downloader.indices_selector.'
+               'IndicesSelector', return_value=ind_sel):
+        td = text_downloader.TextDownloader()
+    out = tmpdir.mkdir('out')
+    td.worker(units, str(out), 0)
+
+    assert sorted(os.listdir(str(out))) == ['W0-{}.txt'.format(i)
+                                            for i in range(4)]
+
+
+def test_worker_writes_shards(cc_server, tmpdir):
+    indices = write_warc(cc_server.root, 'test.warc.gz', [
+        ('http://{}.nl/'.format(i), '<html><p>Delft en De Bilt</p></html>')
+        for i in range(3)])
+    path = str(tmpdir.join('indices.gz'))
+    with gzip.open(path, 'wt') as f:
+        for index in indices:
+            f.write('{"status": "200", ' + json.dumps(index)[1:] + '\n')
+
+    ind_sel = indices_selector.IndicesSelector(cities=['Delft', 'De Bilt'])
+    ind_sel.page_downloader.cc_data_prefix = cc_server.url
+    with patch('urbansearch.gathering.text_downloader.indices_selector.'
+               'IndicesSelector', return_value=ind_sel):
+        td = text_downloader.TextDownloader()
+    td.output_format = 'shard'
+    out = tmpdir.mkdir('out')
+    td.worker([path], str(out), 0)
+
+    assert sorted(os.listdir(str(out))) == ['W0-0.shard', 'W0-0.shard.idx']
+    records = list(shard_utils.ShardReader(str(out.join('W0-0.shard'))))
+    assert [index['offset'] for index, _ in records] == \
+        [index['offset'] for index in indices]
+    assert all('Delft en De Bilt' in text for _, text in records)
+
+
+def test_next_file_number(tmpdir):
+    for name in ('W0-0.txt', 'W0-7.txt', 'W1-9.txt', 'W0-x.txt'):
+        tmpdir.join(name).write('')
+    assert text_downloader.TextDownloader._next_file_number(str(tmpdir),
+                                                            0) == 8
+    assert text_downloader.TextDownloader._next_file_number(str(tmpdir),
+                                                            2) == 0
+
+
 def test_write_txt_file(tmpdir):
     td = text_downloader.TextDownloader()
     td._write_txt_file_index('a', 'b', str(tmpdir), (123, 456))
@@ -0,0 +1,89 @@
+import gzip
+import pickle
+import zlib
+
+import pytest
+
+from tests.cc_server import make_record
+from urbansearch.gathering import warc
+
+HTML = '<html><body>{}</body></html>'.format('Delft en Rotterdam ' * 5000)
+RECORD = make_record('http://a.nl/', HTML)
+MEMBER = gzip.compress(RECORD)
+
+
+def test_feed():
+    decoder = warc.RecordDecoder()
+    assert decoder.feed(memoryview(MEMBER))
+    assert decoder.getvalue() == RECORD
+    assert not decoder.truncated
+    assert decoder.body() == HTML.encode() + b'\r\n\r\n'
+
+
+def test_feed_chunks():
+    decoder = warc.RecordDecoder()
+    for i in range(0, len(MEMBER), 7):
+        done = decoder.feed(MEMBER[i:i + 7])
+    assert done
+    assert decoder.getvalue() == RECORD
+    assert decoder.body()[:6] == b'<html>'
+
+
+def test_max_body():
+    decoder = warc.RecordDecoder(max_body=100)
+    assert decoder.feed(MEMBER)
+    assert decoder.truncated
+    assert decoder.body() == HTML.encode()[:100]
+    assert decoder.getvalue() == RECORD[:RECORD.index(b'<html>') + 100]
+
+
+def test_max_body_chunks():
+    decoder = warc.RecordDecoder(max_body=20000)
+    chunks = [MEMBER[i:i + 100] for i in range(0, len(MEMBER), 100)]
+    fed = 0
+    for chunk in chunks:
+        fed += 1
+        if decoder.feed(chunk):
+            break
+    assert fed < len(chunks)
+    assert len(decoder.body()) == 20000
+
+
+def test_max_body_larger_than_record():
+    decoder = warc.RecordDecoder(max_body=10 ** 6)
+    assert decoder.feed(MEMBER)
+    assert not decoder.truncated
+    assert decoder.getvalue() == RECORD
+
+
+def test_incomplete():
+    decoder = warc.RecordDecoder()
+    assert not decoder.feed(MEMBER[:len(MEMBER) // 2])
+    assert not decoder.done
+
+
+def test_multiple_members():
+    decoder = warc.RecordDecoder()
+    assert decoder.feed(MEMBER + gzip.compress(b'WARC/1.0'))
+    assert decoder.getvalue() == RECORD + b'WARC/1.0'
+
+
+def test_no_http_headers():
+    decoder = warc.RecordDecoder()
+    decoder.feed(gzip.compress(b'WARC/1.0\r\n\r\nbody'))
+    assert decoder.body() == b'body'
+
+
+def test_invalid():
+    with pytest.raises(zlib.error):
+        warc.RecordDecoder().feed(RECORD)
+
+
+def test_record_body():
+    decoder = warc.RecordDecoder()
+    decoder.feed(MEMBER)
+    record = decoder.getvalue()
+    assert isinstance(record, warc.Record)
+    assert record.body() == decoder.body()
+    # Records are put on queues between processes
+    assert pickle.loads(pickle.dumps(record)).body() == decoder.body()
@@ -0,0 +1,72 @@
+import os
+
+from urbansearch.gathering import warc_cache
+
+INDEX = {'digest': 'ABCDEF', 'filename': 'a.warc.gz', 'offset': '10',
+         'length': '4'}
+
+
+def test_key_digest():
+    assert warc_cache.WarcCache.key(INDEX) == 'ABCDEF'
+
+
+def test_key_without_digest():
+    index = dict(INDEX, digest='sha1:../..')
+    key = warc_cache.WarcCache.key(index)
+    assert key.isalnum()
+    assert key != warc_cache.WarcCache.key(dict(index, offset='11'))
+
+
+def test_get_put(tmpdir):
+    cache = warc_cache.WarcCache(str(tmpdir), 100)
+    assert cache.get(INDEX) is None
+    cache.put(INDEX, b'data')
+    assert cache.get(INDEX) == b'data'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 4}
+
+
+def test_put_memoryview(tmpdir):
+    cache = warc_cache.WarcCache(str(tmpdir), 100)
+    cache.put(INDEX, memoryview(b'xxdatax')[2:6])
+    assert cache.get(INDEX) == b'data'
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = warc_cache.WarcCache(str(tmpdir), 35)
+    indices = [dict(INDEX, digest='D{}'.format(i)) for i in range(3)]
+    for i, index in enumerate(indices):
+        cache.put(index, b'0123456789')
+        path = cache._path(cache.key(index))
+        os.utime(path, (i, i))
+
+    # Reading an entry makes it the most recently used
+    cache.get(indices[0])
+    cache.put(dict(INDEX, digest='D3'), b'0123456789')
+
+    assert cache.get(indices[1]) is None
+    assert cache.get(indices[0]) == b'0123456789'
+    assert cache.stats()['size'] <= 35
+
+
+def test_existing_entries_count(tmpdir):
+    warc_cache.WarcCache(str(tmpdir), 100).put(INDEX, b'data')
+    cache = warc_cache.WarcCache(str(tmpdir), 100)
+    cache.put(dict(INDEX, digest='OTHER'), b'more')
+    assert cache.stats()['size'] == 8
+
+
+def test_put_existing_counts_once(tmpdir):
+    cache = warc_cache.WarcCache(str(tmpdir), 10)
+    cache.put(INDEX, b'data')
+    cache.put(INDEX, b'data')
+    cache.put(dict(INDEX, digest='OTHER'), b'more')
+    # Both entries fit, so nothing was evicted
+    assert cache.stats()['size'] == 8
+    assert cache.get(INDEX) == b'data'
+    assert not [name for name in os.listdir(os.path.dirname(
+        cache._path(cache.key(INDEX)))) if name.startswith(
+            warc_cache.TMP_PREFIX)]
+
+
+def test_from_config_disabled():
+    assert warc_cache.from_config() is None
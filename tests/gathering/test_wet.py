@@ -0,0 +1,129 @@
+import gzip
+import os
+from unittest.mock import patch
+
+from urbansearch.gathering import wet
+from urbansearch.utils import gz_utils
+
+TEXTS = ['Delft en Rotterdam', 'Utrecht\nAmsterdam', 'Groningen é']
+
+
+def _record(warc_type, text, digest='sha1:ABC'):
+    body = text.encode('utf-8')
+    headers = ('WARC/1.0\r\nWARC-Type: {0}\r\n'
+               'WARC-Refers-To: <urn:uuid:{1}>\r\n'
+               'WARC-Block-Digest: {1}\r\nContent-Length: {2}\r\n\r\n'
+               .format(warc_type, digest, len(body)))
+    return gzip.compress(headers.encode() + body + b'\r\n\r\n')
+
+
+def _write_wet(tmpdir, texts=TEXTS):
+    members = [_record('warcinfo', 'software: test')]
+    members += [_record('conversion', t, 'sha1:D{0}'.format(i))
+                for i, t in enumerate(texts)]
+    path = tmpdir.join('test.warc.wet.gz')
+    path.write_binary(b''.join(members))
+    return str(path), members
+
+
+def test_iter_records(tmpdir):
+    path, members = _write_wet(tmpdir)
+    records = list(wet.WetReader(0).iter_records(path))
+
+    assert [text for _, text in records] == TEXTS
+    offset = len(members[0])
+    for i, (index, _) in enumerate(records):
+        assert index == {'digest': 'D{0}'.format(i),
+                         'filename': 'test.warc.wet.gz',
+                         'offset': str(offset),
+                         'length': str(len(members[i + 1])),
+                         'source': 'wet',
+                         'refers_to': '<urn:uuid:sha1:D{0}>'.format(i)}
+        assert wet.is_wet_index(index)
+        offset += len(members[i + 1])
+
+
+def test_iter_records_root(tmpdir):
+    path, _ = _write_wet(tmpdir.mkdir('segment'))
+    reader = wet.WetReader(0, root=str(tmpdir))
+    for index, _ in reader.iter_records(path):
+        assert index['filename'] == os.path.join('segment',
+                                                 'test.warc.wet.gz')
+
+
+def test_is_wet_index():
+    assert not wet.is_wet_index({'digest': 'A', 'filename': 'a.warc.gz'})
+    assert not wet.is_wet_index(None)
+
+
+def test_iter_records_index_points_to_member(tmpdir):
+    path, _ = _write_wet(tmpdir)
+    reader = wet.WetReader(0)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    for index, text in reader.iter_records(path):
+        start = int(index['offset'])
+        member = gzip.decompress(data[start:start + int(index['length'])])
+        assert reader.parse_record(member)[1] == text
+
+
+def test_iter_records_range(tmpdir):
+    path, members = _write_wet(tmpdir)
+    start = len(members[0]) + len(members[1])
+    unit = gz_utils.GzRange(path, start, start + len(members[2]))
+
+    records = list(wet.WetReader(0).iter_records(unit))
+
+    assert [text for _, text in records] == TEXTS[1:2]
+    assert records[0][0]['offset'] == str(start)
+
+
+def test_iter_records_large_record(tmpdir):
+    text = 'Delft ' * 50000
+    path, _ = _write_wet(tmpdir, [text, 'Leiden'])
+
+    records = list(wet.WetReader(0).iter_records(path))
+
+    assert [t for _, t in records] == [text, 'Leiden']
+
+
+def test_iter_records_max_text_size(tmpdir):
+    path, _ = _write_wet(tmpdir)
+    texts = [t for _, t in wet.WetReader(7).iter_records(path)]
+    assert texts == [t[:7] for t in TEXTS]
+
+
+@patch('config.get')
+def test_max_text_size_from_config(mock_config):
+    mock_config.return_value = 100
+    assert wet.WetReader().max_text_size == 100
+
+
+def test_iter_records_truncated_file(tmpdir):
+    path, members = _write_wet(tmpdir)
+    data = b''.join(members)
+    tmpdir.join('test.warc.wet.gz').write_binary(data[:-10])
+
+    texts = [t for _, t in wet.WetReader(0).iter_records(path)]
+
+    assert texts == TEXTS[:-1]
+
+
+def test_iter_records_corrupt_file(tmpdir):
+    path, members = _write_wet(tmpdir)
+    data = b''.join(members[:2]) + b'\x1f\x8b\x08garbage'
+    tmpdir.join('test.warc.wet.gz').write_binary(data)
+
+    texts = [t for _, t in wet.WetReader(0).iter_records(path)]
+
+    assert texts == TEXTS[:1]
+
+
+def test_parse_record_other_type():
+    record = gzip.decompress(_record('metadata', 'x'))
+    assert wet.WetReader(0).parse_record(record) is None
+
+
+def test_parse_record_no_headers():
+    assert wet.WetReader(0).parse_record(b'WARC/1.0\r\n') is None
@@ -160,6 +160,56 @@ def test_mock_classify_text_files_to_db_not_connected(mock_db_connected,
                 assert not mock_workers.called
 
 
+@patch('urbansearch.workers.Workers')
+@patch('urbansearch.main.Manager')
+def test_classify_wet_files_to_db(mock_manager, mock_workers, tmpdir):
+    tmpdir.join('a.warc.wet.gz').write_binary(b'')
+    tmpdir.join('notes.txt').write('')
+    w = mock_workers.return_value = Mock()
+    a = Mock()
+    b = Mock()
+    w.run_read_wet_workers.return_value = [a]
+    w.run_classifying_workers.return_value = [b]
+
+    main.classify_wet_files_to_db(2, 1, str(tmpdir), 0.3)
+
+    args = w.run_read_wet_workers.call_args[0]
+    assert args[0] == 2
+    assert args[1] == [str(tmpdir.join('a.warc.wet.gz'))]
+    assert w.run_read_wet_workers.call_args[1]['root'] == str(tmpdir)
+    assert w.run_classifying_workers.call_args[1]['pre_downloaded']
+    assert w.set_file_producers_done.called
+    assert a.join.called
+    assert b.join.called
+
+
+def test__run_producers_workers():
+    ind_sel = Mock()
+    main._run_producers(ind_sel, 3, 'dir', 'queue')
+    ind_sel.run_workers.assert_called_once_with(3, 'dir', 'queue',
+                                                join=False)
+    assert not ind_sel.run_pipeline.called
+
+
+@patch('config.get')
+def test__run_producers_pipeline(mock_config):
+    mock_config.return_value = 'pipeline'
+    ind_sel = Mock()
+    producers = main._run_producers(ind_sel, 3, 'dir', 'queue',
+                                    progress=True)
+    ind_sel.run_pipeline.assert_called_once_with('dir', 'queue', join=False,
+                                                 extractors=3, progress=True)
+    assert producers == ind_sel.run_pipeline.return_value
+    assert not ind_sel.run_workers.called
+
+
+@patch('config.get')
+def test__run_producers_unknown(mock_config):
+    mock_config.return_value = 'threads'
+    with pytest.raises(ValueError):
+        main._run_producers(Mock(), 3, 'dir', 'queue')
+
+
 def test__join_ic_rel_workers():
     w = Mock()
     producers = [Mock()]
@@ -1,6 +1,10 @@
+import os
 import pytest
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import MagicMock, Mock, patch, mock_open
+from urbansearch.filtering import dedup
+from urbansearch.utils import shard_utils
 from urbansearch.workers import Workers
 
 
@@ -35,7 +39,7 @@ class Test_Workers(TestCase):
                                 mock_pre_process, mock_config):
         queue = MagicMock()
         queue.empty = MagicMock(side_effect=[False, True])
-        queue.get = MagicMock(side_effect=[{Mock(), Mock()}])
+        queue.get = MagicMock(side_effect=[(Mock(), Mock())])
         mock_config.return_value = 0
         w = Workers()
         w._store_indices_db = Mock()
@@ -58,6 +62,29 @@ class Test_Workers(TestCase):
         assert w._store_info_db.called
         assert w._final_store_db.called
 
+    @patch('urbansearch.workers.db_utils')
+    def test_classifying_worker_snippets(self, mock_db_utils, mock_event,
+                                         mock_pd, mock_classify, mock_coOc,
+                                         mock_pre_process, mock_config):
+        snippets = {'Delft': ['Delft'], 'Leiden': ['Leiden']}
+        queue = MagicMock()
+        queue.empty = MagicMock(side_effect=[False, True])
+        queue.get = MagicMock(side_effect=[({'digest': 'A'},
+                                            ['Delft', 'Leiden'], snippets)])
+        mock_config.return_value = 10
+        w = Workers()
+        w._store_indices_db = Mock()
+        w._store_info_db = Mock()
+        w._final_store_db = Mock()
+        w.set_producers_done()
+        w.classifying_worker(queue, 1, True)
+
+        w._store_info_db.assert_any_call(
+            ['A'], (['Delft', 'Leiden'], []), mock_db_utils.store_occurrences)
+        w._store_info_db.assert_any_call(
+            ['A'], (snippets, []), mock_db_utils.store_indices_snippets)
+        assert w._final_store_db.call_args[0][0][5] == []
+
     @patch('urbansearch.workers.db_utils')
     def test_not_classifying_worker(self, mock_db_utils, mock_event, mock_pd,
                                     mock_classify, mock_coOc,  mock_config,
@@ -110,6 +137,50 @@ class Test_Workers(TestCase):
         assert w._store_info_db.called
         assert w._final_store_db.called
 
+    def test_classifying_from_files_worker_store(self, mock_event, mock_pd,
+                                                 mock_classify, mock_coOc,
+                                                 mock_pre_process,
+                                                 mock_config):
+        queue = MagicMock()
+        queue.get.return_value = ({'digest': 'A'}, 'text')
+        queue.empty = MagicMock(side_effect=[False, True])
+        store = Mock()
+        w = Workers(store=store)
+        w.ct.categories_above_threshold.return_value = ['commuting']
+        w.set_file_producers_done()
+        w.classifying_from_files_worker(queue, 1)
+
+        writer = store.writer.return_value
+        writer.write.assert_called_once_with({'digest': 'A'}, 'text',
+                                             ['commuting'])
+        assert writer.close.called
+
+    @patch('urbansearch.workers.db_utils')
+    def test_classifying_from_files_worker_snippets(self, mock_db_utils,
+                                                    mock_event, mock_pd,
+                                                    mock_classify, mock_coOc,
+                                                    mock_pre_process,
+                                                    mock_config):
+        snippets = {'Delft': ['Delft'], 'Leiden': ['Leiden']}
+        mock_coOc.return_value.check_snippets.return_value = (
+            ['Delft', 'Leiden'], snippets)
+        queue = MagicMock()
+        queue.get.return_value = ({'digest': 'A'}, 'Delft en Leiden')
+        queue.empty = MagicMock(side_effect=[False, True])
+        mock_config.return_value = 10
+        w = Workers(snippet_width=50)
+        w._store_indices_db = Mock()
+        w._store_info_db = Mock()
+        w._final_store_db = Mock()
+        w.set_file_producers_done()
+        w.classifying_from_files_worker(queue, 1, True)
+
+        w.co.check_snippets.assert_called_once_with('Delft en Leiden', 50)
+        assert not w.co.check.called
+        w._store_info_db.assert_any_call(
+            ['A'], (snippets, []), mock_db_utils.store_indices_snippets)
+        assert w._final_store_db.call_args[0][0][5] == []
+
     @patch('urbansearch.workers.literal_eval')
     @patch("builtins.open", new_callable=mock_open, read_data="data")
     @patch('urbansearch.workers.os')
@@ -124,6 +195,7 @@ class Test_Workers(TestCase):
 
         mock_os.scandir.return_value = [file]
         file.is_file.return_value = True
+        file.name = file.path = 'W0-0.txt'
 
         w = Workers()
         w.read_files_worker(Mock(), queue)
@@ -131,6 +203,71 @@ class Test_Workers(TestCase):
         assert mock_lit_ev.called
         assert queue.put.called
 
+    def test_read_files_worker_resumes(self, mock_event, mock_pd,
+                                       mock_classify, mock_coOc, mock_config,
+                                       mock_pre_process):
+        with TemporaryDirectory() as directory:
+            for n in range(3):
+                with open(os.path.join(directory, 'W0-{0}.txt'.format(n)),
+                          'w') as f:
+                    f.write("{'offset': '%d'}\ntext" % n)
+            checkpoint = Mock()
+            checkpoint.position.return_value = 1
+            queue = Mock()
+            w = Workers(checkpoint=checkpoint)
+            held = []
+
+            def classify(item, block):
+                # Acknowledge the items of the files in reverse order
+                held.insert(0, item[2])
+                if len(held) == 2:
+                    for ack in held:
+                        w.acks.put(ack)
+
+            queue.put.side_effect = classify
+            w.read_files_worker(directory, queue)
+
+        offsets = [c[0][0][0]['offset'] for c in queue.put.call_args_list]
+        assert offsets == ['1', '2']
+        # The files are done once all their items are acknowledged
+        checkpoint.update.assert_called_once_with(directory, 3)
+        assert checkpoint.flush.called
+
+    def test_classifying_from_files_worker_acknowledges(self, mock_event,
+                                                        mock_pd,
+                                                        mock_classify,
+                                                        mock_coOc,
+                                                        mock_pre_process,
+                                                        mock_config):
+        queue = MagicMock()
+        queue.get.return_value = ({'digest': 'A'}, 'text', ('dir', 0))
+        queue.empty = MagicMock(side_effect=[False, True])
+        mock_coOc.return_value.check.return_value = []
+        w = Workers(checkpoint=Mock())
+        w.acks = Mock()
+        w.set_file_producers_done()
+        w.classifying_from_files_worker(queue, 1)
+
+        w.acks.put.assert_called_once_with(('dir', 0))
+
+    def test_read_files_worker_shards(self, mock_event, mock_pd,
+                                      mock_classify, mock_coOc, mock_config,
+                                      mock_pre_process):
+        with TemporaryDirectory() as directory:
+            with shard_utils.ShardWriter(directory, 'W0') as writer:
+                writer.write({'digest': 'A'}, 'a')
+                writer.write({'digest': 'B'}, 'b')
+            with open(os.path.join(directory, 'W1-0.txt'), 'w') as f:
+                f.write("{'digest': 'C'}\nc")
+            queue = Mock()
+
+            w = Workers()
+            w.read_files_worker(directory, queue)
+
+        assert [c[0][0] for c in queue.put.call_args_list] == \
+            [({'digest': 'A'}, 'a'), ({'digest': 'B'}, 'b'),
+             ({'digest': 'C'}, 'c')]
+
     @patch('urbansearch.workers.Process')
     def test_run_read_files_worker(self, mock_process, mock_event, mock_pd,
                                    mock_classify, mock_coOc, mock_config,
@@ -159,6 +296,49 @@ class Test_Workers(TestCase):
         assert mock_process.called
         assert not worker.join.called
 
+    @patch('urbansearch.workers.wet')
+    def test_read_wet_worker(self, mock_wet, mock_event, mock_pd,
+                             mock_classify, mock_coOc, mock_pre_process,
+                             mock_config):
+        reader = mock_wet.WetReader.return_value
+        reader.iter_records.side_effect = lambda f: [({'f': f}, 'a'),
+                                                     ({'f': f}, 'b')]
+        queue = Mock()
+        w = Workers()
+        w.co.may_cooccur.side_effect = lambda text: text == 'a'
+
+        w.read_wet_worker(['x', 'y'], queue)
+
+        assert queue.put.call_count == 2
+        queue.put.assert_any_call(({'f': 'x'}, 'a'), block=True)
+        queue.put.assert_any_call(({'f': 'y'}, 'a'), block=True)
+
+    @patch('urbansearch.workers.wet')
+    def test_read_wet_worker_dedup(self, mock_wet, mock_event, mock_pd,
+                                   mock_classify, mock_coOc, mock_pre_process,
+                                   mock_config):
+        reader = mock_wet.WetReader.return_value
+        reader.iter_records.side_effect = lambda f: [({'digest': 'A'}, f)]
+        queue = Mock()
+        w = Workers(dedup=dedup.DigestFilter(100))
+
+        w.read_wet_worker(['x', 'y'], queue)
+
+        queue.put.assert_called_once_with(({'digest': 'A'}, 'x'), block=True)
+
+    @patch('urbansearch.workers.Process')
+    def test_run_read_wet_workers(self, mock_process, mock_event, mock_pd,
+                                  mock_classify, mock_coOc, mock_config,
+                                  mock_pre_process):
+        worker = mock_process.return_value = Mock()
+
+        w = Workers()
+        workers = w.run_read_wet_workers(2, ['a', 'b'], Mock(), join=False)
+
+        assert len(workers) == 2
+        assert worker.start.call_count == 2
+        assert not worker.join.called
+
     @patch('urbansearch.workers.db_utils')
     def test__store_indices_db(self, mock_db, mock_event,
                                mock_pd, mock_classify,
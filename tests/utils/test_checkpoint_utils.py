@@ -0,0 +1,163 @@
+import json
+import os
+from queue import Queue
+from unittest.mock import patch
+
+from urbansearch.utils import checkpoint_utils, gz_utils
+
+
+def _files(directory):
+    return sorted(os.listdir(str(directory)))
+
+
+def test_unit_key():
+    assert checkpoint_utils.unit_key('dir/a.gz') == 'dir/a.gz'
+    unit = gz_utils.GzRange('dir/a.gz', 0, 100)
+    assert checkpoint_utils.unit_key(unit) == 'dir/a.gz:0:100'
+
+
+def test_new_unit(tmpdir):
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    assert checkpoint.position('a') == 0
+    assert not checkpoint.done('a')
+
+
+def test_update_and_reload(tmpdir):
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    checkpoint.update('a', 10)
+    checkpoint.complete('b')
+    assert checkpoint.position('a') == 10
+    checkpoint.flush()
+
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    assert checkpoint.position('a') == 10
+    assert checkpoint.done('b')
+    assert checkpoint.position('b') == 0
+
+
+def test_write_once_per_interval(tmpdir):
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test',
+                                             interval=60)
+    checkpoint.update('a', 10)
+    assert _files(tmpdir) == []
+
+    checkpoint.interval = 0
+    checkpoint.update('a', 20)
+    assert _files(tmpdir) == ['test-{0}.json'.format(os.getpid())]
+
+
+def test_flush_without_updates(tmpdir):
+    checkpoint_utils.Checkpoint(str(tmpdir), 'test').flush()
+    assert _files(tmpdir) == []
+
+
+def test_merge_files_of_processes(tmpdir):
+    tmpdir.join('test-1.json').write(json.dumps({'a': 10, 'b': 5}))
+    tmpdir.join('test-2.json').write(json.dumps({'a': 20, 'b': True}))
+    tmpdir.join('other-1.json').write(json.dumps({'a': 30}))
+
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+
+    assert checkpoint.position('a') == 20
+    assert checkpoint.done('b')
+    assert _files(tmpdir) == ['other-1.json',
+                              'test-{0}.json'.format(os.getpid())]
+
+
+def test_skip_unreadable_file(tmpdir):
+    tmpdir.join('test-1.json').write('{"a": 1')
+    tmpdir.join('test-2.json').write(json.dumps({'b': 2}))
+
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+
+    assert checkpoint.position('a') == 0
+    assert checkpoint.position('b') == 2
+
+
+def test_failed_write_leaves_no_temporary_file(tmpdir):
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    checkpoint.update('a', 1)
+    with patch('urbansearch.utils.checkpoint_utils.os.replace',
+               side_effect=OSError):
+        checkpoint.flush()
+    assert _files(tmpdir) == []
+
+
+@patch('config.get')
+def test_from_config(mock_config, tmpdir):
+    mock_config.side_effect = lambda section, key: \
+        {'directory': str(tmpdir), 'interval': 5}[key]
+    checkpoint = checkpoint_utils.from_config('test')
+    assert checkpoint.directory == str(tmpdir)
+    assert checkpoint.interval == 5
+
+
+@patch('config.get')
+def test_from_config_disabled(mock_config):
+    mock_config.return_value = ''
+    assert checkpoint_utils.from_config('test') is None
+
+
+def test_completions_advance_over_finished_items(tmpdir):
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    completions = checkpoint_utils.Completions(checkpoint)
+    first = completions.issue('a', 1)
+    second = completions.issue('a', 2)
+    completions.finish('a', second)
+    # The first item is still in progress
+    assert checkpoint.position('a') == 0
+    assert completions.pending() == 1
+    completions.finish('a', first)
+    assert checkpoint.position('a') == 2
+    assert completions.pending() == 0
+
+
+def test_completions_close(tmpdir):
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    completions = checkpoint_utils.Completions(checkpoint)
+    number = completions.issue('a', 1)
+    completions.close('a')
+    assert not checkpoint.done('a')
+    completions.finish('a', number)
+    assert checkpoint.done('a')
+    completions.close('b', 3)
+    assert checkpoint.position('b') == 3
+
+
+def test_completions_receive(tmpdir):
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    completions = checkpoint_utils.Completions(checkpoint)
+    acks = Queue()
+    acks.put(('a', completions.issue('a', 1)))
+    completions.issue('a', 2)
+    completions.receive(acks)
+    assert checkpoint.position('a') == 1
+    assert completions.pending() == 1
+
+
+def test_completions_advanced(tmpdir):
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    advanced = []
+    completions = checkpoint_utils.Completions(checkpoint, advanced.extend)
+    first = completions.issue('a', 1)
+    second = completions.issue('a', 2)
+    third = completions.issue('a', 3)
+    completions.finish('a', second, 'B')
+    assert advanced == []
+    completions.finish('a', first, 'A')
+    completions.finish('a', third)
+    assert advanced == ['A', 'B']
+
+
+def test_on_flush(tmpdir):
+    checkpoint = checkpoint_utils.Checkpoint(str(tmpdir), 'test')
+    flushed = []
+
+    def callback():
+        flushed.append(checkpoint.position('a'))
+
+    checkpoint.on_flush(callback)
+    checkpoint.on_flush(callback)
+    checkpoint.update('a', 10)
+    checkpoint.flush()
+    assert flushed == [10]
@@ -111,6 +111,12 @@ def test_store_single_index():
     assert db_utils.store_index(index)
 
 
+@pytest.mark.usefixtures('clean_neo4j_index')
+def test_index_digests():
+    digest = _create_test_index()
+    assert digest in db_utils.index_digests()
+
+
 @pytest.mark.usefixtures('clean_neo4j_index')
 def test_store_multi_index():
     indices = [
@@ -219,6 +225,30 @@ def test_store_indices_topics():
     assert db_utils.store_indices_topics(indices, topics)
 
 
+@pytest.mark.usefixtures('clean_neo4j_index')
+def test_store_index_snippets_empty():
+    index = _create_test_index()
+    assert not db_utils.store_index_snippets(index, {})
+    assert not db_utils.store_index_snippets(index, None)
+
+
+@pytest.mark.usefixtures('clean_neo4j_index_and_rel')
+def test_get_related_documents_snippets():
+    index = _create_test_index()
+    db_utils.store_occurrence(index, ['Amsterdam', 'Rotterdam', 'Den Haag'])
+    db_utils.store_index_topics(index, ['commuting'])
+    db_utils.store_index_probabilities(index, {'commuting': 0.9})
+    snippets = {'Amsterdam': ['in Amsterdam en'], 'Rotterdam': ['Rotterdam'],
+                'Den Haag': ['Den Haag']}
+    assert db_utils.store_indices_snippets([index], [snippets])
+
+    documents = db_utils.get_related_documents('Amsterdam', 'Rotterdam')
+    assert documents == [{'digest': index,
+                          'categories': {'commuting': 0.9},
+                          'snippets': {'Amsterdam': ['in Amsterdam en'],
+                                       'Rotterdam': ['Rotterdam']}}]
+
+
 @pytest.mark.usefixtures('clean_neo4j_index')
 def test_get_index_probabilities():
     index = _create_test_index()
@@ -0,0 +1,73 @@
+import gzip
+import os
+
+from urbansearch.utils import gz_utils
+
+LINES = ['{{"status": "200", "offset": "{0}"}}\n'.format(i)
+         for i in range(1000)]
+
+
+def _write_members(tmpdir, name='test.gz', per_member=50):
+    path = str(tmpdir.join(name))
+    with open(path, 'wb') as f:
+        for i in range(0, len(LINES), per_member):
+            f.write(gzip.compress(''.join(LINES[i:i + per_member])
+                                  .encode('utf-8')))
+    return path
+
+
+def _read(gz_range):
+    with gz_utils.open_range(gz_range) as lines:
+        return list(lines)
+
+
+def test_split_members(tmpdir):
+    path = _write_members(tmpdir)
+    ranges = gz_utils.split_members(path, 4)
+    assert len(ranges) == 4
+    assert ranges[0].start == 0
+    assert ranges[-1].end == os.path.getsize(path)
+    assert all(a.end == b.start for a, b in zip(ranges, ranges[1:]))
+    assert [l for r in ranges for l in _read(r)] == LINES
+
+
+def test_split_members_single_member(tmpdir):
+    path = _write_members(tmpdir, per_member=len(LINES))
+    ranges = gz_utils.split_members(path, 4)
+    assert ranges == [gz_utils.GzRange(path, 0, os.path.getsize(path))]
+
+
+def test_split_members_more_parts_than_members(tmpdir):
+    path = _write_members(tmpdir, per_member=400)
+    ranges = gz_utils.split_members(path, 10)
+    assert len(ranges) == 3
+    assert [l for r in ranges for l in _read(r)] == LINES
+
+
+def test_find_member_skips_false_magic():
+    member = gzip.compress(b'abc')
+    data = b'\x1f\x8b\x08garbage' + member
+    assert gz_utils.find_member(data, 0) == len(data) - len(member)
+    assert gz_utils.find_member(data, len(data) - 1) is None
+
+
+def test_split_files(tmpdir):
+    large = _write_members(tmpdir, 'large.gz')
+    small = str(tmpdir.join('small.txt'))
+    with open(small, 'w') as f:
+        f.write('x')
+    units = gz_utils.split_files([large, small], 4, min_size=1)
+    assert units[-1] == small
+    assert len(units) == 5
+    assert all(isinstance(u, gz_utils.GzRange) for u in units[:-1])
+
+
+def test_split_files_min_size(tmpdir):
+    large = _write_members(tmpdir, 'large.gz')
+    assert gz_utils.split_files([large], 4) == [large]
+
+
+def test_is_gz():
+    assert gz_utils.is_gz('a.gz')
+    assert gz_utils.is_gz(gz_utils.GzRange('a', 0, 1))
+    assert not gz_utils.is_gz('a.txt')
@@ -0,0 +1,63 @@
+from multiprocessing import Manager, Process
+from queue import Queue
+
+from urbansearch.utils import pipeline_utils
+
+
+def test_finish_last_worker_puts_sentinels():
+    stage = pipeline_utils.Stage('test', 2, consumers=3)
+    queue = Queue()
+    stage.finish(queue)
+    assert queue.empty()
+    stage.finish(queue)
+    assert [queue.get_nowait() for _ in range(3)] == [None] * 3
+    assert queue.empty()
+
+
+def test_finish_without_consumers():
+    stage = pipeline_utils.Stage('test', 1)
+    queue = Queue()
+    stage.finish(queue)
+    assert queue.empty()
+
+
+def test_iter_queue():
+    queue = Queue()
+    for item in (1, 2, pipeline_utils.SENTINEL, 3):
+        queue.put(item)
+    assert list(pipeline_utils.iter_queue(queue)) == [1, 2]
+    assert queue.get_nowait() == 3
+
+
+def test_stats():
+    stage = pipeline_utils.Stage('test', 2)
+    stage.count(10, 4, 0.5)
+    stage.count(5, 1, 0.5)
+    stats = stage.stats()
+    assert stats['workers'] == 2
+    assert stats['in'] == 15
+    assert stats['out'] == 5
+    assert stats['per_sec'] > 0
+    assert stats['busy'] > 0
+
+
+def test_iter_tasks_list():
+    assert list(pipeline_utils.iter_tasks(['a', 'b'])) == ['a', 'b']
+
+
+def _take_tasks(tasks, done):
+    for unit in pipeline_utils.iter_tasks(tasks):
+        done.append(unit)
+
+
+def test_task_queue_shared_by_workers():
+    units = list(range(50))
+    tasks = pipeline_utils.task_queue(units, 3)
+    done = Manager().list()
+    workers = [Process(target=_take_tasks, args=(tasks, done))
+               for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sorted(done) == units
@@ -21,3 +21,16 @@ def test_divide_files_odd():
     assert actual[0][0] == 'a'
     assert actual[1][2] == 'e'
     assert len(actual) == 2
+
+
+def test_divide_files_remainder():
+    files = list('abcdefg')
+    actual = process_utils.divide_files(files, 3)
+    assert [len(part) for part in actual] == [2, 2, 3]
+    assert sum(actual, []) == files
+
+
+def test_divide_files_more_parts():
+    actual = process_utils.divide_files(['a', 'b', 'c'], 4)
+    assert len(actual) == 4
+    assert sum(actual, []) == ['a', 'b', 'c']
@@ -0,0 +1,90 @@
+import gzip
+
+from urbansearch.utils import shard_utils
+
+RECORDS = [({'digest': 'D{0}'.format(i), 'filename': 'a.warc.gz',
+             'offset': str(i * 100), 'length': '100'},
+            'Delft en Rotterdam {0}\nUtrecht é'.format(i))
+           for i in range(10)]
+
+
+def _write(directory, records=RECORDS, **kwargs):
+    with shard_utils.ShardWriter(str(directory), 'W0', **kwargs) as writer:
+        for index, text in records:
+            writer.write(index, text)
+
+
+def test_write_and_iterate(tmpdir):
+    _write(tmpdir, block_size=100)
+
+    paths = shard_utils.shard_paths(str(tmpdir))
+    assert paths == [str(tmpdir.join('W0-0.shard'))]
+    assert list(shard_utils.ShardReader(paths[0])) == RECORDS
+    assert shard_utils.count_records(paths[0]) == len(RECORDS)
+
+
+def test_blocks_are_gzip_members(tmpdir):
+    _write(tmpdir, block_size=100)
+    with gzip.open(str(tmpdir.join('W0-0.shard')), 'rb') as f:
+        assert b'Delft en Rotterdam 9' in f.read()
+
+
+def test_get(tmpdir):
+    _write(tmpdir, block_size=200)
+    reader = shard_utils.ShardReader(str(tmpdir.join('W0-0.shard')))
+
+    assert len(reader) == len(RECORDS)
+    for index, text in RECORDS:
+        assert reader.get(index['digest']) == (index, text)
+    assert reader.get('missing') is None
+
+
+def test_labels(tmpdir):
+    with shard_utils.ShardWriter(str(tmpdir), 'W0') as writer:
+        writer.write(*RECORDS[0], labels=['commuting', 'leisure'])
+        writer.write(*RECORDS[1])
+    reader = shard_utils.ShardReader(str(tmpdir.join('W0-0.shard')))
+
+    assert reader.entries['D0'][3] == ('commuting', 'leisure')
+    assert reader.entries['D1'][3] == ()
+    assert reader.get('D0') == RECORDS[0]
+
+
+def test_new_shard_at_shard_size(tmpdir):
+    _write(tmpdir, block_size=1, shard_size=200)
+
+    paths = shard_utils.shard_paths(str(tmpdir))
+    assert len(paths) > 1
+    records = [r for path in paths for r in shard_utils.ShardReader(path)]
+    assert records == RECORDS
+
+
+def test_writer_continues_after_existing_shards(tmpdir):
+    _write(tmpdir, RECORDS[:5])
+    _write(tmpdir, RECORDS[5:])
+
+    paths = shard_utils.shard_paths(str(tmpdir))
+    assert [p[len(str(tmpdir)) + 1:] for p in paths] == ['W0-0.shard',
+                                                         'W0-1.shard']
+    reader = shard_utils.ShardReader(paths[1])
+    assert reader.get('D7') == RECORDS[7]
+
+
+def test_unwritten_block(tmpdir):
+    writer = shard_utils.ShardWriter(str(tmpdir), 'W0')
+    writer.write(*RECORDS[0])
+    assert shard_utils.shard_paths(str(tmpdir)) == []
+    writer.close()
+    assert len(shard_utils.shard_paths(str(tmpdir))) == 1
+
+
+def test_iterate_broken_block(tmpdir):
+    _write(tmpdir, block_size=1)
+    path = tmpdir.join('W0-0.shard')
+    path.write_binary(path.read_binary()[:-10])
+
+    assert list(shard_utils.ShardReader(str(path))) == RECORDS[:-1]
+
+
+def test_count_records_without_index(tmpdir):
+    assert shard_utils.count_records(str(tmpdir.join('W0-0.shard'))) == 0
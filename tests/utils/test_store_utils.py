@@ -0,0 +1,69 @@
+from unittest.mock import patch
+
+from urbansearch.utils import store_utils
+
+DOCUMENTS = [({'digest': 'A'}, 'Delft', ['commuting']),
+             ({'digest': 'B'}, 'Utrecht', ['commuting', 'leisure']),
+             ({'digest': 'C'}, 'Leiden', ['Other'])]
+
+
+def _store(tmpdir, documents=DOCUMENTS):
+    store = store_utils.DocumentStore(str(tmpdir))
+    with store.writer('C0') as writer:
+        for document in documents:
+            writer.write(*document)
+    return store
+
+
+def test_from_config_disabled():
+    assert store_utils.from_config() is None
+
+
+@patch('config.get')
+def test_from_config(mock_config, tmpdir):
+    mock_config.return_value = str(tmpdir)
+    assert store_utils.from_config().directory == str(tmpdir)
+
+
+def test_get(tmpdir):
+    store = _store(tmpdir)
+    assert len(store) == 3
+    assert 'B' in store
+    assert store.get('B') == ({'digest': 'B'}, 'Utrecht',
+                              ('commuting', 'leisure'))
+    assert store.get('D') is None
+
+
+def test_random_of_categories(tmpdir):
+    store = _store(tmpdir)
+    digests = {store.random(['leisure', 'Other'])[0]['digest']
+               for _ in range(50)}
+    assert digests == {'B', 'C'}
+    assert store.random(['education']) is None
+
+
+def test_random_of_all(tmpdir):
+    store = _store(tmpdir)
+    digests = {store.random()[0]['digest'] for _ in range(50)}
+    assert digests == {'A', 'B', 'C'}
+
+
+def test_counts(tmpdir):
+    assert _store(tmpdir).counts() == {'commuting': 2, 'leisure': 1,
+                                       'Other': 1}
+
+
+def test_reload(tmpdir):
+    store = _store(tmpdir, DOCUMENTS[:1])
+    assert len(store) == 1
+    with store.writer('C1') as writer:
+        writer.write(*DOCUMENTS[1])
+    assert len(store) == 1
+    store.reload()
+    assert len(store) == 2
+
+
+def test_missing_directory(tmpdir):
+    store = store_utils.DocumentStore(str(tmpdir.join('missing')))
+    assert len(store) == 0
+    assert store.random() is None
@@ -1,7 +1,7 @@
 import requests
 import time
-from bs4 import BeautifulSoup
 
+from urbansearch.gathering import extractors
 from .text_preprocessor import PreProcessor
 
 UNWANTED_TAGS = ['head', 'script', 'link', 'meta', 'img', 'style']
@@ -15,11 +15,12 @@ class Link2Doc(object):
 
     def __init__(self):
         self.pp = PreProcessor()
+        self.extractor = extractors.get_extractor(skip_tags=UNWANTED_TAGS)
 
     def get_doc(self, link):
         """
-        Gets a page and processes it to a string. Unwanted HTML tags get
-        stripped by the strip_crap parser.
+        Gets a page and processes it to a string. The content of unwanted
+        HTML tags is stripped by the configured extractor.
 
         :param link: The link to fetch the content from
         :return: String containing the content of the requested page
@@ -30,10 +31,7 @@ class Link2Doc(object):
             if not r.status_code == requests.codes.ok:
                 return ''
 
-            soup = BeautifulSoup(r.text, 'html.parser')
-            self.strip_unwanted_tags(soup)
-
-            return self.pp.pre_process(soup.get_text())
+            return self.pp.pre_process(self.extractor.extract(r.text))
         except:
             return ''
 
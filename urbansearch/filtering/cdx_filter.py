@@ -0,0 +1,163 @@
+import logging
+import re
+from ctypes import c_longlong
+from multiprocessing import Value
+
+import config
+
+logger = logging.getLogger('filtering')
+
+# Rules in order of evaluation, the first rule that fails rejects an index
+RULES = ('length', 'mime', 'language', 'url_include', 'url_exclude')
+# Number of indices after which local counts are added to the shared ones
+FLUSH_INTERVAL = 10000
+
+
+def from_config():
+    """
+    Creates the filter configured in gathering.cdx_filter.
+
+    :return: A CdxFilter, or None if no rule is configured
+    """
+    settings = config.get('gathering', 'cdx_filter') or {}
+    cdx_filter = CdxFilter(**settings)
+    return cdx_filter if cdx_filter.active else None
+
+
+class CdxFilter(object):
+
+    """
+    Filter on the metadata of cdx records, evaluated before anything is
+    downloaded. Rules that are not configured accept every index. Indices
+    without the metadata a rule needs are accepted by that rule as well.
+
+    Rejections are counted per rule. The counters are shared with forked
+    processes, create the filter before starting workers.
+    """
+
+    def __init__(self, mimes=(), languages=(), url_include=(),
+                 url_exclude=(), max_length=0):
+        """
+        :param mimes: Allowed MIME types. A type ending with /* allows all
+        subtypes, e.g. text/*. The detected MIME type is used if available.
+        :param languages: Languages of which at least one must be detected,
+        as ISO 639-3 codes, e.g. nld
+        :param url_include: Regular expressions of which at least one must
+        match the url
+        :param url_exclude: Regular expressions of which none may match the
+        url
+        :param max_length: Maximum compressed length of a record in bytes, 0
+        for no limit
+        """
+        self.mimes = frozenset(m for m in mimes if not m.endswith('/*'))
+        self.mime_types = tuple(m[:-1] for m in mimes if m.endswith('/*'))
+        self.languages = frozenset(languages)
+        self.url_include = _compile(url_include)
+        self.url_exclude = _compile(url_exclude)
+        self.max_length = max_length
+
+        self.rejected = {rule: Value(c_longlong, 0) for rule in RULES}
+        self.passed = Value(c_longlong, 0)
+
+    @property
+    def active(self):
+        """ True if at least one rule is configured. """
+        return bool(self.mimes or self.mime_types or self.languages or
+                    self.url_include or self.url_exclude or self.max_length)
+
+    @property
+    def keys(self):
+        """ Keys of the cdx records needed to evaluate the rules. """
+        keys = []
+        if self.mimes or self.mime_types:
+            keys += ['mime', 'mime-detected']
+        if self.languages:
+            keys.append('languages')
+        if self.url_include or self.url_exclude:
+            keys.append('url')
+        return tuple(keys)
+
+    def check(self, index):
+        """
+        Evaluate the rules on an index, without counting.
+
+        :param index: Index in JSON format, including the metadata keys
+        :return: Name of the rule that rejects the index, None if the index
+        is accepted
+        """
+        if self.max_length and int(index['length']) > self.max_length:
+            return 'length'
+
+        mime = index.get('mime-detected') or index.get('mime')
+        if (mime and (self.mimes or self.mime_types) and
+                mime not in self.mimes and
+                not mime.startswith(self.mime_types)):
+            return 'mime'
+
+        languages = index.get('languages')
+        if (languages and self.languages and
+                self.languages.isdisjoint(languages.split(','))):
+            return 'language'
+
+        url = index.get('url')
+        if url and self.url_include and not self.url_include.search(url):
+            return 'url_include'
+        if url and self.url_exclude and self.url_exclude.search(url):
+            return 'url_exclude'
+        return None
+
+    def filter(self, indices):
+        """
+        Yield the accepted indices and count the rejected ones. The metadata
+        keys needed by the rules are removed from the accepted indices.
+
+        :param indices: Iterable of indices in JSON format
+        :return: Generator of indices
+        """
+        keys = self.keys
+        counts = dict.fromkeys(RULES, 0)
+        passed = 0
+        try:
+            for i, index in enumerate(indices, 1):
+                rule = self.check(index)
+                if rule:
+                    counts[rule] += 1
+                else:
+                    passed += 1
+                    for key in keys:
+                        index.pop(key, None)
+                    yield index
+
+                if i % FLUSH_INTERVAL == 0:
+                    self._flush(counts, passed)
+                    counts = dict.fromkeys(RULES, 0)
+                    passed = 0
+        finally:
+            self._flush(counts, passed)
+
+    def stats(self):
+        """
+        Returns the numbers of rejected indices per rule and of accepted
+        indices, counted by all processes.
+
+        :return: Dictionary with a count per rule and 'passed'
+        """
+        stats = {rule: value.value for rule, value in self.rejected.items()}
+        stats['passed'] = self.passed.value
+        return stats
+
+    def _flush(self, counts, passed):
+        for rule, count in counts.items():
+            if count:
+                with self.rejected[rule].get_lock():
+                    self.rejected[rule].value += count
+        if passed:
+            with self.passed.get_lock():
+                self.passed.value += passed
+
+
+def _compile(patterns):
+    # Single regular expression matching any of the patterns, or None
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:{0})'.format(p) for p in patterns))
@@ -1,32 +1,140 @@
 import ahocorasick
 import collections
+import hashlib
 import itertools
 import logging
+import os
+import pickle
+import re
+import tempfile
 
+import numpy as np
+from scipy import sparse
+
+import config
 from urbansearch.utils import db_utils
 
 
 logger = logging.getLogger('filtering')
 
+ASCII_WORD_RE = re.compile(r'[A-Za-z0-9]+')
+# Characters that are not word characters, as \\w in regular expressions,
+# are normalised to SEPARATOR in pages and city names, except spaces. Names
+# are mentioned between two of BOUNDARIES, see
+# CoOccurrenceChecker._matches.
+SEPARATOR = '\x1f'
+BOUNDARIES = (' ', SEPARATOR)
+# Default number of characters of context on either side of a mention and
+# number of snippets per city, see CoOccurrenceChecker.check_snippets
+SNIPPET_WIDTH = 100
+SNIPPETS_PER_CITY = 3
+# Version of the format of cached automata, files of other versions are
+# ignored
+CACHE_VERSION = 3
+# File of the cached automata of the cities in Neo4j
+CACHE_FILE = 'automata-v{0}-default.pickle'.format(CACHE_VERSION)
+
+# Automata loaded or built in this process by cache key, None for the
+# cities in Neo4j. Processes forked afterwards share them copy-on-write.
+_automata = {}
+
+
+def cache_key(cities):
+    """
+    Returns the key of the automata of a list of cities, a hash of the
+    distinct names.
+
+    :param cities: A list of cities
+    :return: The key as string
+    """
+    names = '\n'.join(sorted(set(cities))).encode('utf-8')
+    return hashlib.sha1(names).hexdigest()[:16]
+
+
+def build_cache(cache_dir=None):
+    """
+    Builds the automata of the cities in Neo4j and stores them in the cache,
+    e.g. after the cities in Neo4j changed. Checkers created without a list
+    of cities load them from the cache.
+
+    :param cache_dir: Directory of the cache. Defaults to the directory
+    configured in resources.automata.
+    :return: Path of the cached automata
+    """
+    automata = _build(db_utils.city_names())
+    return _save(cache_dir or config.get('resources', 'automata'), automata)
+
+
+def pair_counts(matrix):
+    """
+    Returns the number of documents in which every pair of cities occurs,
+    from a matrix of CoOccurrenceChecker.check_many.
+
+    :param matrix: Sparse documents x cities matrix
+    :return: scipy.sparse.csr_matrix of cities x cities, the diagonal holds
+    the number of documents of every city
+    """
+    occurs = (matrix > 0).astype(np.int64)
+    return (occurs.T * occurs).tocsr()
+
 
 class CoOccurrenceChecker(object):
-    def __init__(self, cities=None):
+    def __init__(self, cities=None, cache_dir=None):
         """
         Initialises the co-occurrence checker. If a list of cities
         is provided, that list will be checked against.
-        Else, the city list is collected from Neo4j.
+        Else, the cities in Neo4j are used. Their automata are loaded from
+        the cache, or built and stored in the cache if it is empty, see
+        build_cache.
+
+        The automata are built once per list of cities in a process.
 
         :param cities: A list of cities. Defaults to None.
+        :param cache_dir: Directory of the cache. Defaults to the directory
+        configured in resources.automata, no cache if that is empty.
+        """
+        if cache_dir is None:
+            cache_dir = config.get('resources', 'automata')
+        automata = _automata_of(cities, cache_dir)
+
+        self.cities = automata['cities']
+        # Automaton to be used for Aho-Corasick
+        self.automaton = automata['automaton']
+        # Automaton to prefilter raw pages, see may_cooccur
+        self.prefilter = automata['prefilter']
+        self._unprobed = automata['unprobed']
+        # Column of every city in the matrices of check_many
+        self.columns = {city: i for i, city in enumerate(
+            collections.OrderedDict.fromkeys(self.cities))}
+
+    def may_cooccur(self, data):
+        """
+        Cheap test on the raw bytes of a page, e.g. an uncompressed WARC
+        record, to be done before extracting the text. Every city has a
+        probe, the longest ASCII word in its name. The test passes if the
+        probes of at least two distinct cities occur in the raw bytes.
+        Pages that fail the test have no co-occurrence according to check,
+        unless markup or entity references appear within a city name.
+
+        :param data: Raw page as bytes-like object or string
+        :return: False if the page can be discarded, True otherwise
         """
-        # Retrieve cities from Neo4j unless provided
-        if not cities:
-            cities = db_utils.city_names()
+        if data is None:
+            return False
+        if self._unprobed >= 2:
+            return True
+        if not len(self.prefilter):
+            return False
+        if not isinstance(data, str):
+            # Maps every byte to a character, ASCII probes match as bytes
+            data = str(data, 'latin-1')
 
-        # Create the automaton to be used for Aho-Corasick
-        self.automaton = ahocorasick.Automaton()
-        # Add all city names to the automaton
-        [self.automaton.add_word(city, city) for city in cities]
-        self.automaton.make_automaton()
+        found = set()
+        for _, cities in self.prefilter.iter(data):
+            found.update(cities)
+            if len(found) + self._unprobed >= 2:
+                return True
+        return False
 
     def check(self, page):
         """
@@ -55,27 +163,279 @@ class CoOccurrenceChecker(object):
 
         return occurrences
 
-    def _calculate_occurrences(self, page):
-        names = self.automaton.iter(page)
-        result_set = collections.OrderedDict()
-
-        prev_end, prev_name = next(names, (None, None))
-        for end, name in names:
-            # Skip words that contain city names (e.g. Amsterdammers)
-            if page[prev_end + 1] in 'abcdefghijklmnopqrstuvwxyz':
-                prev_end, prev_name = end, name
-            # Skip cities if they are part of another city (e.g. Amsterdam
-            # when Amsterdam Zuidoost occurs)
-            elif abs(end - prev_end) < len(name):
-                longer = name if len(name) > len(prev_name) else prev_name
-                result_set[longer] = None
-                prev_end, prev_name = next(names, (None, None))
+    def check_many(self, pages, counts=False):
+        """
+        Checks pages for city co-occurrences at once. The result is a
+        sparse documents x cities matrix, so pair statistics follow from
+        matrix products, see pair_counts, and it can be stored compactly
+        with scipy.sparse.save_npz.
+
+        :param pages: Iterable of strings to be checked
+        :param counts: If true, entries are the numbers of mentions of the
+        cities, else 1 for every city that occurs
+        :return: scipy.sparse.csr_matrix with a row per page and a column per
+        city, in the order of self.columns. Rows of pages without
+        co-occurrences, see check, are empty.
+        """
+        indptr = [0]
+        indices = []
+        data = []
+        for page in pages:
+            if not isinstance(page, str):
+                raise TypeError('Expected a string object but got %s'
+                                % type(page))
+            mentions = collections.Counter(self._mentions(page))
+            if 2 <= len(mentions) <= 25:
+                for city, n in mentions.items():
+                    indices.append(self.columns[city])
+                    data.append(n if counts else 1)
+            indptr.append(len(indices))
+
+        return sparse.csr_matrix(
+            (np.array(data, dtype=np.int32), np.array(indices, dtype=np.int32),
+             np.array(indptr, dtype=np.int64)),
+            shape=(len(indptr) - 1, len(self.columns)))
+
+    def check_snippets(self, page, width=SNIPPET_WIDTH,
+                       limit=SNIPPETS_PER_CITY):
+        """
+        Same as check, but also captures the context of the first mentions
+        of every city, in the same pass over the page. The snippets show
+        why a page relates cities without fetching the page again.
+
+        :param page: A string to be checked for city co-occurrences.
+        :param width: Number of characters of context on either side of a
+        mention
+        :param limit: Maximum number of snippets per city
+        :return: Occurrences, snippets tuple. The occurrences as returned by
+        check, the snippets as a dictionary of city names to lists of
+        strings, with whitespace collapsed. None, None if there are no
+        co-occurrences.
+        """
+        if not isinstance(page, str):
+            raise TypeError('Expected a string object but got %s' % type(page))
+
+        snippets = collections.OrderedDict()
+        for start, end, city in self._matches(page):
+            city_snippets = snippets.setdefault(city, [])
+            if len(city_snippets) < limit:
+                context = page[max(0, start - width):end + width]
+                city_snippets.append(' '.join(context.split()))
+
+        if not (2 <= len(snippets) <= 25):
+            return None, None
+
+        return list(snippets.keys()), dict(snippets)
+
+    @staticmethod
+    def _create_prefilter(cities):
+        # Returns the probe automaton and the number of cities without probe,
+        # which are always assumed to occur
+        probes = collections.defaultdict(list)
+        unprobed = 0
+        for city in set(cities):
+            words = ASCII_WORD_RE.findall(city)
+            if words:
+                probes[max(words, key=len)].append(city)
             else:
-                result_set[prev_name] = None
-                prev_end, prev_name = end, name
+                unprobed += 1
 
-        # Add the last occurrence
-        if prev_name:
-            result_set[prev_name] = None
+        automaton = ahocorasick.Automaton()
+        for probe, probe_cities in probes.items():
+            automaton.add_word(probe, probe_cities)
+        if probes:
+            automaton.make_automaton()
+        return automaton, unprobed
 
+    def _calculate_occurrences(self, page):
+        # Distinct cities in order of first mention
+        result_set = collections.OrderedDict.fromkeys(self._mentions(page))
         return list(result_set.keys())
+
+    def _mentions(self, page):
+        # The city of every mention in the page
+        return self._matches(page, positions=False)
+
+    def _matches(self, page, positions=True):
+        # Returns start, end, city tuples of the mentions in the page, or the
+        # cities only if not positions. Only names that start and end at a
+        # word boundary are mentions (e.g. Amsterdammers or NieuwAmsterdam
+        # don't mention Amsterdam), of overlapping mentions the leftmost
+        # longest is taken (e.g. Amsterdam Zuidoost over Amsterdam).
+        matches = []
+        if not len(self.automaton):
+            return matches
+        # Padded and normalised like the names in the automaton, so it only
+        # finds names between boundaries. Most names are a plain city. The
+        # others are compared to the page if they contain other separators
+        # than spaces, or checked against earlier mentions if they can
+        # overlap other names.
+        text = ' {0} '.format(page).translate(_separators)
+        # Start, end, index in matches of the mentions that can overlap
+        overlapping = []
+        for end, city in self.automaton.iter(text):
+            if city.__class__ is str:
+                # Positions in the page, without the padding
+                matches.append((end - len(city) - 1, end - 1, city)
+                               if positions else city)
+                continue
+
+            size, city, names, overlaps = city
+            start = end - size - 1
+            end -= 1
+            if names:
+                city = page[start:end]
+                if city not in names:
+                    continue
+            if overlaps:
+                # Mentions are found in order of end. One that overlaps
+                # earlier mentions replaces them, unless it starts after
+                # the first of them.
+                if overlapping and overlapping[-1][1] > start:
+                    i = len(overlapping) - 1
+                    while i and overlapping[i - 1][1] > start:
+                        i -= 1
+                    if overlapping[i][0] < start:
+                        continue
+                    del matches[overlapping[i][2]:]
+                    del overlapping[i:]
+                overlapping.append((start, end, len(matches)))
+            matches.append((start, end, city) if positions else city)
+        return matches
+
+
+class _Separators(dict):
+
+    """
+    Translation table of str.translate that maps characters that are not
+    word characters, except spaces, to SEPARATOR. Characters are added on
+    their first lookup.
+    """
+
+    def __missing__(self, ordinal):
+        char = chr(ordinal)
+        if not (char.isalnum() or char == '_' or char == ' '):
+            char = SEPARATOR
+        self[ordinal] = char
+        return char
+
+
+_separators = _Separators()
+
+
+def _automata_of(cities, cache_dir):
+    # Automata of the cities, or of the cities in Neo4j if None, loaded once
+    # per process. Only the latter are cached on disk.
+    key = cache_key(cities) if cities else None
+    automata = _automata.get(key)
+    if automata is not None:
+        return automata
+
+    if cities:
+        automata = _build(cities)
+    else:
+        path = os.path.join(cache_dir, CACHE_FILE) if cache_dir else None
+        automata = _load(path) if path and os.path.exists(path) else None
+        if automata is None:
+            automata = _build(db_utils.city_names())
+            if cache_dir:
+                _save(cache_dir, automata)
+    _automata[key] = automata
+    return automata
+
+
+def _build(cities):
+    # Creates the automata of a list of cities. The automaton holds the
+    # names normalised as the pages in CoOccurrenceChecker._matches, between
+    # boundaries. The value of a name is its city, or a size, city, names,
+    # overlaps tuple if it needs more checks: the names with this normalised
+    # form to compare to the page, and whether it can overlap other names.
+    names = collections.OrderedDict()
+    for city in cities:
+        names.setdefault(city.translate(_separators), set()).add(city)
+    overlapping = _overlapping(names)
+
+    automaton = ahocorasick.Automaton()
+    for name, name_cities in names.items():
+        city = next(iter(name_cities))
+        exact = len(name_cities) == 1 and SEPARATOR not in name
+        if exact and name not in overlapping:
+            value = city
+        else:
+            value = (len(name), city,
+                     None if exact else tuple(sorted(name_cities)),
+                     name in overlapping)
+        for before, after in itertools.product(BOUNDARIES, repeat=2):
+            automaton.add_word(before + name + after, value)
+    if len(automaton):
+        automaton.make_automaton()
+    prefilter, unprobed = CoOccurrenceChecker._create_prefilter(cities)
+    return {'version': CACHE_VERSION, 'key': cache_key(cities),
+            'cities': list(cities), 'automaton': automaton,
+            'prefilter': prefilter, 'unprobed': unprobed}
+
+
+def _overlapping(names):
+    # Normalised names that can overlap in a page, as they contain another
+    # name (Amsterdam Zuidoost and Zuidoost) or end with the start of
+    # another name (Bergen op and op Zoom). Names only share the boundaries
+    # around them otherwise.
+    words = {name: ' {0} '.format(name.replace(SEPARATOR, ' '))
+             for name in names}
+    overlapping = set()
+    if not words:
+        return overlapping
+    contained = ahocorasick.Automaton()
+    starts = collections.defaultdict(list)
+    for name, key in words.items():
+        contained.add_word(key, name)
+        for i in range(1, len(key) - 1):
+            if key[i] == ' ':
+                starts[key[:i + 1]].append(name)
+    contained.make_automaton()
+
+    for name, key in words.items():
+        for _, other in contained.iter(key):
+            if other != name:
+                overlapping.update((name, other))
+        for i in range(1, len(key) - 1):
+            if key[i] == ' ' and key[i:] in starts:
+                overlapping.add(name)
+                overlapping.update(starts[key[i:]])
+    return overlapping
+
+
+def _load(path):
+    try:
+        with open(path, 'rb') as f:
+            automata = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError) as e:
+        logger.warning('Could not load automata {0}: {1}'.format(path, e))
+        return None
+    if automata.get('version') != CACHE_VERSION:
+        return None
+    logger.info('Loaded automata of {0} cities from {1}'
+                .format(len(automata['cities']), path))
+    return automata
+
+
+def _save(cache_dir, automata):
+    # Written to a temporary file first, so readers never see a partial file
+    path = os.path.join(cache_dir, CACHE_FILE)
+    tmp = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(automata, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning('Could not cache automata in {0}: {1}'
+                       .format(cache_dir, e))
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+if __name__ == '__main__':
+    print(build_cache())
@@ -0,0 +1,223 @@
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+from ctypes import c_longlong
+from multiprocessing import Lock, RawArray, Value
+
+import config
+from urbansearch.utils import db_utils
+
+logger = logging.getLogger('filtering')
+
+# Seconds to wait for a lock on the exact set held by another process
+SQLITE_TIMEOUT = 60
+
+
+def from_config():
+    """
+    Creates the digest filter configured in gathering.dedup, seeded with the
+    digests of the indices stored in Neo4j if seed_from_db is set.
+
+    :return: A DigestFilter, or None if no capacity is configured
+    """
+    settings = config.get('gathering', 'dedup') or {}
+    if not settings.get('capacity'):
+        return None
+    digests = DigestFilter(settings['capacity'],
+                           settings.get('error_rate', 0.001),
+                           settings.get('path') or None)
+    if settings.get('seed_from_db'):
+        logger.info('Seeded digest filter with {0} stored indices'
+                    .format(digests.seed(db_utils.index_digests())))
+    return digests
+
+
+class DigestFilter(object):
+
+    """
+    Remembers the digests of the indices processed by all processes, so
+    content that is reachable through several urls or crawls is downloaded
+    and classified once. Digests are kept in a Bloom filter in shared memory,
+    which may take a new digest for a seen one with the configured error
+    rate. If a path is given, digests are also kept in an exact set on disk,
+    which corrects these false positives and keeps the committed digests
+    over restarts.
+
+    Checking a digest does not remember it, add the digest once its index is
+    processed, so indices that failed to download or were lost in a crash
+    are not dropped the next time. Digests that are added but not committed
+    are forgotten after a restart, commit them once the checkpoint is past
+    their indices, see checkpoint_utils.
+
+    The filter is shared with forked processes, create it before starting
+    workers.
+    """
+
+    def __init__(self, capacity, error_rate=0.001, path=None):
+        """
+        :param capacity: Expected number of distinct digests. The error rate
+        rises above error_rate when more digests are added.
+        :param error_rate: False positive rate at capacity digests
+        :param path: Path of an sqlite database holding the exact set, None
+        for the Bloom filter only
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.path = path
+        self.bits = max(8, int(math.ceil(-capacity * math.log(error_rate) /
+                                         math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+
+        self._lock = Lock()
+        self._bloom = RawArray('B', (self.bits + 7) // 8)
+        self._checked = Value(c_longlong, 0, lock=False)
+        self._duplicates = Value(c_longlong, 0, lock=False)
+        self._false_positives = Value(c_longlong, 0, lock=False)
+        self._db = None
+        self._pid = None
+        # Digests added by this process and not committed yet
+        self._uncommitted = []
+        if path:
+            # Digests of earlier runs, of indices that were not lost
+            db = self._connection()
+            db.execute('DELETE FROM digests WHERE NOT committed')
+            self.seed(digest for digest, in db.execute(
+                'SELECT digest FROM digests'))
+
+    def seen(self, digest):
+        """
+        Check whether a digest was added before, see add.
+
+        :param digest: Digest of an index
+        :return: True if the digest was added before
+        """
+        positions = self._positions(digest)
+        with self._lock:
+            self._checked.value += 1
+            seen = all(self._bloom[p >> 3] & (1 << (p & 7))
+                       for p in positions)
+
+        if seen and self.path:
+            # The exact set decides
+            seen = self._in_exact(digest)
+            if not seen:
+                with self._lock:
+                    self._false_positives.value += 1
+
+        if seen:
+            self._count_duplicate()
+        return seen
+
+    def add(self, digests):
+        """
+        Remember the digests of processed indices. In the exact set they are
+        kept over restarts once committed.
+
+        :param digests: Iterable of digests
+        """
+        digests = list(digests)
+        self.seed(digests)
+        if self.path:
+            self._connection().executemany(
+                'INSERT OR IGNORE INTO digests VALUES (?, 0)',
+                ((digest,) for digest in digests))
+            self._uncommitted.extend(digests)
+
+    def commit(self):
+        """ Keep the digests added by this process over restarts. """
+        if not self._uncommitted:
+            return
+        db = self._connection()
+        db.execute('BEGIN')
+        db.executemany('UPDATE digests SET committed = 1 WHERE digest = ?',
+                       ((digest,) for digest in self._uncommitted))
+        db.execute('COMMIT')
+        self._uncommitted.clear()
+
+    def filter(self, indices):
+        """
+        Yield the indices of which the digest was not added before, and not
+        yielded before by this call. Indices without digest are yielded as
+        well.
+
+        :param indices: Iterable of indices in JSON format
+        :return: Generator of indices
+        """
+        # Digests of the indices that are not processed yet
+        pending = set()
+        for index in indices:
+            digest = index.get('digest')
+            if not digest:
+                yield index
+            elif not self.seen(digest):
+                if digest in pending:
+                    self._count_duplicate()
+                    continue
+                pending.add(digest)
+                yield index
+
+    def seed(self, digests):
+        """
+        Add digests to the Bloom filter without counting them, e.g. the
+        digests of the indices stored before.
+
+        :param digests: Iterable of digests
+        :return: The number of digests added
+        """
+        added = 0
+        with self._lock:
+            for digest in digests:
+                for p in self._positions(digest):
+                    self._bloom[p >> 3] |= 1 << (p & 7)
+                added += 1
+        return added
+
+    def stats(self):
+        """
+        Returns the counts of all processes.
+
+        :return: Dictionary with the numbers of digests checked, duplicates,
+        false positives of the Bloom filter caught by the exact set and the
+        fraction of bits set
+        """
+        with self._lock:
+            stats = {'checked': self._checked.value,
+                     'duplicates': self._duplicates.value,
+                     'false_positives': self._false_positives.value}
+        set_bits = sum(bin(byte).count('1') for byte in bytes(self._bloom))
+        stats['fill'] = set_bits / self.bits
+        return stats
+
+    def _positions(self, digest):
+        # Bit positions of a digest, by double hashing
+        h = hashlib.md5(digest.encode('utf-8')).digest()
+        h1 = int.from_bytes(h[:8], 'little')
+        h2 = int.from_bytes(h[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _connection(self):
+        # A connection of its own per process
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT,
+                                       isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS digests '
+                             '(digest TEXT PRIMARY KEY, committed INTEGER) '
+                             'WITHOUT ROWID')
+            self._pid = os.getpid()
+            # Added by the parent process, which commits them
+            self._uncommitted = []
+        return self._db
+
+    def _in_exact(self, digest):
+        # True if the digest is in the exact set
+        return self._connection().execute(
+            'SELECT 1 FROM digests WHERE digest = ?',
+            (digest,)).fetchone() is not None
+
+    def _count_duplicate(self):
+        with self._lock:
+            self._duplicates.value += 1
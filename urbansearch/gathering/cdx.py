@@ -0,0 +1,120 @@
+import functools
+import gzip
+import json
+import logging
+import re
+
+from urbansearch.utils import gz_utils
+
+logger = logging.getLogger(__name__)
+
+STATUS_RE = re.compile(r'"status": "(\w+)",')
+STATUS_200 = '"status": "200"'
+
+# Keys every index needs to locate its part of a warc file
+INDEX_KEYS = ('digest', 'length', 'offset', 'filename')
+_REQUIRED_KEYS = frozenset(INDEX_KEYS)
+
+
+def useful_line(line):
+    """
+    Check the status code of a cdx line without parsing the JSON.
+
+    :param line: A line of a cdx file
+    :return: True iff the status code of the line is 200
+    """
+    status_code = STATUS_RE.search(line)
+    return status_code is not None and status_code.group(1) == '200'
+
+
+def parse_line(line, object_hook=None):
+    """
+    Parse the JSON part of a cdx line. Lines may be prefixed with the SURT
+    key and timestamp, as in the cdx files of Common Crawl.
+
+    :param line: A line of a cdx file
+    :param object_hook: Passed to json.loads
+    :return: The index as dictionary
+    """
+    return json.loads(line[line.find('{'):], object_hook=object_hook)
+
+
+@functools.lru_cache(maxsize=None)
+def _field_re(keys):
+    # Matches "key": "value" pairs for the given keys. Only used for lines
+    # without escaped characters, so no JSON decoding is needed.
+    return re.compile(r'"({})": "([^"]*)"'.format(
+        '|'.join(re.escape(k) for k in keys)))
+
+
+def parse_index(line, extra=()):
+    """
+    Fast path parser for cdx lines. Lines with a status code other than 200
+    are rejected before anything is allocated. For the other lines only the
+    index keys (digest, length, offset and filename) and the requested extra
+    keys (e.g. mime or languages) are extracted from the JSON text, without
+    building the full JSON object. Lines with escaped characters, e.g. in
+    the url, are decoded with json.loads instead.
+
+    :param line: A line of a cdx file
+    :param extra: Extra keys to extract if present in the line
+    :return: The index as dictionary, or None if the status is not 200
+    :raises ValueError if one of the index keys is missing
+    """
+    if STATUS_200 not in line:
+        return None
+
+    keys = INDEX_KEYS + tuple(extra)
+    if '\\' in line:
+        full = parse_line(line)
+        if full.get('status') != '200':
+            return None
+        index = {k: full[k] for k in keys if k in full}
+    else:
+        index = dict(_field_re(keys).findall(line))
+    if not index.keys() >= _REQUIRED_KEYS:
+        raise ValueError('Line is missing index keys: {}'.format(line))
+    return index
+
+
+def _parse_full(line):
+    # Slow path, keeps every key of the index
+    if not useful_line(line):
+        return None
+    return parse_line(line)
+
+
+def iter_gz_indices(filename, extra=(), full=False):
+    """
+    Stream the indices of a gzip compressed cdx file. The file is
+    decompressed and parsed line by line, so memory use does not grow with
+    the size of the file. Only indices with status code 200 are produced,
+    malformed lines are skipped.
+
+    :param filename: Path to the .gz file, or a gz_utils.GzRange to read
+    part of the file
+    :param extra: Extra keys to keep next to the index keys, see parse_index
+    :param full: Parse the complete JSON and keep all keys
+    :return: Generator of indices
+    """
+    parse = _parse_full if full else functools.partial(parse_index,
+                                                       extra=extra)
+    try:
+        with _open_gz(filename) as lines:
+            for line in lines:
+                try:
+                    index = parse(line)
+                except ValueError:
+                    logger.warning('Skipping malformed line in {0}'
+                                   .format(filename))
+                    continue
+                if index is not None:
+                    yield index
+    except (OSError, EOFError) as e:
+        logger.error('File {0} failed to read: {1}'.format(filename, e))
+
+
+def _open_gz(filename):
+    if isinstance(filename, gz_utils.GzRange):
+        return gz_utils.open_range(filename)
+    return gzip.open(filename, 'rt', encoding='utf-8', errors='replace')
@@ -0,0 +1,150 @@
+import bisect
+import collections
+import logging
+import re
+import zlib
+
+from urbansearch.gathering import cdx, gathering, local_warc, warc
+
+logger = logging.getLogger(__name__)
+
+# A gzip block of a cdx shard, listed in cluster.idx. The location is the
+# directory or url of the shard, so a block can be handed to any process.
+ClusterBlock = collections.namedtuple('ClusterBlock', ['key', 'location',
+                                                       'filename', 'offset',
+                                                       'length'])
+
+URLKEY_RE = re.compile(r'"urlkey": "([^"]*)"')
+
+
+def surt_prefixes(domain):
+    """
+    Returns the SURT key prefixes of a domain and all of its subdomains, e.g.
+    ('nl,tudelft)', 'nl,tudelft,') for tudelft.nl. A top level domain has a
+    single prefix, e.g. ('nl,',) for nl.
+
+    :param domain: Domain name
+    :return: Tuple of SURT key prefixes
+    """
+    labels = domain.strip('.').lower().split('.')
+    surt = ','.join(reversed(labels))
+    if len(labels) == 1:
+        return surt + ',',
+    return surt + ')', surt + ','
+
+
+class ClusterIndex(object):
+
+    """
+    Secondary index of a Common Crawl cdx collection, read from a local copy
+    of its cluster.idx. Every line of cluster.idx contains the first SURT key
+    of a gzip block of a cdx shard, with the shard name, offset and length of
+    the block. Binary search on these keys yields the few blocks that can
+    contain the keys of a domain, so only those blocks have to be read
+    instead of the complete shards.
+    """
+
+    def __init__(self, filename, location):
+        """
+        :param filename: Path to the cluster.idx file
+        :param location: Directory or url containing the cdx shards
+        """
+        self.keys = []
+        self.blocks = []
+        with open(filename, 'r', errors='replace') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 4:
+                    continue
+                block = ClusterBlock(fields[0], location, fields[1],
+                                     int(fields[2]), int(fields[3]))
+                self.keys.append(block.key)
+                self.blocks.append(block)
+
+    def find_blocks(self, prefixes):
+        """
+        Find the blocks that can contain keys starting with one of the
+        prefixes.
+
+        :param prefixes: Iterable of SURT key prefixes, see surt_prefixes
+        :return: List of ClusterBlocks, in order of shard and offset
+        """
+        found = set()
+        for prefix in prefixes:
+            # The block before the first block starting with the prefix can
+            # contain the prefix as well
+            first = max(bisect.bisect_left(self.keys, prefix) - 1, 0)
+            end = bisect.bisect_left(self.keys, prefix + '\uffff')
+            found.update(range(first, end))
+        return [self.blocks[i] for i in sorted(found)]
+
+
+def read_block(block, downloader=None):
+    """
+    Read and decompress a block of a cdx shard. Blocks of remote shards are
+    requested through the rate controller shared by all processes and
+    retried if the request fails, see PageDownloader.fetch_range.
+
+    :param block: A ClusterBlock
+    :param downloader: gathering.PageDownloader used for remote shards
+    :return: The uncompressed block as bytes-like object, or None if reading
+    failed
+    """
+    end = block.offset + block.length - 1
+    if local_warc.is_local(block.location):
+        content = local_warc.LocalWarcReader(block.location).read(
+            block.filename, block.offset, end)
+    else:
+        downloader = downloader or gathering.PageDownloader()
+        content = downloader.fetch_range(
+            block.location.rstrip('/') + '/' + block.filename, block.offset,
+            end)
+    if content is None:
+        return None
+
+    decoder = warc.RecordDecoder()
+    try:
+        if decoder.feed(content):
+            return decoder.getvalue()
+    except zlib.error as e:
+        logger.error('Block of {0} failed to decompress: {1}'
+                     .format(block.filename, e))
+    return None
+
+
+def iter_block_indices(block, prefixes, downloader=None, extra=()):
+    """
+    Stream the indices of a block with a SURT key starting with one of the
+    prefixes. Lines are parsed as in cdx.iter_gz_indices.
+
+    :param block: A ClusterBlock
+    :param prefixes: Iterable of SURT key prefixes
+    :param downloader: gathering.PageDownloader used for remote shards
+    :param extra: Extra keys to keep, see cdx.parse_index
+    :return: Generator of indices
+    """
+    data = read_block(block, downloader)
+    if data is None:
+        return
+
+    prefixes = tuple(prefixes)
+    for line in data.decode('utf-8', errors='replace').splitlines():
+        if not _line_key(line).startswith(prefixes):
+            continue
+        try:
+            index = cdx.parse_index(line, extra)
+        except ValueError:
+            logger.warning('Skipping malformed line in {0}'
+                           .format(block.filename))
+            continue
+        if index is not None:
+            yield index
+
+
+def _line_key(line):
+    # SURT key of a cdx line, either in front of the JSON or as its urlkey
+    if not line.startswith('{'):
+        return line.split(' ', 1)[0]
+    urlkey = URLKEY_RE.search(line)
+    return urlkey.group(1) if urlkey else ''
+
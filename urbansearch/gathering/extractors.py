@@ -0,0 +1,186 @@
+import logging
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup, UnicodeDammit
+
+import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SKIP_TAGS = ('script', 'style')
+
+# Elements without content, these never need an end tag
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img',
+                       'input', 'keygen', 'link', 'meta', 'param', 'source',
+                       'track', 'wbr'])
+# Elements in which whitespace is kept as is, the same as BeautifulSoup
+PRESERVE_TAGS = frozenset(['pre', 'textarea'])
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+def get_extractor(name=None, skip_tags=DEFAULT_SKIP_TAGS):
+    """
+    Creates the HTML to text extractor with the given name.
+
+    :param name: Name of the extractor, 'stream' or 'soup'. Read from the
+    gathering section of the config if not provided.
+    :param skip_tags: Tags of which the content is not part of the text
+    :return: An Extractor
+    """
+    name = name or config.get('gathering', 'extractor')
+    try:
+        return EXTRACTORS[name](skip_tags)
+    except KeyError:
+        raise ValueError('Unknown extractor: {0}'.format(name))
+
+
+def decode(html):
+    """
+    Decode HTML bytes to str. UTF-8 is tried first, other encodings are
+    detected the same way BeautifulSoup does. A character cut off at the end,
+    e.g. of a truncated page, is dropped.
+
+    :param html: HTML as bytes-like object or str
+    :return: HTML as str
+    """
+    if isinstance(html, str):
+        return html
+    try:
+        return str(html, 'utf-8')
+    except UnicodeDecodeError as e:
+        if e.end == len(html) and e.reason == 'unexpected end of data':
+            return str(html[:e.start], 'utf-8')
+        return UnicodeDammit(bytes(html), is_html=True).unicode_markup
+
+
+class Extractor(object):
+
+    """
+    Base class of HTML to text extractors. An extractor returns the text of
+    all elements, except for the content of the skipped tags.
+    """
+
+    def __init__(self, skip_tags=DEFAULT_SKIP_TAGS):
+        """
+        :param skip_tags: Tags of which the content is not part of the text
+        """
+        self.skip_tags = frozenset(skip_tags)
+
+    def extract(self, html):
+        """
+        Extract the plain text of an HTML document.
+
+        :param html: HTML as bytes-like object or str
+        :return: Plain text as str
+        """
+        raise NotImplementedError
+
+
+class SoupExtractor(Extractor):
+
+    """
+    Extractor that builds a BeautifulSoup tree. Slow, but lenient towards
+    badly broken HTML.
+    """
+
+    def extract(self, html):
+        if not isinstance(html, (str, bytes)):
+            html = bytes(html)
+        soup = BeautifulSoup(html, 'html.parser')
+        for element in soup(list(self.skip_tags)):
+            element.extract()
+        return soup.get_text()
+
+
+class StreamExtractor(Extractor):
+
+    """
+    Extractor that strips tags while parsing, without building a tree.
+    Produces the same text as SoupExtractor, including the way BeautifulSoup
+    collapses strings that consist of whitespace only. Unknown entity
+    references are kept as is, where BeautifulSoup drops their semicolon.
+    """
+
+    def extract(self, html):
+        parser = _TextParser(self.skip_tags)
+        parser.feed(decode(html))
+        parser.close()
+        return ''.join(parser.text)
+
+
+class _TextParser(HTMLParser):
+    # Collects text in between tags. Every tag, comment and declaration ends
+    # a string, like in BeautifulSoup.
+
+    def __init__(self, skip_tags):
+        super().__init__(convert_charrefs=True)
+        self.skip_tags = skip_tags
+        self.text = []
+        self._data = []
+        # Open tags, with the number of open skipped and preserving tags
+        self._open = []
+        self._skipping = 0
+        self._preserving = 0
+
+    def handle_starttag(self, tag, attrs):
+        self._end_string()
+        if tag in VOID_TAGS:
+            return
+        self._open.append(tag)
+        self._count(tag, 1)
+
+    def handle_startendtag(self, tag, attrs):
+        # Self-closing tags have no content
+        self._end_string()
+
+    def handle_endtag(self, tag):
+        self._end_string()
+        if tag not in self._open:
+            return
+        # Close tag and all unclosed tags opened after it
+        while True:
+            closed = self._open.pop()
+            self._count(closed, -1)
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._data.append(data)
+
+    def handle_comment(self, data):
+        self._end_string()
+
+    def handle_decl(self, decl):
+        self._end_string()
+
+    def handle_pi(self, data):
+        self._end_string()
+
+    def unknown_decl(self, data):
+        self._end_string()
+        if data.upper().startswith('CDATA['):
+            self.handle_data(data[len('CDATA['):])
+            self._end_string()
+
+    def close(self):
+        super().close()
+        self._end_string()
+
+    def _end_string(self):
+        if not self._data:
+            return
+        string = ''.join(self._data)
+        self._data = []
+        if not self._preserving and not string.strip(ASCII_SPACES):
+            string = '\n' if '\n' in string else ' '
+        self.text.append(string)
+
+    def _count(self, tag, n):
+        if tag in self.skip_tags:
+            self._skipping += n
+        if tag in PRESERVE_TAGS:
+            self._preserving += n
+
+
+EXTRACTORS = {'stream': StreamExtractor, 'soup': SoupExtractor}
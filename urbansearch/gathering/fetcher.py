@@ -0,0 +1,398 @@
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import time
+import zlib
+
+import aiohttp
+
+import config
+from urbansearch.gathering import (local_warc, range_scheduler, rate_control,
+                                   warc, warc_cache)
+from urbansearch.gathering.gathering import STREAM_CHUNK_SIZE, PageDownloader
+
+logger = logging.getLogger(__name__)
+
+
+def from_config():
+    """
+    Creates the fetcher configured in the gathering section of the config.
+    With 'sync', the default, WARC parts are downloaded one at a time by the
+    PageDownloader instead.
+
+    :return: An AsyncFetcher, or None if gathering.fetcher is sync
+    """
+    name = config.get('gathering', 'fetcher')
+    if name == 'async':
+        return AsyncFetcher()
+    if name == 'sync':
+        return None
+    raise ValueError('Unknown fetcher: {0}'.format(name))
+
+
+class AsyncFetcher(object):
+
+    """
+    Asynchronous WARC part fetcher. Keeps a bounded pool of keep-alive
+    connections to the Common Crawl data server and a configurable number of
+    range requests in flight, so that a single process no longer sits idle on
+    network latency. If cc_data is a local directory, parts are read from
+    local copies of the warc files instead, see local_warc.
+
+    Requests also count against the limit of the rate controller shared by
+    all processes, see rate_control, and are retried if they fail.
+    """
+
+    def __init__(self, max_connections=None, max_in_flight=None,
+                 cc_data=None, cache=None, rate=None):
+        """
+        Initialises the fetcher. Unless provided, the connection pool size,
+        the number of requests in flight and the cache are read from the
+        config.
+
+        :param max_connections: Maximum number of open connections
+        :param max_in_flight: Maximum number of concurrent range requests
+        :param cc_data: Prefix of the Common Crawl data url
+        :param cache: A warc_cache.WarcCache for the fetched parts
+        :param rate: A rate_control.RateController, defaults to the shared
+        controller
+        """
+        self.cc_data_prefix = cc_data or config.get('gathering', 'cc_data')
+        self.max_connections = (max_connections or
+                                config.get('gathering', 'fetch_connections'))
+        self.max_in_flight = (max_in_flight or
+                              config.get('gathering', 'fetch_in_flight'))
+        self.req_timeout = config.get('gathering', 'request_timeout')
+        self.coalesce_gap = config.get('gathering', 'coalesce_gap')
+        self.coalesce_max_size = config.get('gathering', 'coalesce_max_size')
+        self.coalesce_batch = config.get('gathering', 'coalesce_batch')
+        self.max_body_size = config.get('gathering', 'max_body_size')
+        self.rate = rate or rate_control.shared()
+        if local_warc.is_local(self.cc_data_prefix):
+            self.local_reader = local_warc.LocalWarcReader(
+                self.cc_data_prefix)
+            self.cache = None
+        else:
+            self.local_reader = None
+            self.cache = cache or warc_cache.from_config()
+
+        # Sessions and loops are bound to a process, they are (re)created
+        # lazily so a fetcher can be handed to forked workers.
+        self._pid = None
+        self._loop = None
+        self._session = None
+        self._session_loop = None
+
+    def fetch_many(self, indices):
+        """
+        Fetch the WARC parts of the given indices concurrently. Nearby parts
+        of the same warc file are fetched with a single range request, see
+        range_scheduler.coalesce. Cached parts are not fetched. Results are
+        produced in order of completion, not in the order of the indices.
+
+        :param indices: Iterable of indices in JSON format
+        :return: Asynchronous iterator of (index, data) tuples, data is the
+        uncompressed part of the warc file or None if the request failed
+        """
+        return _FetchIterator(self, indices)
+
+    def fetch_iter(self, indices, batch_size=None):
+        """
+        Blocking counterpart of fetch_many, for use outside of an event loop.
+        The indices are fetched in batches, connections are kept alive
+        between batches.
+
+        :param indices: Iterable of indices in JSON format
+        :param batch_size: Number of indices fetched per batch. Defaults to
+        four times the number of requests in flight.
+        :return: Generator of (index, data) tuples
+        """
+        batch_size = batch_size or self.max_in_flight * 4
+        loop = self._event_loop()
+        indices = iter(indices)
+
+        while True:
+            batch = list(itertools.islice(indices, batch_size))
+            if not batch:
+                break
+            for result in loop.run_until_complete(self._collect(batch)):
+                yield result
+
+    async def fetch(self, index):
+        """
+        Fetch a single WARC part using the JSON index.
+
+        :param index: Index in JSON format
+        :return: Tuple of index and the uncompressed part of the warc file,
+        or None instead of the part if the request failed
+        """
+        start, length = int(index['offset']), int(index['length'])
+        results = await self.fetch_range(range_scheduler.WarcRange(
+            index['filename'], start, start + length - 1, [index]))
+        return results[0]
+
+    async def fetch_range(self, warc_range):
+        """
+        Fetch a byte range of a warc file with a single request, retried if
+        it fails, and split it into the parts of the indices it covers.
+
+        :param warc_range: A range_scheduler.WarcRange
+        :return: List of (index, data) tuples, data is None for all indices
+        if the request failed
+        """
+        if self.local_reader:
+            return self._split(warc_range, self.local_reader.read(
+                warc_range.filename, warc_range.start, warc_range.end))
+
+        if self._streams(warc_range):
+            result = await self._retry(self._stream_range, warc_range)
+            if result is None:
+                return [(warc_range.indices[0], None)]
+            content, decoder = result
+            index = warc_range.indices[0]
+            if self.cache and len(content) == int(index['length']):
+                self.cache.put(index, content)
+            return [(index, decoder.getvalue())]
+
+        return self._split(warc_range, await self._retry(
+            self._request_range, warc_range))
+
+    async def _retry(self, request, warc_range):
+        # Await request until it succeeds or fails in a way not worth
+        # retrying, with a backoff between attempts. Returns its result.
+        for attempt in range(self.rate.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.rate.backoff(attempt - 1))
+            result, retry = await request(warc_range)
+            if not retry:
+                return result
+        logger.warning('Giving up on warc part of {0} after {1} attempts'
+                       .format(warc_range.filename, self.rate.retries + 1))
+        return None
+
+    def _streams(self, warc_range):
+        # Single parts longer than max_body_size are streamed, so their
+        # transfer can be aborted, see PageDownloader.download_warc_part
+        return (self.max_body_size and len(warc_range.indices) == 1 and
+                warc_range.end - warc_range.start + 1 > self.max_body_size)
+
+    async def _stream_range(self, warc_range):
+        # A single rate controlled range request of one part, streamed into
+        # a record decoder. Returns the compressed content received and the
+        # decoder, or None, and whether the request is worth retrying.
+        decoder = warc.RecordDecoder(self.max_body_size)
+        received = bytearray()
+        while not self.rate.try_acquire():
+            await asyncio.sleep(rate_control.POLL_INTERVAL)
+        began = time.time()
+        timeout = self.rate.timeout(self.req_timeout)
+        try:
+            # Leaving the block early closes the connection, which aborts
+            # the transfer
+            async with self._get_session().get(
+                    self.cc_data_prefix + warc_range.filename,
+                    headers={'Range': 'bytes={}-{}'.format(warc_range.start,
+                                                           warc_range.end)},
+                    timeout=aiohttp.ClientTimeout(total=None,
+                                                  sock_connect=timeout,
+                                                  sock_read=timeout)
+            ) as resp:
+                status = resp.status
+                if status == 200:
+                    # The server ignored the Range header
+                    content = await resp.read()
+                    received += content[warc_range.start:warc_range.end + 1]
+                    decoder.feed(received)
+                elif status == 206:
+                    async for chunk in resp.content.iter_chunked(
+                            STREAM_CHUNK_SIZE):
+                        received += chunk
+                        if decoder.feed(chunk):
+                            break
+        except asyncio.CancelledError:
+            self.rate.cancel()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.rate.release(False)
+            logger.warning('Exception while fetching warc part: {0}'
+                           .format(e))
+            return None, True
+        except zlib.error as e:
+            self.rate.release(True, time.time() - began, len(received))
+            logger.error('Uncompressing gz file failed with error: {0}'
+                         .format(e))
+            return None, False
+
+        throttled = status in rate_control.THROTTLE_STATUS
+        self.rate.release(not throttled, time.time() - began, len(received))
+        if status not in (200, 206):
+            logger.warning('Fetching warc part failed with status {0}'
+                           .format(status))
+            return None, throttled
+        if not decoder.done:
+            logger.error('Warc part of {0} ended before the end of its '
+                         'record'.format(warc_range.filename))
+            return None, False
+        return (received, decoder), False
+
+    async def _request_range(self, warc_range):
+        # A single rate controlled range request. Returns the content or
+        # None, and whether the request failed in a way worth retrying.
+        while not self.rate.try_acquire():
+            await asyncio.sleep(rate_control.POLL_INTERVAL)
+        began = time.time()
+        timeout = self.rate.timeout(self.req_timeout)
+        try:
+            async with self._get_session().get(
+                    self.cc_data_prefix + warc_range.filename,
+                    headers={'Range': 'bytes={}-{}'.format(warc_range.start,
+                                                           warc_range.end)},
+                    timeout=aiohttp.ClientTimeout(total=None,
+                                                  sock_connect=timeout,
+                                                  sock_read=timeout)
+            ) as resp:
+                status = resp.status
+                content = await resp.read()
+        except asyncio.CancelledError:
+            self.rate.cancel()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.rate.release(False)
+            logger.warning('Exception while fetching warc part: {0}'
+                           .format(e))
+            return None, True
+
+        throttled = status in rate_control.THROTTLE_STATUS
+        self.rate.release(not throttled, time.time() - began, len(content))
+        if status == 200:
+            # The server ignored the Range header
+            return content[warc_range.start:warc_range.end + 1], False
+        if status != 206:
+            logger.warning('Fetching warc part failed with status {0}'
+                           .format(status))
+            return None, throttled
+        return content, False
+
+    def close(self):
+        """ Close the connections held by this fetcher. """
+        if self._session and self._pid == os.getpid():
+            if self._loop and not self._loop.is_running():
+                self._loop.run_until_complete(self._session.close())
+                self._loop.close()
+        self._session = None
+        self._session_loop = None
+        self._loop = None
+
+    def _split(self, warc_range, content):
+        # Returns the (index, data) tuples of the parts in content
+        if content is None:
+            return [(index, None) for index in warc_range.indices]
+
+        results = []
+        for index, member in range_scheduler.split(warc_range, content):
+            if self.cache and len(member) == int(index['length']):
+                self.cache.put(index, member)
+            results.append((index, PageDownloader._uncompress_gz(
+                member, self.max_body_size)))
+        return results
+
+    def _split_cached(self, indices):
+        # Returns the (index, data) tuples of cached parts and the indices
+        # that still have to be fetched
+        if not self.cache:
+            return [], indices
+        cached, missing = [], []
+        for index in indices:
+            content = self.cache.get(index)
+            if content is None:
+                missing.append(index)
+            else:
+                cached.append((index, PageDownloader._uncompress_gz(
+                    content, self.max_body_size)))
+        return cached, missing
+
+    async def _collect(self, indices):
+        results = []
+        async for result in self.fetch_many(indices):
+            results.append(result)
+        return results
+
+    def _event_loop(self):
+        # Event loop used by the blocking API, one per process
+        if self._loop is None or self._pid != os.getpid():
+            self._reset()
+            self._loop = asyncio.new_event_loop()
+        return self._loop
+
+    def _get_session(self):
+        # Session of the running event loop, with a bounded connection pool
+        loop = asyncio.get_event_loop()
+        if self._pid != os.getpid():
+            self._reset()
+        if self._session is None or self._session_loop is not loop:
+            timeout = aiohttp.ClientTimeout(total=None,
+                                            sock_connect=self.req_timeout,
+                                            sock_read=self.req_timeout)
+            connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                             ssl=False)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=timeout)
+            self._session_loop = loop
+        return self._session
+
+    def _reset(self):
+        # Forget sessions and loops inherited from a parent process
+        self._pid = os.getpid()
+        self._session = None
+        self._session_loop = None
+        self._loop = None
+
+
+class _FetchIterator(object):
+    # Asynchronous iterator that keeps at most max_in_flight range requests
+    # running. Indices are read and coalesced in batches.
+    # A class instead of an async generator, which Python 3.5 lacks.
+
+    def __init__(self, fetcher, indices):
+        self._fetcher = fetcher
+        self._indices = iter(indices)
+        self._ranges = collections.deque()
+        self._pending = set()
+        self._done = collections.deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._done:
+            self._fill()
+            if self._done:
+                break
+            if not self._pending:
+                raise StopAsyncIteration
+            done, self._pending = await asyncio.wait(
+                self._pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                self._done.extend(task.result())
+        return self._done.popleft()
+
+    def _fill(self):
+        f = self._fetcher
+        while len(self._pending) < f.max_in_flight:
+            if not self._ranges:
+                batch = list(itertools.islice(self._indices,
+                                              f.coalesce_batch))
+                if not batch:
+                    break
+                cached, missing = f._split_cached(batch)
+                self._done.extend(cached)
+                self._ranges.extend(range_scheduler.coalesce(
+                    missing, f.coalesce_gap, f.coalesce_max_size,
+                    0 if f.local_reader else f.max_body_size))
+                if not self._ranges:
+                    # Every part of the batch was cached
+                    break
+            self._pending.add(asyncio.ensure_future(
+                f.fetch_range(self._ranges.popleft())))
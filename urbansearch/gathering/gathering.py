@@ -1,22 +1,29 @@
-import gzip
-import io
+import copy
+import itertools
 import json
 import logging
 import re
 import os
 import requests
+import time
+import zlib
 
 from urllib.parse import quote
-from bs4 import BeautifulSoup
 from multiprocessing import Process
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 import config
-from urbansearch.utils import process_utils
+from urbansearch.gathering import (cdx, extractors, local_warc,
+                                   range_scheduler, rate_control, warc,
+                                   warc_cache, wet)
+from urbansearch.utils import gz_utils, pipeline_utils, process_utils
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 logger = logging.getLogger(__name__)
 
+# Size of the chunks of streamed responses
+STREAM_CHUNK_SIZE = 16384
+
 
 class PageDownloader(object):
 
@@ -24,6 +31,11 @@ class PageDownloader(object):
     PageDownloader class. Creates object for a downloader with functions
     to download pages for a certain url. Also contains functions to parse
     the downloaded data to plain text.
+
+    If cc_data is a local directory instead of an url, warc parts are read
+    from local copies of the warc files, see local_warc. Otherwise requests
+    are limited and retried by the rate controller shared by all processes,
+    see rate_control.
     """
 
     def __init__(self):
@@ -31,11 +43,35 @@ class PageDownloader(object):
         self.cc_index_url = config.get('gathering', 'cc_index')
         self.indices = []
         self.req_timeout = config.get('gathering', 'request_timeout')
+        self.coalesce_gap = config.get('gathering', 'coalesce_gap')
+        self.coalesce_max_size = config.get('gathering', 'coalesce_max_size')
+        self.coalesce_batch = config.get('gathering', 'coalesce_batch')
+        self.max_body_size = config.get('gathering', 'max_body_size')
+        # Local warc files need no cache
+        self.cache = (None if local_warc.is_local(self.cc_data_prefix)
+                      else warc_cache.from_config())
+        self._local_reader = None
+        self.extractor = extractors.get_extractor()
+        self.rate = rate_control.shared()
         self.session = requests.Session()
 
         # Cache the regular expression to filter http response code
         re.compile('\'status\': \'(\w+)\',')
 
+    def clone(self):
+        """
+        Returns a copy of this downloader with a session and local warc
+        reader of its own, for use in another thread. The cache and the rate
+        controller are shared.
+
+        :return: A PageDownloader
+        """
+        clone = copy.copy(self)
+        clone.indices = []
+        clone.session = requests.Session()
+        clone._local_reader = None
+        return clone
+
     def download_indices(self, url, collection):
         """
         Download indices corresponding to url from Common Crawl collection.
@@ -71,7 +107,9 @@ class PageDownloader(object):
     def download_warc_part(self, index):
         """
         Download the part of the warc file from common crawl servers
-        using the JSON index.
+        using the JSON index. If max_body_size is configured, the part is
+        decompressed while it is downloaded and the transfer is aborted as
+        soon as the body reaches max_body_size bytes.
 
         :param index: index in JSON format
         :return: Uncompressed part of warc file if responsecode for index is
@@ -80,36 +118,273 @@ class PageDownloader(object):
         if not index:
             return None
 
+        if self._streams():
+            content = self.cache.get(index) if self.cache else None
+            if content is None:
+                return self._stream_warc_part(index)
+        else:
+            content = self.fetch_warc_part(index)
+        if content is None:
+            return None
+
+        # Response is compressed gz data, uncompress this using gzip
+        data = self._uncompress_gz(content, self.max_body_size)
+
+        return data
+
+    def fetch_warc_part(self, index):
+        """
+        Fetch the compressed part of the warc file using the JSON index.
+        Parts that were downloaded before are read from the cache, if a
+        cache is configured.
+
+        :param index: index in JSON format
+        :return: Compressed part of the warc file, or None if downloading
+        failed
+        """
+        if self.cache:
+            content = self.cache.get(index)
+            if content is not None:
+                return content
+
         start, length = int(index['offset']), int(index['length'])
-        end = start + length - 1
+        content = self._get_range(index['filename'], start,
+                                  start + length - 1)
+        if content is not None:
+            self._cache_put(index, content)
+        return content
+
+    def download_warc_parts(self, indices):
+        """
+        Download the parts of multiple indices. Indices are grouped by warc
+        file and parts close to each other are downloaded with a single
+        range request, see range_scheduler.coalesce. Parts longer than
+        max_body_size are downloaded on their own, as in download_warc_part.
+        Parts are produced in order of warc file and offset.
+
+        :param indices: Iterable of indices in JSON format
+        :return: Generator of (index, data) tuples, data is the uncompressed
+        part of the warc file or None if downloading failed
+        """
+        indices = iter(indices)
+        while True:
+            batch = list(itertools.islice(indices, self.coalesce_batch))
+            if not batch:
+                break
+
+            missing = []
+            for index in batch:
+                content = self.cache.get(index) if self.cache else None
+                if content is None:
+                    missing.append(index)
+                else:
+                    yield index, self._uncompress_gz(content,
+                                                     self.max_body_size)
+
+            max_part = self.max_body_size if self._streams() else 0
+            for warc_range in range_scheduler.coalesce(
+                    missing, self.coalesce_gap, self.coalesce_max_size,
+                    max_part):
+                if max_part and (warc_range.end - warc_range.start + 1 >
+                                 max_part):
+                    index = warc_range.indices[0]
+                    yield index, self._stream_warc_part(index)
+                    continue
+
+                content = self._get_range(warc_range.filename,
+                                          warc_range.start, warc_range.end)
+                if content is None:
+                    for index in warc_range.indices:
+                        yield index, None
+                    continue
+
+                for index, member in range_scheduler.split(warc_range,
+                                                           content):
+                    self._cache_put(index, member)
+                    yield index, self._uncompress_gz(member,
+                                                     self.max_body_size)
+
+    def fetch_range(self, url, start, end):
+        """
+        Fetch a byte range of a remote file other than a warc file, e.g. a
+        block of a cdx shard. The request is rate controlled and retried
+        like the requests for warc parts.
+
+        :param url: Url of the file
+        :param start: First byte of the range
+        :param end: Last byte of the range, inclusive
+        :return: The content of the range, or None if downloading failed
+        """
+        return self._retry(self._request_url_range, url, start, end)
+
+    def _cache_put(self, index, content):
+        # Cache complete parts only, a short response is never valid
+        if self.cache and len(content) == int(index['length']):
+            self.cache.put(index, content)
+
+    def _get_range(self, filename, start, end):
+        # Request a byte range of a warc file, returns the content or None
+        local_reader = self._local_warc_reader()
+        if local_reader:
+            return local_reader.read(filename, start, end)
+        return self._retry(self._request_range, filename, start, end)
+
+    def _retry(self, request, filename, start, end):
+        # Call request until it succeeds or fails in a way not worth
+        # retrying, with a backoff between attempts. Returns its result.
+        for attempt in range(self.rate.retries + 1):
+            if attempt:
+                time.sleep(self.rate.backoff(attempt - 1))
+            result, retry = request(filename, start, end)
+            if not retry:
+                return result
+        logger.warning('Giving up on range of {0} after {1} attempts'
+                       .format(filename, self.rate.retries + 1))
+        return None
+
+    def _streams(self):
+        # Parts are streamed if their body is limited and they are remote
+        return bool(self.max_body_size) and not self._local_warc_reader()
+
+    def _stream_warc_part(self, index):
+        # Download a part while decompressing it, the transfer is aborted
+        # once the body reaches max_body_size bytes. Returns the uncompressed
+        # part, or None if downloading failed.
+        start, length = int(index['offset']), int(index['length'])
+        result = self._retry(self._stream_range, index['filename'], start,
+                             start + length - 1)
+        if result is None:
+            return None
+        content, decoder = result
+        self._cache_put(index, content)
+        return decoder.getvalue()
+
+    def _stream_range(self, filename, start, end):
+        # A single rate controlled range request, streamed into a decoder of
+        # a single record. Returns the compressed content received and the
+        # decoder, or None, and whether the request is worth retrying.
+        decoder = warc.RecordDecoder(self.max_body_size)
+        received = bytearray()
+        self.rate.acquire()
+        began = time.time()
         try:
-            resp = self.session.get(self.cc_data_prefix + index['filename'],
+            resp = self.session.get(self.cc_data_prefix + filename,
                                     headers={
                                         'Range': 'bytes={}-{}'.format(start,
                                                                       end)},
-
-                                    timeout=self.req_timeout, verify=False)
+                                    timeout=self.rate.timeout(
+                                        self.req_timeout), verify=False,
+                                    stream=True)
+            try:
+                status = resp.status_code
+                if status == 200:
+                    # The server ignored the Range header
+                    received += resp.content[start:end + 1]
+                    decoder.feed(received)
+                elif status == 206:
+                    for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+                        received += chunk
+                        if decoder.feed(chunk):
+                            break
+            finally:
+                # Closing an unfinished response aborts the transfer
+                resp.close()
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            self.rate.release(False)
+            logger.warning('Exception while downloading warc part: {0}'
+                           .format(e))
+            return None, True
         except requests.exceptions.RequestException as e:
+            self.rate.release(False)
             logger.warning('Exception while downloading warc part: {0}'
                            .format(e))
-            return None
-
-        # Response is compressed gz data, uncompress this using gzip
-        data = self._uncompress_gz(resp)
+            return None, False
+        except zlib.error as e:
+            self.rate.release(True, time.time() - began, len(received))
+            logger.error("Uncompressing gz file failed with error: {0}"
+                         .format(e))
+            return None, False
+
+        throttled = status in rate_control.THROTTLE_STATUS
+        self.rate.release(not throttled, time.time() - began, len(received))
+        if status not in (200, 206):
+            logger.warning('Downloading warc part failed with status {0}'
+                           .format(status))
+            return None, throttled
+        if not decoder.done:
+            logger.error('Warc part of {0} ended before the end of its '
+                         'record'.format(filename))
+            return None, False
+        return (received, decoder), False
+
+    def _request_range(self, filename, start, end):
+        # A single rate controlled range request of a warc file
+        return self._request_url_range(self.cc_data_prefix + filename, start,
+                                       end)
+
+    def _request_url_range(self, url, start, end):
+        # A single rate controlled range request. Returns the content or
+        # None, and whether the request failed in a way worth retrying.
+        self.rate.acquire()
+        began = time.time()
+        try:
+            resp = self.session.get(url,
+                                    headers={
+                                        'Range': 'bytes={}-{}'.format(start,
+                                                                      end)},
 
-        return data
+                                    timeout=self.rate.timeout(
+                                        self.req_timeout), verify=False)
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            self.rate.release(False)
+            logger.warning('Exception while downloading {0}: {1}'
+                           .format(url, e))
+            return None, True
+        except requests.exceptions.RequestException as e:
+            self.rate.release(False)
+            logger.warning('Exception while downloading {0}: {1}'
+                           .format(url, e))
+            return None, False
+
+        throttled = resp.status_code in rate_control.THROTTLE_STATUS
+        self.rate.release(not throttled, time.time() - began,
+                          len(resp.content))
+        if resp.status_code == 200:
+            # The server ignored the Range header
+            return resp.content[start:end + 1], False
+        if resp.status_code != 206:
+            logger.warning('Downloading {0} failed with status {1}'
+                           .format(url, resp.status_code))
+            return None, throttled
+        return resp.content, False
+
+    def _local_warc_reader(self):
+        # Reader of the local warc files, None if cc_data is an url
+        if not local_warc.is_local(self.cc_data_prefix):
+            return None
+        if (self._local_reader is None or
+                self._local_reader.directory != self.cc_data_prefix):
+            self._local_reader = local_warc.LocalWarcReader(
+                self.cc_data_prefix)
+        return self._local_reader
 
     @staticmethod
-    def _uncompress_gz(response):
+    def _uncompress_gz(content, max_body=0):
+        # Uncompress all gzip members in content, which may be any bytes-like
+        # object. Memoryviews are decompressed without copying them first.
+        # Decompression stops once the body reaches max_body bytes.
+        decoder = warc.RecordDecoder(max_body)
         try:
-            compressed_gz = io.BytesIO(response.content)
-            with gzip.GzipFile(fileobj=compressed_gz) as gz_obj:
-                data = gz_obj.read()
-        except OSError as e:
+            if not decoder.feed(content) and len(content):
+                raise EOFError('Compressed data ended before the '
+                               'end-of-stream marker was reached')
+        except (zlib.error, EOFError) as e:
             logger.error("Uncompressing gz file failed with error: {0}"
                          .format(e))
-            data = None
-        return data
+            return None
+        return decoder.getvalue()
 
     @staticmethod
     def _useful_responsecode(index):
@@ -136,29 +411,30 @@ class PageDownloader(object):
             if not self._useful_responsecode(index):
                 indices.remove(index)
 
-    @staticmethod
-    def warc_html_to_text(data):
+    def warc_html_to_text(self, data):
         """
-        Process uncompressed warc to plain text.
+        Process uncompressed warc to plain text. Script and style statements
+        are removed by the configured extractor, see extractors.
 
-        :param data: Uncrompessed bytes of partial warc
+        :param data: Uncrompessed bytes of partial warc, as warc.Record,
+        bytes or bytearray
         :return: Plain text without warc headers
 
         """
         if data is None:
             return ''
+        if isinstance(data, warc.Record):
+            # Downloaded parts know where their body starts, the view avoids
+            # copying the page
+            return self.extractor.extract(data.body())
+
+        # Other data, e.g. read from a file, is stripped up to the html
         index = data.find("<html".encode())
 
         if index == -1:
             return ''
 
-        # Strip headers
-        data = data[index:-1]
-        soup = BeautifulSoup(data, 'html.parser')
-        # Remove style and script statements
-        for script in soup(['script', 'style']):
-            script.extract()
-        return soup.get_text()
+        return self.extractor.extract(memoryview(data)[index:-1])
 
     def index_to_txt(self, index):
         """
@@ -166,9 +442,11 @@ class PageDownloader(object):
         common crawl servers and parses to plain text.
 
         :return: Plain text of web page in str format
+        :raises ValueError if the index was read from a WET file, see
+        wet.is_wet_index
 
         """
-        data = self.download_warc_part(index)
+        data = self.download_warc_part(self._cc_index(index))
         return self.warc_html_to_text(data)
 
     def index_to_raw_text(self, index):
@@ -178,11 +456,23 @@ class PageDownloader(object):
         and other headers.
 
         :return: Raw text of web page in str format
+        :raises ValueError if the index was read from a WET file, see
+        wet.is_wet_index
 
         """
-        data = self.download_warc_part(index)
+        data = self.download_warc_part(self._cc_index(index))
         return data.decode('utf-8')
 
+    @staticmethod
+    def _cc_index(index):
+        # Indices of WET records point to local files, not to Common Crawl
+        if wet.is_wet_index(index):
+            raise ValueError('Index {0} was read from the WET file {1}, it '
+                             'can\'t be downloaded from Common Crawl'
+                             .format(index.get('digest'),
+                                     index.get('filename')))
+        return index
+
     def indices_from_file(self, filename):
         """
         Opens file with filename and parses JSON,
@@ -207,19 +497,17 @@ class PageDownloader(object):
         :param filename: Path to .gz file
         :return: Return list of indices
         """
-        with gzip.GzipFile(filename) as gz_obj:
-            # Remove the garbage before { and parse to json and add to list
-            indices = [json.loads('{' + x.split('{', 1)[-1]) for x in
-                       gz_obj.read().decode('utf-8').strip().split('\n')
-                       if self._useful_str_responsecode(x)]
-
-            self.indices += indices
-            return indices
+        indices = list(cdx.iter_gz_indices(filename, full=True))
+        self.indices += indices
+        return indices
 
     def run_workers(self, num_workers, directory, queue, **kwargs):
         """ Run workers to process indices from a directory with files
         in parallel. All parsed indices will be added to the queue.
 
+        Workers take files or ranges of large gzip files from a shared task
+        queue until all are done, see pipeline_utils.task_queue.
+
         :num_workers: Number of workers that will run
         :directory: Path to directory containing files
         :queue: multiprocessing.Queue where the indices will be added to
@@ -232,9 +520,13 @@ class PageDownloader(object):
 
         files = [_file.path for _file in os.scandir(directory)
                  if _file.is_file()]
+        if kwargs.get('gz', True):
+            # Let several workers decompress parts of large files
+            files = gz_utils.split_files(
+                files, num_workers * pipeline_utils.UNITS_PER_WORKER)
 
-        div_files = process_utils.divide_files(files, num_workers)
-        workers = [Process(target=self.worker, args=(queue, div_files[i],
+        tasks = pipeline_utils.task_queue(files, num_workers)
+        workers = [Process(target=self.worker, args=(queue, tasks,
                                                      kwargs.get('gz', True)))
                    for i in range(num_workers)]
 
@@ -252,32 +544,35 @@ class PageDownloader(object):
         .gz files containing indices.
 
         :queue: multiprocessing.JoinableQueue to put results in
-        :files: List of filepaths to files that this worker will use
+        :files: List of filepaths to files or gz_utils.GzRanges of files that
+        this worker will use, or a task queue of them, see
+        pipeline_utils.task_queue
         :gz: Use .gz files or not, default: True.
         """
         if gz:
-            for file in files:
-                if file.endswith('.gz'):
-                    for index in self._worker_indices_from_gz_file(file):
+            for file in pipeline_utils.iter_tasks(files):
+                if gz_utils.is_gz(file):
+                    for index in self.iter_indices_from_gz_file(file):
                         queue.put(index)
         else:
-            for file in files:
+            for file in pipeline_utils.iter_tasks(files):
                 for index in self.indices_from_file(file):
                     queue.put(index)
 
+    def iter_indices_from_gz_file(self, filename, extra=()):
+        """
+        Stream the indices of a compressed gz file, in constant memory.
+        Indices are stripped to minimal information (digest, length, offset
+        and filename) and are not added to this PageDownloader.
+
+        :param filename: Path to .gz file, or a gz_utils.GzRange of a file
+        :param extra: Extra keys to keep, e.g. mime or languages
+        :return: Generator of indices
+        """
+        return cdx.iter_gz_indices(filename, extra)
+
     def _worker_indices_from_gz_file(self, filename):
-        with gzip.GzipFile(filename) as gz_obj:
-            indices = []
-            try:
-                # Strips JSON to minimal information (length, offset & name)
-                indices = [json.loads(x, object_hook=self._remove_keys)
-                           for x in
-                           gz_obj.read().decode('utf-8').strip().split('\n')
-                           if self._useful_str_responsecode(x)]
-            except OSError as e:
-                logger.error('File {0} failed to read: {1}'.format(filename,
-                                                                   e))
-            return indices
+        return list(self.iter_indices_from_gz_file(filename))
 
     @staticmethod
     def _remove_keys(json_dict):
@@ -1,20 +1,48 @@
 import os
 import itertools
 import logging
+import time
 from json.decoder import JSONDecodeError
-from multiprocessing import Process
+from multiprocessing import Process, Queue
+from queue import Empty, Queue as ThreadQueue
+from threading import Thread
 
-from urbansearch.gathering import gathering
-from urbansearch.filtering import cooccurrence
-from urbansearch.utils import process_utils, db_utils, progress_utils
+from urbansearch.gathering import cluster_index, gathering, rate_control
+from urbansearch.filtering import cdx_filter, cooccurrence, dedup
+from urbansearch.utils import (checkpoint_utils, process_utils, db_utils,
+                               gz_utils, pipeline_utils, progress_utils)
 logger = logging.getLogger(__name__)
 
+DEFAULT_DOMAINS = ('nl',)
+
 
 class IndicesSelector(object):
 
-    def __init__(self, cities=None):
+    def __init__(self, cities=None, fetcher=None, snippet_width=0):
+        """
+        Initialises the selector.
+
+        :param cities: List of cities to check against. Defaults to the
+        cities stored in Neo4j.
+        :param fetcher: Optional fetcher.AsyncFetcher, used to download the
+        WARC parts of the indices concurrently.
+        :param snippet_width: Characters of context on either side of the
+        city mentions captured in the same pass as the co-occurrences, see
+        CoOccurrenceChecker.check_snippets. 0 captures no snippets.
+        """
         self.page_downloader = gathering.PageDownloader()
         self.occurrence_checker = cooccurrence.CoOccurrenceChecker(cities)
+        self.fetcher = fetcher
+        self.snippet_width = snippet_width
+        # Filter on cdx metadata, see gathering.cdx_filter in the config
+        self.cdx_filter = cdx_filter.from_config()
+        # Digests seen by all workers, see gathering.dedup in the config
+        self.dedup = dedup.from_config()
+        # Progress of the workers, to resume after a restart
+        self.checkpoint = checkpoint_utils.from_config('indices')
+        # Queues the consumers of the relevant indices acknowledge them on,
+        # one per worker, see run_workers and run_pipeline
+        self.acks = None
 
     def relevant_indices_from_dir(self, directory):
         """ Check all files in a directory and parse indices in the files
@@ -40,64 +68,258 @@ class IndicesSelector(object):
         :returns: List of relevant indices, in python JSON format
 
         """
+        return self._relevant_indices(self._indices_from_file(filepath),
+                                      to_database, worker, progress)
+
+    def relevant_indices_from_block(self, block, prefixes, to_database=False,
+                                    worker=False, progress=False):
+        """ Collect the indices of a block of a cdx shard with a SURT key
+        starting with one of the prefixes and return the relevant ones, see
+        relevant_indices_from_file.
+
+        :block: cluster_index.ClusterBlock to read
+        :prefixes: SURT key prefixes, see cluster_index.surt_prefixes
+        :to_database: Store the indices and co-occurrences in the database
+        :returns: List of relevant indices, in python JSON format
+        """
+        indices = self._indices_from_block(block, prefixes,
+                                           self.page_downloader)
+        return self._relevant_indices(indices, to_database, worker,
+                                      progress)
+
+    def relevant_texts_from_file(self, filepath, progress=False):
+        """ Collect all indices from file and yield the relevant ones
+        together with their co-occurrences, plain text and snippets, so the
+        text does not have to be downloaded again.
+
+        :filepath: Path to the file containing indices
+        :returns: Generator of (index, co-occurrences, text, snippets)
+        tuples, snippets None without a snippet width
+        """
+        for result in self._iter_relevant(self._indices_from_file(filepath),
+                                          progress):
+            yield result
+            # The caller is done with the index once it asks for the next
+            self._finish(result[0])
+
+    def _work_units(self, directory, parts, kwargs):
+        # Files, ranges of files or cdx blocks to divide among workers, and
+        # the SURT key prefixes to select from blocks
+        if kwargs.get('cluster_idx'):
+            prefixes = [prefix for domain in kwargs.get('domains',
+                                                        DEFAULT_DOMAINS)
+                        for prefix in cluster_index.surt_prefixes(domain)]
+            return cluster_index.ClusterIndex(
+                kwargs['cluster_idx'], directory).find_blocks(prefixes), \
+                prefixes
+
+        files = [_file.path for _file in os.scandir(directory)
+                 if _file.is_file()]
+        # Let several workers decompress parts of large files
+        return gz_utils.split_files(files, parts), ()
+
+    def _unit_indices(self, unit, prefixes, pd):
+        # Filtered indices of a work unit, see _work_units
+        if isinstance(unit, cluster_index.ClusterBlock):
+            return self._indices_from_block(unit, prefixes, pd)
+        return self._indices_from_file(unit)
+
+    def _indices_from_block(self, block, prefixes, pd):
+        indices = cluster_index.iter_block_indices(block, prefixes, pd,
+                                                   self._filter_keys())
+        return self._filter(indices)
+
+    def _resume(self, unit, indices, completions=None):
+        # Chunks of the indices of a unit that were not processed before a
+        # restart. Without a checkpoint all indices form a single chunk.
+        # The unit advances past a chunk once the caller asks for the next.
+        # With checkpoint_utils.Completions, the chunks hold index,
+        # acknowledgement tuples instead and the unit advances past the
+        # indices that are acknowledged.
+        checkpoint = self.checkpoint
+        if not checkpoint:
+            yield indices
+            return
+
+        key = checkpoint_utils.unit_key(unit)
+        if checkpoint.done(key):
+            return
+        position = checkpoint.position(key)
+        indices = itertools.islice(indices, position, None)
+        while True:
+            chunk = list(itertools.islice(
+                indices, self.page_downloader.coalesce_batch))
+            if not chunk:
+                break
+            if completions:
+                yield [(index, (key, completions.issue(key, position + n)))
+                       for n, index in enumerate(chunk, 1)]
+                position += len(chunk)
+                continue
+            yield chunk
+            # The caller is done with the chunk once it asks for the next
+            position += len(chunk)
+            checkpoint.update(key, position)
+        if completions:
+            completions.close(key)
+        else:
+            checkpoint.complete(key)
+
+    def _indices_from_file(self, filepath):
         pd = self.page_downloader
         try:
-            if filepath.endswith('.gz'):
-                indices = pd._worker_indices_from_gz_file(filepath)
+            if gz_utils.is_gz(filepath):
+                indices = pd.iter_indices_from_gz_file(filepath,
+                                                       self._filter_keys())
             else:
                 indices = pd.indices_from_file(filepath)
         except JSONDecodeError:
             logger.error('File {0} doesn\'t contain correct indices'
                          .format(filepath))
-            indices = None
+            return []
+        return self._filter(indices)
+
+    def _filter(self, indices):
+        # Drop indices rejected by the cdx filter, before downloading
+        if self.cdx_filter:
+            return self.cdx_filter.filter(indices)
+        return indices
 
-        return self._relevant_indices(indices, to_database, worker, progress)
+    def _filter_keys(self):
+        # Metadata to keep when parsing cdx lines, for the cdx filter
+        return self.cdx_filter.keys if self.cdx_filter else ()
 
     def _relevant_indices(self, indices, to_database, worker, progress=False):
+        relevant_indices = []
+
+        for index, co_occ, _, snippets in self._iter_relevant(indices,
+                                                               progress):
+            if to_database:
+                db_utils.store_index(index, co_occ)
+            # If called from workers, return tuple to add to queue
+            if worker:
+                relevant_indices.append(_item(index, co_occ, snippets))
+            else:
+                relevant_indices.append(index)
+            self._remember([index.get('digest')])
+
+        return relevant_indices
+
+    def _iter_relevant(self, indices, progress=False, finish=None):
+        # Yields index, co-occurrences, text, snippets tuples of relevant
+        # indices, the caller finishes them. The other indices that were
+        # downloaded are passed to finish, which remembers their digests by
+        # default.
+        if finish is None:
+            finish = self._finish
         pd = self.page_downloader
         occ = self.occurrence_checker
-        relevant_indices = []
 
-        for index in indices:
+        for index, data in self._warc_parts(indices):
             if progress:
                 with progress_utils.ind_counter_lock:
                     progress_utils.ind_counter.value += 1
-            try:
-                co_occ = occ.check(pd.index_to_txt(index))
-            except (UnicodeDecodeError, TypeError) as e:
-                logger.warning("Could not convert index to txt: {0}".format(e))
+            if data is None:
+                continue
+            # Most pages mention less than two cities, discard those before
+            # extracting the text
+            co_occ = None
+            if occ.may_cooccur(data):
+                try:
+                    text = pd.warc_html_to_text(data)
+                    co_occ, snippets = self._check(text)
+                except (UnicodeDecodeError, TypeError) as e:
+                    logger.warning("Could not convert index to txt: {0}"
+                                   .format(e))
 
             if co_occ:
-                if to_database:
-                    db_utils.store_index(index, co_occ)
-                # If called from workers, return tuple to add to queue
-                if worker:
-                    relevant_indices.append((index, co_occ))
-                else:
-                    relevant_indices.append(index)
+                yield index, co_occ, text, snippets
+            else:
+                finish(index)
 
-        return relevant_indices
+    def _check(self, text):
+        # Returns the co-occurrences of a text, and the snippets of the
+        # mentions if a snippet width is set, None otherwise
+        if self.snippet_width:
+            return self.occurrence_checker.check_snippets(text,
+                                                          self.snippet_width)
+        return self.occurrence_checker.check(text), None
+
+    def _warc_parts(self, indices):
+        # Yields index, uncompressed warc part tuples. Downloads concurrently
+        # if an asynchronous fetcher is available.
+        indices = self._dedup(indices)
+        if self.fetcher:
+            return self.fetcher.fetch_iter(indices)
+        return self.page_downloader.download_warc_parts(indices)
+
+    def _dedup(self, indices):
+        # Drop indices with content processed before, right before
+        # downloading, so checkpoint positions count the same indices after a
+        # restart
+        if self.dedup:
+            return self.dedup.filter(indices)
+        return indices
+
+    def _finish(self, index):
+        # Done with an index without a consumer to acknowledge it
+        self._remember([index.get('digest')])
+
+    def _remember(self, digests):
+        # Remember the digests of processed indices. With a checkpoint they
+        # are committed once it is written, after the positions past their
+        # indices, so the indices replayed after a restart are not dropped.
+        digests = [digest for digest in digests if digest]
+        if not self.dedup or not digests:
+            return
+        self.dedup.add(digests)
+        if self.checkpoint:
+            self.checkpoint.on_flush(self.dedup.commit)
+        else:
+            self.dedup.commit()
 
     def run_workers(self, num_workers, directory, queue, **kwargs):
         """ Run workers to process indices from a directory with files
         in parallel. All parsed indices will be added to the queue.
 
+        If a cluster.idx is passed, the directory is the location of the cdx
+        shards, a directory or url. Only the blocks of the shards that can
+        contain indices of the domains are read, see cluster_index.
+
+        Workers take files, ranges of large gzip files or cdx blocks from a
+        shared task queue until all are done, see pipeline_utils.task_queue.
+
+        If a checkpoint is configured, the consumers of the queue acknowledge
+        the indices once their results are stored, on the queue of the
+        worker in self.acks that the acknowledgement routes to, see
+        Workers.classifying_worker. The work units only advance past indices
+        that are acknowledged, see checkpoint_utils.Completions, and the
+        workers wait for the acknowledgements before they are done.
+
         :num_workers: Number of workers that will run
         :directory: Path to directory containing files
         :queue: multiprocessing.Queue where the indices will be added to
         :opt: Determine optimal number of workers and ignore num_workers
         parameter
+        :cluster_idx: Passed in kwargs. Path to the cluster.idx of the shards
+        :domains: Passed in kwargs. Domains to select indices of when using
+        cluster_idx. Default: nl
         """
         if kwargs.get('opt', False):
             num_workers = process_utils.compute_num_workers()
 
-        files = [_file.path for _file in os.scandir(directory)
-                 if _file.is_file()]
-
-        div_files = process_utils.divide_files(files, num_workers)
-        workers = [Process(target=self.worker, args=(queue, div_files[i],
+        files, prefixes = self._work_units(
+            directory, num_workers * pipeline_utils.UNITS_PER_WORKER, kwargs)
+        tasks = pipeline_utils.task_queue(files, num_workers)
+        self.acks = None
+        if self.checkpoint:
+            self.acks = [Queue() for _ in range(num_workers)]
+        workers = [Process(target=self.worker, args=(queue, tasks,
                                                      kwargs.get('progress',
-                                                                False)))
+                                                                False),
+                                                     prefixes,
+                                                     self.acks and
+                                                     self.acks[i], i))
                    for i in range(num_workers)]
 
         for worker in workers:
@@ -107,19 +329,326 @@ class IndicesSelector(object):
             # Wait for processes to finish
             for worker in workers:
                 worker.join()
+            if self.cdx_filter:
+                logger.info('Indices rejected by the cdx filter: {0}'
+                            .format(self.cdx_filter.stats()))
+            if self.dedup:
+                logger.info('Duplicate digests: {0}'
+                            .format(self.dedup.stats()))
+            logger.info('Requests to Common Crawl: {0}'
+                        .format(rate_control.shared().stats()))
+        else:
+            return workers
+
+    def run_pipeline(self, directory, queue, **kwargs):
+        """ Select relevant indices with a pipeline of stages connected by
+        bounded queues, so downloading, extracting and matching overlap:
+
+        fetch: threads read the indices of the files and download their
+        WARC parts, all in one process
+        extract: processes extract the text of parts that may contain a
+        co-occurrence
+        match: processes check the texts for co-occurrences and put the
+        index, co-occurrences tuples of relevant indices on the queue, with
+        the snippets of the mentions if a snippet width is set
+
+        Each stage has its own number of workers and throughput counters,
+        which are logged when the pipeline is done, see
+        pipeline_utils.Stage.stats.
+
+        If a checkpoint is configured, the work units are resumed as in
+        run_workers. The extract and match stages acknowledge every part
+        they drop, the consumers of the queue the relevant ones once their
+        results are stored, on self.acks as in run_workers. A unit only
+        advances past parts that are done, see checkpoint_utils.Completions.
+
+        :directory: Path to directory containing files, or the location of
+        the cdx shards if cluster_idx is passed, see run_workers
+        :queue: multiprocessing.Queue where the relevant indices will be
+        added to
+        :fetchers: Passed in kwargs. Number of fetch threads. Default: 8
+        :extractors: Passed in kwargs. Number of extract processes.
+        Default: 2
+        :matchers: Passed in kwargs. Number of match processes. Default: 1
+        :queue_size: Passed in kwargs. Size of the queues between stages.
+        Default: 1000
+        :join: Passed in kwargs. Wait for the pipeline to finish. Default:
+        True
+        :return: List of multiprocessing.Process if join = False
+        """
+        fetchers = kwargs.get('fetchers', 8)
+        extractors = kwargs.get('extractors', 2)
+        matchers = kwargs.get('matchers', 1)
+        queue_size = kwargs.get('queue_size', 1000)
+
+        units, prefixes = self._work_units(directory, fetchers, kwargs)
+        self.stages = (pipeline_utils.Stage('fetch', fetchers, extractors),
+                       pipeline_utils.Stage('extract', extractors, matchers),
+                       pipeline_utils.Stage('match', matchers))
+        fetch, extract, match = self.stages
+        parts = Queue(queue_size)
+        texts = Queue(queue_size)
+        # Acknowledgements of the parts that are done, for the checkpoint
+        self.acks = [Queue()] if self.checkpoint else None
+        acks = self.acks and self.acks[0]
+
+        workers = [Process(target=self.fetch_stage,
+                           args=(units, parts, fetch, prefixes, acks))]
+        workers += [Process(target=self.extract_stage,
+                            args=(parts, texts, extract,
+                                  kwargs.get('progress', False), acks))
+                    for _ in range(extractors)]
+        workers += [Process(target=self.match_stage,
+                            args=(texts, queue, match, acks))
+                    for _ in range(matchers)]
+
+        for worker in workers:
+            worker.start()
+
+        if kwargs.get('join', True):
+            for worker in workers:
+                worker.join()
+            for stage in self.stages:
+                logger.info('Pipeline stage {0}: {1}'
+                            .format(stage.name, stage.stats()))
         else:
             return workers
 
-    def worker(self, queue, files, progress=False):
+    def fetch_stage(self, units, parts, stage, prefixes=(), acks=None):
+        """ Fetch stage of run_pipeline. Runs stage.workers threads that
+        take work units, read their indices and download the WARC parts.
+        Puts index, part, acknowledgement tuples on the parts queue.
+
+        :units: List of filepaths, gz_utils.GzRanges or
+        cluster_index.ClusterBlocks
+        :parts: Queue of the extract stage
+        :stage: pipeline_utils.Stage of this stage
+        :prefixes: SURT key prefixes of the indices to select from blocks
+        :acks: Queue of the acknowledgements of the later stages, None
+        without a checkpoint
+        """
+        completions = None
+        if acks is not None:
+            completions = checkpoint_utils.Completions(self.checkpoint,
+                                                       self._remember)
+        todo = ThreadQueue()
+        for unit in units:
+            todo.put(unit)
+        threads = [Thread(target=self._fetch_thread,
+                          args=(todo, parts, stage, prefixes, completions,
+                                acks))
+                   for _ in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if completions:
+            # The parts are done once the later stages acknowledged them
+            completions.receive(acks, wait=True)
+            self.checkpoint.flush()
+
+    def _fetch_thread(self, todo, parts, stage, prefixes, completions=None,
+                      acks=None):
+        # A session of its own per thread, the rate limit is shared
+        pd = self.page_downloader.clone()
+        while True:
+            try:
+                unit = todo.get_nowait()
+            except Empty:
+                break
+
+            indices = self._unit_indices(unit, prefixes, pd)
+            for chunk in self._resume(unit, indices, completions):
+                if not completions:
+                    chunk = ((index, None) for index in chunk)
+                self._fetch_chunk(chunk, parts, stage, pd, completions)
+                if completions:
+                    completions.receive(acks)
+        stage.finish(parts)
+
+    def _fetch_chunk(self, chunk, parts, stage, pd, completions):
+        # Downloads the parts of a chunk of index, acknowledgement tuples.
+        # Parts that are not passed on are finished right away.
+        issued = {}
+
+        def issue():
+            for index, ack in chunk:
+                issued[id(index)] = ack
+                yield index
+
+        began = time.time()
+        for index, data in pd.download_warc_parts(self._dedup(issue())):
+            ack = issued.pop(id(index))
+            stage.count(1, data is not None, time.time() - began)
+            if data is not None:
+                if ack:
+                    # Remembered once the unit advances past the part
+                    ack += (index.get('digest'),)
+                parts.put((index, data, ack))
+            elif ack:
+                completions.finish(*ack)
+            began = time.time()
+        # Indices dropped before downloading
+        for ack in issued.values():
+            if ack:
+                completions.finish(*ack)
+
+    def extract_stage(self, parts, texts, stage, progress=False, acks=None):
+        """ Extract stage of run_pipeline. Extracts the text of the parts
+        that may contain a co-occurrence and puts index, text,
+        acknowledgement tuples on the texts queue.
+
+        :parts: Queue of this stage
+        :texts: Queue of the match stage
+        :stage: pipeline_utils.Stage of this stage
+        :acks: Queue to acknowledge the parts without text on
+        """
+        pd = self.page_downloader
+        occ = self.occurrence_checker
+        for index, data, ack in pipeline_utils.iter_queue(parts):
+            began = time.time()
+            if progress:
+                with progress_utils.ind_counter_lock:
+                    progress_utils.ind_counter.value += 1
+            text = None
+            if occ.may_cooccur(data):
+                try:
+                    text = pd.warc_html_to_text(data)
+                except (UnicodeDecodeError, TypeError) as e:
+                    logger.warning("Could not convert index to txt: {0}"
+                                   .format(e))
+            stage.count(1, bool(text), time.time() - began)
+            if text:
+                texts.put((index, text, ack))
+            else:
+                self._done(acks, index, ack)
+        stage.finish(texts)
+
+    def match_stage(self, texts, queue, stage, acks=None):
+        """ Match stage of run_pipeline. Checks the texts for
+        co-occurrences and puts index, co-occurrences tuples of relevant
+        indices on the queue, with the snippets if a snippet width is set
+        and the acknowledgement if there is a checkpoint, see _item.
+
+        :texts: Queue of this stage
+        :queue: Output queue of the pipeline
+        :stage: pipeline_utils.Stage of this stage
+        :acks: Queue to acknowledge the texts without co-occurrences on
+        """
+        for index, text, ack in pipeline_utils.iter_queue(texts):
+            began = time.time()
+            co_occ, snippets = self._check(text)
+            stage.count(1, bool(co_occ), time.time() - began)
+            if co_occ:
+                # Acknowledged by the consumer, on the only queue
+                queue.put(_item(index, co_occ, snippets,
+                                ack and (0,) + ack))
+                if ack is None:
+                    self._finish(index)
+            else:
+                self._done(acks, index, ack)
+        stage.finish(queue)
+
+    def _done(self, acks, index, ack):
+        # Tell the fetch stage that the part of ack is done. Without a
+        # checkpoint, the digest of the index is remembered right away.
+        if ack is not None:
+            acks.put(ack)
+        else:
+            self._finish(index)
+
+    def worker(self, queue, files, progress=False, prefixes=(), acks=None,
+               route=0):
         """
         Worker that will parse indices from files in file list and put the
-        results in a Queue. Can use plain text files containing indices or
-        .gz files containing indices.
+        results in a Queue: index, co-occurrences tuples, with the snippets
+        of the mentions if a snippet width is set and an acknowledgement if
+        acks is passed, see _item. Can use plain text files containing
+        indices, .gz files containing indices or blocks of cdx shards.
 
         :queue: multiprocessing.JoinableQueue to put results in
-        :files: List of filepaths to files that this worker will use
+        :files: List of filepaths, gz_utils.GzRanges or
+        cluster_index.ClusterBlocks that this worker will use, or a task
+        queue of them, see pipeline_utils.task_queue
+        :prefixes: SURT key prefixes of the indices to select from blocks
+        :acks: Queue the consumers acknowledge the results on, with a
+        checkpoint. The checkpoint then only advances past acknowledged
+        indices, otherwise past the queued ones.
+        :route: Number of the acks queue, put first in the
+        acknowledgements
+        """
+        if acks is None:
+            for file in pipeline_utils.iter_tasks(files):
+                for index, co_occ, _, snippets in self.iter_relevant(
+                        file, prefixes, progress):
+                    queue.put(_item(index, co_occ, snippets))
+            if self.checkpoint:
+                self.checkpoint.flush()
+            return
+
+        completions = checkpoint_utils.Completions(self.checkpoint,
+                                                   self._remember)
+        for file in pipeline_utils.iter_tasks(files):
+            indices = self._unit_indices(file, prefixes,
+                                         self.page_downloader)
+            for chunk in self._resume(file, indices, completions):
+                self._select_chunk(chunk, queue, progress, completions,
+                                   route)
+                completions.receive(acks)
+        # The indices are done once the consumers acknowledged them
+        completions.receive(acks, wait=True)
+        self.checkpoint.flush()
+
+    def _select_chunk(self, chunk, queue, progress, completions, route):
+        # Queues the relevant indices of a chunk of index, acknowledgement
+        # tuples with their acknowledgement. The other indices are finished
+        # right away.
+        issued = {id(index): ack for index, ack in chunk}
+
+        def finish(index):
+            completions.finish(*issued.pop(id(index)), index.get('digest'))
+
+        for index, co_occ, _, snippets in self._iter_relevant(
+                (index for index, _ in chunk), progress, finish):
+            # Remembered once the unit advances past the index
+            ack = (route,) + issued.pop(id(index)) + (index.get('digest'),)
+            queue.put(_item(index, co_occ, snippets, ack))
+        # Indices dropped before downloading or that failed to download
+        for ack in issued.values():
+            completions.finish(*ack)
+
+    def iter_relevant(self, unit, prefixes=(), progress=False):
+        """
+        Yield the relevant indices of a work unit together with their
+        co-occurrences, plain text and the snippets of the mentions.
+
+        If a checkpoint is configured, see checkpoint_utils, the indices are
+        processed in chunks. The checkpoint advances past a chunk once the
+        caller asks for the results after it, so work that was completed
+        before a restart is skipped.
+
+        :param unit: A filepath, gz_utils.GzRange or
+        cluster_index.ClusterBlock
+        :param prefixes: SURT key prefixes of the indices to select from
+        blocks
+        :return: Generator of (index, co-occurrences, text, snippets)
+        tuples, snippets None without a snippet width
         """
-        for file in files:
-            for index in self.relevant_indices_from_file(file, worker=True,
-                                                         progress=progress):
-                queue.put(index)
+        indices = self._unit_indices(unit, prefixes, self.page_downloader)
+        for chunk in self._resume(unit, indices):
+            for result in self._iter_relevant(chunk, progress):
+                yield result
+                # The caller is done with the index once it asks for the next
+                self._finish(result[0])
+
+
+def _item(index, co_occ, snippets, ack=None):
+    # Queue item of a relevant index: index, co-occurrences, with the
+    # snippets if captured and the acknowledgement if any. An
+    # acknowledgement is a route, key, number, digest tuple: the number of
+    # the acks queue to put the rest of it on, see run_workers.
+    if ack is not None:
+        return index, co_occ, snippets, ack
+    if snippets is not None:
+        return index, co_occ, snippets
+    return index, co_occ
@@ -0,0 +1,77 @@
+import collections
+import logging
+import mmap
+import os
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Number of warc files kept mapped per reader
+MAX_OPEN_FILES = 64
+
+
+def is_local(cc_data):
+    """
+    Check whether the Common Crawl data prefix is a local directory instead
+    of an http(s) url.
+
+    :param cc_data: The cc_data prefix, e.g. from the config
+    :return: True iff cc_data is not an http(s) url
+    """
+    return urlparse(cc_data).scheme not in ('http', 'https')
+
+
+class LocalWarcReader(object):
+
+    """
+    Reads byte ranges of local copies of warc files. Files are memory
+    mapped, ranges are returned as memoryview slices of the mapping, so
+    reading a part copies no data. The most recently used files stay
+    mapped.
+    """
+
+    def __init__(self, directory, max_open=MAX_OPEN_FILES):
+        """
+        :param directory: Directory containing the warc files, with the
+        same layout as the Common Crawl data server
+        :param max_open: Maximum number of files kept mapped
+        """
+        self.directory = directory
+        self.max_open = max_open
+        self._maps = collections.OrderedDict()
+
+    def read(self, filename, start, end):
+        """
+        Read a byte range of a warc file.
+
+        :param filename: Path of the warc file, relative to the directory
+        :param start: Offset of the first byte
+        :param end: Offset of the last byte, inclusive
+        :return: memoryview of the range, or None if the file can't be read
+        """
+        view = self._map(filename)
+        if view is None:
+            return None
+        return view[start:end + 1]
+
+    def _map(self, filename):
+        # Returns a memoryview of the whole file, mapping it if needed
+        view = self._maps.get(filename)
+        if view is not None:
+            self._maps.move_to_end(filename)
+            return view
+
+        try:
+            with open(os.path.join(self.directory, filename), 'rb') as f:
+                view = memoryview(mmap.mmap(f.fileno(), 0,
+                                            access=mmap.ACCESS_READ))
+        except (OSError, ValueError) as e:
+            logger.warning('Exception while reading warc file: {0}'
+                           .format(e))
+            return None
+
+        self._maps[filename] = view
+        if len(self._maps) > self.max_open:
+            # The mapping is closed when the last view on it is released
+            self._maps.popitem(last=False)
+        return view
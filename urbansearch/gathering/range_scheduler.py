@@ -0,0 +1,75 @@
+import collections
+
+# A range request on a single warc file, covering the parts of all indices.
+# The end of the range is inclusive, like in the HTTP Range header.
+WarcRange = collections.namedtuple('WarcRange', ['filename', 'start', 'end',
+                                                 'indices'])
+
+
+def coalesce(indices, max_gap, max_size=0, max_part=0):
+    """
+    Group indices by warc file and merge the byte ranges of the indices into
+    as few range requests as possible. Two ranges are merged if the gap
+    between them is at most max_gap bytes. A negative max_gap disables
+    merging, every index then gets a range of its own.
+
+    :param indices: Iterable of indices in JSON format
+    :param max_gap: Maximum number of unused bytes between merged parts
+    :param max_size: Maximum size of a merged range in bytes, 0 for no limit
+    :param max_part: Parts longer than this number of bytes are never
+    merged, so they can be fetched on their own. 0 for no limit.
+    :return: List of WarcRange tuples
+    """
+    files = collections.OrderedDict()
+    for index in indices:
+        files.setdefault(index['filename'], []).append(index)
+
+    ranges = []
+    for filename, file_indices in files.items():
+        file_indices.sort(key=lambda i: int(i['offset']))
+        start, end, merged = None, None, []
+
+        for index in file_indices:
+            offset = int(index['offset'])
+            last = offset + int(index['length']) - 1
+            if max_part and last - offset + 1 > max_part:
+                if merged:
+                    ranges.append(WarcRange(filename, start, end, merged))
+                    merged = []
+                ranges.append(WarcRange(filename, offset, last, [index]))
+                continue
+            if merged and _mergeable(start, end, offset, last, max_gap,
+                                     max_size):
+                end = max(end, last)
+                merged.append(index)
+            else:
+                if merged:
+                    ranges.append(WarcRange(filename, start, end, merged))
+                start, end, merged = offset, last, [index]
+
+        if merged:
+            ranges.append(WarcRange(filename, start, end, merged))
+    return ranges
+
+
+def _mergeable(start, end, offset, last, max_gap, max_size):
+    # Parts are sorted by offset, so only the gap after end matters
+    if max_gap < 0 or offset - end - 1 > max_gap:
+        return False
+    return not max_size or max(end, last) - start + 1 <= max_size
+
+
+def split(warc_range, content):
+    """
+    Split the content of a range request back into the gzip members of the
+    indices it covers. Members are memoryview slices of content, no data is
+    copied.
+
+    :param warc_range: The WarcRange that was requested
+    :param content: The response content of the range request
+    :return: Generator of (index, member) tuples
+    """
+    view = memoryview(content)
+    for index in warc_range.indices:
+        offset = int(index['offset']) - warc_range.start
+        yield index, view[offset:offset + int(index['length'])]
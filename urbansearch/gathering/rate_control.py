@@ -0,0 +1,205 @@
+import logging
+import random
+import time
+from ctypes import c_double, c_longlong
+from multiprocessing import Lock, Value
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes that signal throttling or overload of the server
+THROTTLE_STATUS = frozenset([429, 500, 502, 503, 504])
+# Interval in seconds between attempts to acquire a slot
+POLL_INTERVAL = 0.01
+# Weight of the latest latency in the moving average
+LATENCY_WEIGHT = 0.1
+# Timeouts are at least this multiple of the average latency
+TIMEOUT_FACTOR = 4
+
+_shared = None
+
+
+def from_config():
+    """
+    Creates the rate controller configured in gathering.rate_control.
+
+    :return: A RateController
+    """
+    settings = config.get('gathering', 'rate_control') or {}
+    return RateController(**settings)
+
+
+def shared():
+    """
+    Returns the rate controller of this process tree, created from the
+    config on first use. Processes forked after its creation share its
+    limit and counters, so create it before starting workers, e.g. by
+    creating a PageDownloader.
+
+    :return: A RateController
+    """
+    global _shared
+    if _shared is None:
+        _shared = from_config()
+    return _shared
+
+
+class RateController(object):
+
+    """
+    Limits the number of requests in flight to the Common Crawl servers,
+    over all processes sharing the controller. The limit adapts to the
+    server with additive increase, multiplicative decrease (AIMD): every
+    fast successful request raises it by increase / limit, so by about
+    increase per round of requests, while a timeout, a throttling response
+    or a slow request cuts it by the decrease factor. A cut happens at most
+    once per cooldown, so a burst of failures counts as one.
+
+    Failed requests are retried after a jittered exponential backoff, see
+    backoff.
+    """
+
+    def __init__(self, initial=16, minimum=1, maximum=256, increase=1.0,
+                 decrease=0.5, target_latency=2.0, cooldown=1.0, retries=3,
+                 backoff_base=0.5, backoff_max=30.0):
+        """
+        :param initial: Initial limit of requests in flight
+        :param minimum: Lower bound of the limit
+        :param maximum: Upper bound of the limit
+        :param increase: Increase of the limit per round of fast requests
+        :param decrease: Factor the limit is multiplied with on a failure
+        :param target_latency: Requests taking longer than this number of
+        seconds decrease the limit
+        :param cooldown: Minimum number of seconds between decreases
+        :param retries: Number of retries of a failed request
+        :param backoff_base: Backoff of the first retry in seconds
+        :param backoff_max: Maximum backoff in seconds
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # A single lock keeps the shared state consistent
+        self._lock = Lock()
+        self._limit = Value(c_double, min(max(initial, minimum), maximum),
+                            lock=False)
+        self._in_flight = Value(c_longlong, 0, lock=False)
+        self._latency = Value(c_double, 0, lock=False)
+        self._last_decrease = Value(c_double, 0, lock=False)
+        self._successes = Value(c_longlong, 0, lock=False)
+        self._failures = Value(c_longlong, 0, lock=False)
+        self._retries = Value(c_longlong, 0, lock=False)
+        self._bytes = Value(c_longlong, 0, lock=False)
+        self._started = Value(c_double, time.time(), lock=False)
+
+    @property
+    def limit(self):
+        """ Current limit of requests in flight. """
+        return int(self._limit.value)
+
+    def try_acquire(self):
+        """
+        Take a slot for a request if the limit allows it. A taken slot must
+        be given back with release or cancel.
+
+        :return: True if a slot was taken
+        """
+        with self._lock:
+            if self._in_flight.value >= int(self._limit.value):
+                return False
+            self._in_flight.value += 1
+            return True
+
+    def acquire(self):
+        """ Take a slot for a request, waiting until the limit allows it. """
+        while not self.try_acquire():
+            time.sleep(POLL_INTERVAL)
+
+    def release(self, success, latency=0, nbytes=0):
+        """
+        Give back the slot of a finished request and adapt the limit.
+
+        :param success: False if the request timed out or was throttled
+        :param latency: Duration of the request in seconds
+        :param nbytes: Number of bytes received
+        """
+        with self._lock:
+            self._in_flight.value -= 1
+            self._bytes.value += nbytes
+            if success:
+                self._successes.value += 1
+                self._latency.value += LATENCY_WEIGHT * (
+                    latency - self._latency.value)
+            else:
+                self._failures.value += 1
+
+            if success and latency <= self.target_latency:
+                self._limit.value = min(self._limit.value + self.increase /
+                                        self._limit.value, self.maximum)
+            elif time.time() - self._last_decrease.value >= self.cooldown:
+                self._last_decrease.value = time.time()
+                self._limit.value = max(self._limit.value * self.decrease,
+                                        self.minimum)
+                logger.debug('Request limit decreased to {0:.1f}'
+                             .format(self._limit.value))
+
+    def cancel(self):
+        """ Give back the slot of an abandoned request, the limit is kept. """
+        with self._lock:
+            self._in_flight.value -= 1
+
+    def backoff(self, attempt):
+        """
+        Returns the delay before a retry, drawn uniformly from zero up to an
+        exponentially growing bound, so that retries of processes that
+        failed at the same time are spread out. Counts the retry.
+
+        :param attempt: Number of the failed attempt, starting at 0
+        :return: Delay in seconds
+        """
+        with self._lock:
+            self._retries.value += 1
+        return random.uniform(0, min(self.backoff_max,
+                                     self.backoff_base * 2 ** attempt))
+
+    def timeout(self, minimum):
+        """
+        Returns the timeout of a request, which grows with the average
+        latency when the server slows down.
+
+        :param minimum: Minimum timeout in seconds, e.g. the configured
+        request_timeout
+        :return: Timeout in seconds
+        """
+        return max(minimum, TIMEOUT_FACTOR * self._latency.value)
+
+    def stats(self):
+        """
+        Returns the state of the controller and the counts of all processes.
+
+        :return: Dictionary with the current concurrency and limit, the
+        success rate, the number of bytes received and bytes per second since
+        creation, the average latency and the numbers of successes, failures
+        and retries
+        """
+        with self._lock:
+            successes = self._successes.value
+            failures = self._failures.value
+            elapsed = time.time() - self._started.value
+            return {'concurrency': self._in_flight.value,
+                    'limit': self.limit,
+                    'success_rate': (successes / (successes + failures)
+                                     if successes + failures else 1.0),
+                    'bytes': self._bytes.value,
+                    'bytes_per_sec': self._bytes.value / max(elapsed, 1e-9),
+                    'latency': self._latency.value,
+                    'successes': successes,
+                    'failures': failures,
+                    'retries': self._retries.value}
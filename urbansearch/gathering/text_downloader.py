@@ -1,23 +1,38 @@
+import logging
 import os
 import sys
 from argparse import ArgumentParser
 from multiprocessing import Process
 
-from urbansearch.gathering import gathering, indices_selector
-from urbansearch.utils import process_utils, progress_utils
+import config
+from urbansearch.gathering import (fetcher, gathering, indices_selector,
+                                   rate_control)
+from urbansearch.utils import (checkpoint_utils, gz_utils, pipeline_utils,
+                               process_utils, progress_utils, shard_utils)
+
+logger = logging.getLogger(__name__)
 
 
 class TextDownloader(object):
 
     def __init__(self):
         self.pd = gathering.PageDownloader()
-        self.ind = indices_selector.IndicesSelector()
+        # Download concurrently if gathering.fetcher is async
+        self.ind = indices_selector.IndicesSelector(
+            fetcher=fetcher.from_config())
+        # Progress of the workers, to resume after a restart
+        self.ind.checkpoint = checkpoint_utils.from_config('texts')
+        # Write a text file per page, or shards, see shard_utils
+        self.output_format = config.get('gathering', 'output_format')
 
     def run_workers(self, num_workers, directory, output_dir,  **kwargs):
         """ Run workers to process indices from a directory with files
         in parallel. For each index the part will be downloaded and written
         in plain text to the output directory.
 
+        Workers take files or ranges of large gzip files from a shared task
+        queue until all are done, see pipeline_utils.task_queue.
+
         :num_workers: Number of workers that will run
         :directory: Path to directory containing index files
         :output_dir: Output directory for plain text files
@@ -30,9 +45,12 @@ class TextDownloader(object):
 
         files = [_file.path for _file in os.scandir(directory)
                  if _file.is_file()]
+        # Let several workers decompress parts of large files
+        files = gz_utils.split_files(
+            files, num_workers * pipeline_utils.UNITS_PER_WORKER)
 
-        div_files = process_utils.divide_files(files, num_workers)
-        workers = [Process(target=self.worker, args=(div_files[i], output_dir,
+        tasks = pipeline_utils.task_queue(files, num_workers)
+        workers = [Process(target=self.worker, args=(tasks, output_dir,
                                                      i, kwargs.get('gz', True),
                                                      kwargs.get('progress',
                                                                 False)))
@@ -47,31 +65,64 @@ class TextDownloader(object):
         # Wait for processes to finish
         for worker in workers:
             worker.join()
+        logger.info('Requests to Common Crawl: {0}'
+                    .format(rate_control.shared().stats()))
 
     def worker(self, files, output_dir, w_id, gz=True, progress=False):
         """
         Worker that will parse indices from files in file list and put the
         write the results to separate files. Uses .gz files as input.
 
-        :files: List of filepaths to files that this worker will use
+        If gathering.output_format is shard, the results are written to the
+        shards W{w_id}-n.shard instead, see shard_utils.ShardWriter.
+
+        :files: List of filepaths or gz_utils.GzRanges of files that this
+        worker will use, or a task queue of them, see
+        pipeline_utils.task_queue
         :output_dir: Output directory for the separate text files
         :w_id: Id of this worker, to prevent writing to same file
         :gz: Use .gz files or not, default: True.
         """
-        rlv_indices = self.ind.relevant_indices_from_file
-        if gz:
-            for file in files:
-                if file.endswith('.gz'):
-                    for i, index in enumerate(rlv_indices(file,
-                                                          progress=True)):
-                        if progress:
-                            with progress_utils.counter_lock:
-                                progress_utils.counter.value += 1
-                        txt = self.pd.index_to_txt(index)
-                        if txt is None:
-                            continue
-                        self._write_txt_file_index(index, txt, output_dir,
-                                                   (w_id, i))
+        # Numbers the files of this worker, over all of its work units. When
+        # resuming, after the files written before the restart.
+        written = 0
+        if self.ind.checkpoint:
+            written = self._next_file_number(output_dir, w_id)
+        shards = None
+        if self.output_format == 'shard':
+            shards = shard_utils.ShardWriter(
+                output_dir, 'W{0}'.format(w_id),
+                config.get('gathering', 'shard_block_size'),
+                config.get('gathering', 'shard_size'))
+        try:
+            if gz:
+                for file in pipeline_utils.iter_tasks(files):
+                    if gz_utils.is_gz(file):
+                        for index, _, txt, _ in self.ind.iter_relevant(
+                                file, progress=True):
+                            if progress:
+                                with progress_utils.counter_lock:
+                                    progress_utils.counter.value += 1
+                            if shards:
+                                shards.write(index, txt)
+                            else:
+                                self._write_txt_file_index(
+                                    index, txt, output_dir, (w_id, written))
+                            written += 1
+        finally:
+            if shards:
+                shards.close()
+        if self.ind.checkpoint:
+            self.ind.checkpoint.flush()
+
+    @staticmethod
+    def _next_file_number(output_dir, w_id):
+        # Number after the highest number of the files of worker w_id
+        prefix = 'W{0}-'.format(w_id)
+        numbers = [int(name[len(prefix):-4]) for name in os.listdir(output_dir)
+                   if name.startswith(prefix) and name.endswith('.txt') and
+                   name[len(prefix):-4].isdigit()]
+        return max(numbers) + 1 if numbers else 0
 
     def _write_txt_file_index(self, index, text, output_dir, name):
         # Write index on first line of file, append the text
@@ -0,0 +1,139 @@
+import zlib
+
+# zlib window bits for data with a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+HEADER_END = b'\r\n\r\n'
+# Output size per decompression step while the headers are not yet found
+HEADER_STEP = 16384
+
+
+class Record(bytearray):
+
+    """
+    A decoded WARC record, see RecordDecoder.getvalue. Knows where its body
+    starts, so the body does not have to be searched for again.
+    """
+
+    body_offset = 0
+
+    def body(self):
+        """
+        Returns the body of the record, see RecordDecoder.body.
+
+        :return: memoryview of the body
+        """
+        return memoryview(self)[self.body_offset:]
+
+
+class RecordDecoder(object):
+
+    """
+    Incremental decoder of gzip compressed WARC records. Compressed data is
+    fed in chunks of any bytes-like type, e.g. memoryviews of a response or a
+    memory mapped file. The end of the WARC headers and of the HTTP headers
+    is found while decompressing, so decompression can stop as soon as the
+    body reaches max_body bytes.
+
+    Data of multiple gzip members, one record each, is decoded as a whole.
+    """
+
+    def __init__(self, max_body=0):
+        """
+        :param max_body: Maximum size of the body in bytes, 0 for no limit
+        """
+        self.max_body = max_body
+        self.truncated = False
+        # Offset of the body in the decoded data, None until the headers
+        # have been decoded
+        self.body_offset = None
+        self._data = Record()
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        self._warc_header_end = None
+        self._scanned = 0
+
+    @property
+    def done(self):
+        """ True if the record is complete or its body is truncated. """
+        return self.truncated or self._decompressor.eof
+
+    def feed(self, chunk):
+        """
+        Decompress the next chunk of compressed data.
+
+        :param chunk: Compressed data, as bytes-like object
+        :return: True if no more data is needed, see done
+        :raises zlib.error if the data is not valid gzip data
+        """
+        if self._decompressor.eof and chunk:
+            # Start of the next gzip member
+            self._decompressor = zlib.decompressobj(GZIP_WBITS)
+
+        while chunk and not self.truncated:
+            decompressor = self._decompressor
+            self._data += decompressor.decompress(chunk, self._room())
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                if chunk:
+                    self._decompressor = zlib.decompressobj(GZIP_WBITS)
+            else:
+                chunk = decompressor.unconsumed_tail
+
+            if self.body_offset is None:
+                self._find_body()
+            self._limit_body()
+        return self.done
+
+    def getvalue(self):
+        """
+        Returns the decoded record. The returned Record is not copied,
+        don't feed more data while using it.
+
+        :return: The record as Record, truncated after max_body bytes of
+        body
+        """
+        self._data.body_offset = self._body_start()
+        return self._data
+
+    def body(self):
+        """
+        Returns the body of the record, the content after the HTTP headers.
+
+        :return: memoryview of the body
+        """
+        return memoryview(self._data)[self._body_start():]
+
+    def _body_start(self):
+        if self.body_offset is None:
+            # Records without HTTP headers, or an incomplete record
+            return (self._warc_header_end
+                    if self.done and self._warc_header_end else 0)
+        return self.body_offset
+
+    def _room(self):
+        # Maximum output size of the next decompression step, 0 is unlimited
+        if not self.max_body:
+            return 0
+        if self.body_offset is None:
+            return HEADER_STEP
+        return max(self.body_offset + self.max_body - len(self._data), 1)
+
+    def _find_body(self):
+        # Scan the new data for the ends of the WARC and HTTP headers
+        start = max(self._scanned - len(HEADER_END) + 1, 0)
+        self._scanned = len(self._data)
+        end = self._data.find(HEADER_END, start)
+        while end != -1:
+            end += len(HEADER_END)
+            if self._warc_header_end is None:
+                self._warc_header_end = end
+            else:
+                self.body_offset = end
+                return
+            end = self._data.find(HEADER_END, end)
+
+    def _limit_body(self):
+        if (self.max_body and self.body_offset is not None and
+                len(self._data) - self.body_offset >= self.max_body):
+            if len(self._data) - self.body_offset > self.max_body:
+                del self._data[self.body_offset + self.max_body:]
+            self.truncated = not self._decompressor.eof
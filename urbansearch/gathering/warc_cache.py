@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from ctypes import c_longlong
+from multiprocessing import Lock, Value
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Digests are base32 encoded, anything else is hashed to a safe file name
+SAFE_KEY_RE = re.compile(r'^[A-Za-z0-9]+$')
+TMP_PREFIX = '.tmp-'
+
+# Fraction of the size cap that remains after eviction, so that eviction
+# does not run on every write once the cache is full.
+EVICT_TARGET = 0.9
+
+
+def from_config():
+    """
+    Creates the cache configured in the gathering section of the config.
+
+    :return: A WarcCache, or None if no cache directory is configured
+    """
+    directory = config.get('gathering', 'cache_dir')
+    if not directory:
+        return None
+    return WarcCache(directory, config.get('gathering', 'cache_size'))
+
+
+class WarcCache(object):
+
+    """
+    Content-addressed on-disk cache of compressed WARC parts. Entries are
+    keyed by the digest of an index, or by filename, offset and length if
+    the index has no digest. Writes are atomic, so the cache can be shared
+    by processes. The least recently used entries are evicted once the size
+    cap is exceeded, recency is tracked with file modification times.
+
+    Counters and the cache size are shared with forked processes, create the
+    cache before starting workers.
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        :param directory: Directory to store the cache in
+        :param max_size: Size cap of the cache in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = Value(c_longlong, 0)
+        self.misses = Value(c_longlong, 0)
+        # Total size of the entries, -1 until the directory has been scanned
+        self._size = Value(c_longlong, -1)
+        self._evict_lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(index):
+        """
+        Returns the cache key of an index.
+
+        :param index: Index in JSON format
+        :return: The key as string
+        """
+        digest = index.get('digest')
+        if digest and SAFE_KEY_RE.match(digest):
+            return digest
+        location = '{}:{}:{}'.format(index['filename'], index['offset'],
+                                     index['length'])
+        return hashlib.sha1(location.encode('utf-8')).hexdigest()
+
+    def get(self, index):
+        """
+        Returns the cached part of an index and marks it as recently used.
+
+        :param index: Index in JSON format
+        :return: The compressed part, or None if it is not cached
+        """
+        path = self._path(self.key(index))
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            self._count(self.misses)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted by another process in the meantime
+            pass
+        self._count(self.hits)
+        return content
+
+    def put(self, index, content):
+        """
+        Stores the compressed part of an index. The entry becomes visible to
+        other processes only when it has been written completely. An entry
+        that is already cached, e.g. stored by another worker that fetched
+        the same digest, is kept and only counted once.
+
+        :param index: Index in JSON format
+        :param content: The compressed part, as bytes-like object
+        """
+        path = self._path(self.key(index))
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        prefix=TMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            # Unlike a rename, a link fails if another process stored the
+            # entry in the meantime
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return
+        except OSError as e:
+            logger.error('Caching warc part failed: {0}'.format(e))
+            return
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+        if self._grow(len(content)) > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is below its
+        size cap again.
+        """
+        with self._evict_lock:
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            target = self.max_size * EVICT_TARGET
+
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+            with self._size.get_lock():
+                self._size.value = total
+
+    def stats(self):
+        """
+        Returns the cache statistics, shared by all processes.
+
+        :return: Dictionary with hits, misses and size in bytes
+        """
+        return {'hits': self.hits.value,
+                'misses': self.misses.value,
+                'size': max(self._size.value, 0)}
+
+    def _path(self, key):
+        # Spread entries over subdirectories to keep directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        # Yields (path, size, mtime) tuples of all entries
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.startswith(TMP_PREFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def _grow(self, size):
+        # Adds size to the shared cache size and returns the new total
+        with self._size.get_lock():
+            if self._size.value < 0:
+                self._size.value = sum(s for _, s, _ in self._entries())
+            else:
+                self._size.value += size
+            return self._size.value
+
+    @staticmethod
+    def _count(counter):
+        with counter.get_lock():
+            counter.value += 1
@@ -0,0 +1,163 @@
+import logging
+import os
+import zlib
+
+import config
+from urbansearch.gathering import extractors
+from urbansearch.utils import gz_utils
+
+logger = logging.getLogger(__name__)
+
+# zlib window bits for data with a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+HEADER_END = b'\r\n\r\n'
+CHUNK_SIZE = 65536
+# WARC type of the records containing the text of a page
+CONVERSION = 'conversion'
+# Source of the indices of WET records, they are not in the Common Crawl
+# cdx index and can't be downloaded from the Common Crawl data
+SOURCE = 'wet'
+
+
+def is_wet_index(index):
+    """
+    Check whether an index was read from a WET file, see WetReader.
+
+    :param index: Index in JSON format
+    :return: True iff the index points to a record of a WET file
+    """
+    return bool(index) and index.get('source') == SOURCE
+
+
+class WetReader(object):
+
+    """
+    Reads the plain text of pages from local Common Crawl WET files. The
+    text was extracted from the HTML by Common Crawl, so it can be fed
+    directly to CoOccurrenceChecker and ClassifyText.
+
+    Every record is a gzip member of the WET file. Records are mapped to
+    indices of the same shape as cdx indices, with the path of the WET file
+    relative to the WET root, the offset and length of the member in the WET
+    file and the digest of the text. The indices also hold source 'wet' and
+    the record id of the WARC record the text was converted from
+    (refers_to), see is_wet_index.
+
+    Note that the digest differs from the digest of the same page in the
+    cdx index, WET files don't contain the latter. Digests of WET records
+    only deduplicate against other WET records.
+    """
+
+    def __init__(self, max_text_size=None, root=None):
+        """
+        :param max_text_size: Maximum size of the text of a record in bytes,
+        0 for no limit. Defaults to gathering.max_body_size in the config.
+        :param root: Directory the filenames of the indices are relative
+        to. Defaults to the directory of each WET file.
+        """
+        if max_text_size is None:
+            max_text_size = config.get('gathering', 'max_body_size') or 0
+        self.max_text_size = max_text_size
+        self.root = root
+
+    def iter_records(self, unit):
+        """
+        Stream the text records of a WET file, decompressing one record at a
+        time.
+
+        :param unit: Path to a WET file or a GzRange of one
+        :return: Generator of (index, text) tuples
+        """
+        if isinstance(unit, gz_utils.GzRange):
+            filename, start, end = unit
+        else:
+            filename, start, end = unit, 0, None
+
+        name = os.path.relpath(filename,
+                               self.root or os.path.dirname(filename))
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            for offset, length, record in _iter_members(f, start, end):
+                parsed = self.parse_record(record)
+                if parsed is None:
+                    continue
+                digest, text, refers_to = parsed
+                index = {'digest': digest, 'filename': name,
+                         'offset': str(offset), 'length': str(length),
+                         'source': SOURCE, 'refers_to': refers_to}
+                yield index, text
+
+    def parse_record(self, record):
+        """
+        Parse an uncompressed WET record.
+
+        :param record: The record as bytes-like object
+        :return: (digest, text, refers_to) tuple, or None if the record does
+        not contain the text of a page. refers_to is the record id of the
+        WARC record the text was converted from, '' if it is unknown.
+        """
+        header_end = record.find(HEADER_END)
+        if header_end == -1:
+            return None
+        headers = _parse_headers(bytes(record[:header_end]))
+        if headers.get('warc-type') != CONVERSION:
+            return None
+
+        body = memoryview(record)[header_end + len(HEADER_END):]
+        try:
+            body = body[:int(headers['content-length'])]
+        except (KeyError, ValueError):
+            pass
+        if self.max_text_size:
+            body = body[:self.max_text_size]
+
+        digest = headers.get('warc-block-digest', '')
+        return (digest.split(':', 1)[-1], extractors.decode(body),
+                headers.get('warc-refers-to', ''))
+
+
+def _parse_headers(data):
+    # Lower case WARC header names mapped to their values
+    headers = {}
+    for line in data.decode('utf-8', errors='replace').split('\r\n')[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def _iter_members(f, start, end):
+    # Yields offset, length and uncompressed data of every gzip member read
+    # from f, which is positioned at start. Stops at end if it is not None.
+    offset = pos = start
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    data = bytearray()
+    chunk = b''
+    while True:
+        if not chunk:
+            size = CHUNK_SIZE if end is None else min(CHUNK_SIZE, end - pos)
+            chunk = f.read(size) if size > 0 else b''
+            if not chunk:
+                break
+
+        try:
+            data += decompressor.decompress(chunk)
+        except zlib.error as e:
+            logger.error('WET file {0} failed to decompress at {1}: {2}'
+                         .format(f.name, offset, e))
+            return
+
+        if decompressor.eof:
+            member_end = pos + len(chunk) - len(decompressor.unused_data)
+            yield offset, member_end - offset, data
+            offset = pos = member_end
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+            data = bytearray()
+        else:
+            pos += len(chunk)
+            chunk = b''
+
+    if data or pos > offset:
+        logger.warning('WET file {0} ends with an incomplete record at {1}'
+                       .format(f.name, offset))
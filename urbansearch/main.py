@@ -1,10 +1,15 @@
 import logging
+import os
 from multiprocessing import Manager
 from argparse import ArgumentParser
 from flask import Flask, request
-from urbansearch.gathering import indices_selector, gathering
+
+import config
+from urbansearch.filtering import dedup
+from urbansearch.gathering import fetcher, indices_selector, gathering
 from urbansearch import workers
-from urbansearch.utils import db_utils, progress_utils
+from urbansearch.utils import (checkpoint_utils, db_utils, gz_utils,
+                               pipeline_utils, progress_utils, store_utils)
 
 LOGGER = logging.getLogger(__name__)
 app = Flask(__name__)
@@ -46,15 +51,18 @@ def classify_documents_from_indices(pworkers=1, cworkers=1, directory=None,
     if directory:
         LOGGER.info("Using files from dir: {0}".format(directory))
 
-    ind_sel = indices_selector.IndicesSelector()
-    cworker = workers.Workers()
+    # Download concurrently if gathering.fetcher is async
+    fetch = fetcher.from_config()
+    ind_sel = indices_selector.IndicesSelector(fetcher=fetch)
+    cworker = workers.Workers(fetcher=fetch, store=store_utils.from_config())
     man = Manager()
     queue = man.Queue()
 
-    producers = ind_sel.run_workers(pworkers, directory, queue, join=False,
-                                    progress=False)
+    producers = _run_producers(ind_sel, pworkers, directory, queue,
+                               progress=False)
     consumers = cworker.run_classifying_workers(cworkers, queue, threshold,
-                                                join=False, progress=progress)
+                                                join=False, progress=progress,
+                                                acks=ind_sel.acks)
     if progress:
         progress_utils.print_progress(directory, pre_downloaded=False,
                                       indices_progress=True)
@@ -86,15 +94,21 @@ def classify_indices_to_db(pworkers=1, cworkers=1, directory=None,
     if directory:
         LOGGER.info("Using files from dir: {0}".format(directory))
 
-    ind_sel = indices_selector.IndicesSelector()
-    cworker = workers.Workers()
+    # Download concurrently if gathering.fetcher is async. The snippets are
+    # captured while selecting the indices, and stored by the classifiers.
+    fetch = fetcher.from_config()
+    ind_sel = indices_selector.IndicesSelector(
+        fetcher=fetch,
+        snippet_width=config.get('classification', 'snippet_width'))
+    cworker = workers.Workers(fetcher=fetch, store=store_utils.from_config())
     man = Manager()
     queue = man.Queue()
 
-    producers = ind_sel.run_workers(pworkers, directory, queue, join=False)
+    producers = _run_producers(ind_sel, pworkers, directory, queue)
     consumers = cworker.run_classifying_workers(cworkers, queue, threshold,
                                                 join=False, to_db=False,
-                                                progress=progress)
+                                                progress=progress,
+                                                acks=ind_sel.acks)
     if progress:
         progress_utils.print_progress(directory, pre_downloaded=False)
 
@@ -120,7 +134,11 @@ def classify_textfiles_to_db(num_cworkers, directory, threshold, to_db=False,
     if directory:
         LOGGER.info("Using files from dir: {0}".format(directory))
 
-    w_factory = workers.Workers()
+    # Resume reading after the files read before a restart
+    w_factory = workers.Workers(
+        checkpoint=checkpoint_utils.from_config('read_files'),
+        store=store_utils.from_config(),
+        snippet_width=config.get('classification', 'snippet_width'))
     man = Manager()
     queue = man.Queue(10000)
 
@@ -138,6 +156,48 @@ def classify_textfiles_to_db(num_cworkers, directory, threshold, to_db=False,
     _join_file_workers(w_factory, producer, consumers)
 
 
+def classify_wet_files_to_db(num_rworkers, num_cworkers, directory,
+                             threshold, to_db=False, progress=False):
+    """ Run workers to classify the text records of the WET files in a
+    directory, without downloading or parsing HTML. Database must be online
+    if to_db is True.
+
+    :num_rworkers: Number of workers reading the WET files
+    :num_cworkers: Number of consuming workers, classifying the records from
+    the queue.
+    :directory: Path to directory containing WET files (.gz)
+    :to_db: Output results to database specified in config
+    """
+    if to_db and not db_utils.connected_to_db():
+        LOGGER.error("No database connection!")
+        return
+
+    LOGGER.info("Using WET files from dir: {0}".format(directory))
+    files = [_file.path for _file in os.scandir(directory)
+             if _file.is_file() and _file.name.endswith('.gz')]
+    # Let several workers read parts of large files
+    files = gz_utils.split_files(
+        files, num_rworkers * pipeline_utils.UNITS_PER_WORKER)
+
+    # Text that was read before, e.g. from another crawl, is skipped
+    w_factory = workers.Workers(
+        dedup=dedup.from_config(), store=store_utils.from_config(),
+        snippet_width=config.get('classification', 'snippet_width'))
+    man = Manager()
+    queue = man.Queue(10000)
+
+    producers = w_factory.run_read_wet_workers(num_rworkers, files, queue,
+                                               join=False, root=directory)
+    consumers = w_factory.run_classifying_workers(num_cworkers, queue,
+                                                  threshold, join=False,
+                                                  to_db=to_db,
+                                                  pre_downloaded=True,
+                                                  progress=progress)
+
+    # Join all workers when done
+    _join_file_workers(w_factory, producers, consumers)
+
+
 def create_ic_relations_to_db(num_workers, to_db=False):
     """
     Creates intercity relations and stores them in the database if desired.
@@ -165,6 +225,20 @@ def create_ic_relations_to_db(num_workers, to_db=False):
     _join_ic_rel_workers(w_factory, producers, consumers)
 
 
+def _run_producers(ind_sel, num_workers, directory, queue, **kwargs):
+    # Start selecting the relevant indices of the directory as configured
+    # by gathering.selection: worker processes that each download, extract
+    # and match, or a pipeline of stages with num_workers extract processes
+    selection = config.get('gathering', 'selection')
+    if selection == 'pipeline':
+        return ind_sel.run_pipeline(directory, queue, join=False,
+                                    extractors=num_workers, **kwargs)
+    if selection == 'workers':
+        return ind_sel.run_workers(num_workers, directory, queue, join=False,
+                                   **kwargs)
+    raise ValueError('Unknown selection: {0}'.format(selection))
+
+
 def _join_workers(cworker, producers, consumers):
     # Wait for producers to finish
     for p in producers:
@@ -3,9 +3,10 @@ import os
 from flask import Blueprint, jsonify, request, make_response
 from random import randint
 
-from urbansearch.utils import db_utils
+from urbansearch.utils import db_utils, store_utils
 from urbansearch.clustering.classifytext import ClassifyText
 from urbansearch.clustering.text_preprocessor import PreProcessor
+from urbansearch.gathering import wet
 from urbansearch.gathering.gathering import PageDownloader
 
 ct = ClassifyText()
@@ -17,6 +18,9 @@ DATA_DIRECTORY = config.get('resources', 'data')
 DOCUMENT_PATH = os.path.join(DATA_DIRECTORY, config.get('api', 'doc_path'))
 NUMBER_OF_WORKERS = config.get('api', 'num_of_workers')
 NUMBER_OF_DOCUMENTS_PER_WORKER = config.get('api', 'num_of_docs')
+CATEGORIES_NO_OTHER = config.get('score', 'categories_no_other')
+
+_store = None
 
 
 def get_categorie(document):
@@ -31,8 +35,39 @@ def random_file():
     return randint(0, NUMBER_OF_DOCUMENTS_PER_WORKER - 1)
 
 
+def store():
+    """
+    Returns the store of classified documents, see store_utils. Uses the
+    configured document store, or else the shards in the data directory.
+
+    :return: A store_utils.DocumentStore
+    """
+    global _store
+    if _store is None:
+        _store = (store_utils.from_config() or
+                  store_utils.DocumentStore(DATA_DIRECTORY))
+    return _store
+
+
 @documents_api.route('/', methods=['GET'])
 def get_random():
+    """
+    Returns a random document that is not classified as Other, or of the
+    category given in the request parameter category. Documents are taken
+    from the document store, random text files are classified if the store
+    holds no such documents.
+
+    :return: The document
+    """
+    category = request.args.get('category')
+    stored = store().random([category] if category else CATEGORIES_NO_OTHER)
+    if stored:
+        return jsonify(status=200,
+                       document=pp.clean_file(stored[1].splitlines(True)))
+    if category:
+        return jsonify(status=404,
+                       message='No document of category {0}'.format(category))
+
     while True:
         try:
             with open(DOCUMENT_PATH.format(random_worker(),
@@ -49,8 +84,8 @@ def get_random():
 @documents_api.route('/download', methods=['GET'])
 def download():
     """
-    Downloads and parses the given document from Common Crawl.
-    Requires a request parameter digest.
+    Downloads and parses the given document from Common Crawl, unless it
+    is in the document store. Requires a request parameter digest.
 
     :return: The downloaded document
     """
@@ -58,8 +93,18 @@ def download():
         return jsonify(status=400, message='No digest provided!')
 
     digest = request.args.get('digest')
-    index = db_utils.get_index(digest)
-    text = pd.index_to_txt(index).split('\n')
+    stored = store().get(digest)
+    if stored:
+        text = stored[1]
+    else:
+        index = db_utils.get_index(digest)
+        if wet.is_wet_index(index):
+            return jsonify(status=404,
+                           message='Document {0} was read from a WET file '
+                                   'and is not in the document store'
+                                   .format(digest))
+        text = pd.index_to_txt(index)
+    text = text.split('\n')
     text = '\n'.join(line for line in text if line)
 
     response = make_response(text)
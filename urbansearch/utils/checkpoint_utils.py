@@ -0,0 +1,316 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from queue import Empty
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Position of a work unit that has been processed completely
+DONE = True
+TMP_PREFIX = '.tmp-'
+# Seconds to wait for an acknowledgement before checking again
+ACK_WAIT = 5
+
+
+def from_config(name):
+    """
+    Creates the checkpoint of a job, stored in the directory configured in
+    checkpoint.directory.
+
+    :param name: Name of the job, e.g. indices
+    :return: A Checkpoint, or None if no checkpoint directory is configured
+    """
+    directory = config.get('checkpoint', 'directory')
+    if not directory:
+        return None
+    return Checkpoint(directory, name, config.get('checkpoint', 'interval'))
+
+
+def unit_key(unit):
+    """
+    Returns the checkpoint key of a work unit.
+
+    :param unit: Path of a file or a namedtuple, e.g. a gz_utils.GzRange
+    :return: The key as string
+    """
+    if isinstance(unit, str):
+        return unit
+    return ':'.join(str(field) for field in unit)
+
+
+class Checkpoint(object):
+
+    """
+    Durable progress of a job, as the position reached in every work unit:
+    the number of items processed, or DONE. Every process writes the units
+    it worked on to a JSON file of its own, atomically and at most once per
+    interval, so a crash loses at most interval seconds of work. The files
+    of all processes are merged when the checkpoint is created, so create
+    it before starting workers.
+
+    Positions only hold for the same work units, restart a job with the
+    same files and number of workers.
+    """
+
+    def __init__(self, directory, name, interval=30):
+        """
+        :param directory: Directory to store the checkpoint files in
+        :param name: Name of the job, prefix of its checkpoint files
+        :param interval: Minimum number of seconds between writes
+        """
+        self.directory = directory
+        self.name = name
+        self.interval = interval
+        os.makedirs(directory, exist_ok=True)
+        self._flushed = []
+        self._positions = self._load()
+        self._updated = {}
+        self._last_write = time.time()
+
+    def done(self, key):
+        """
+        Check whether a work unit has been processed completely.
+
+        :param key: Key of the unit, see unit_key
+        :return: True iff the unit is done
+        """
+        return self._position(key) is DONE
+
+    def position(self, key):
+        """
+        Returns the number of items of a work unit processed so far.
+
+        :param key: Key of the unit, see unit_key
+        :return: The number of items, 0 for a new or completed unit
+        """
+        position = self._position(key)
+        return 0 if position is DONE else position
+
+    def update(self, key, position):
+        """
+        Record the number of items of a work unit processed so far. Written
+        once the interval has passed since the last write.
+
+        :param key: Key of the unit, see unit_key
+        :param position: Number of items processed
+        """
+        self._updated[key] = position
+        if time.time() - self._last_write >= self.interval:
+            self.flush()
+
+    def complete(self, key):
+        """
+        Record that a work unit has been processed completely.
+
+        :param key: Key of the unit, see unit_key
+        """
+        self.update(key, DONE)
+
+    def on_flush(self, callback):
+        """
+        Call a function every time the progress of this process is written,
+        e.g. to keep state that must not get ahead of the checkpoint.
+
+        :param callback: Function without arguments, added once
+        """
+        if callback not in self._flushed:
+            self._flushed.append(callback)
+
+    def flush(self):
+        """ Write the progress of this process, if anything changed. """
+        self._last_write = time.time()
+        if not self._updated:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=TMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._updated, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._path(os.getpid()))
+        except OSError as e:
+            logger.error('Writing checkpoint failed: {0}'.format(e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        for callback in self._flushed:
+            callback()
+
+    def _position(self, key):
+        position = self._updated.get(key)
+        if position is None:
+            position = self._positions.get(key, 0)
+        return position
+
+    def _path(self, pid):
+        return os.path.join(self.directory, '{0}-{1}.json'.format(self.name,
+                                                                  pid))
+
+    def _load(self):
+        # Merge the files of all processes of earlier runs into one file
+        positions = {}
+        paths = glob.glob(os.path.join(glob.escape(self.directory),
+                                       glob.escape(self.name) + '-*.json'))
+        for path in paths:
+            try:
+                with open(path, 'r') as f:
+                    for key, position in json.load(f).items():
+                        positions[key] = _merge(positions.get(key, 0),
+                                                position)
+            except (OSError, ValueError) as e:
+                logger.error('Skipping unreadable checkpoint {0}: {1}'
+                             .format(path, e))
+
+        if positions:
+            self._updated = positions
+            self.flush()
+            merged = self._path(os.getpid())
+            for path in paths:
+                if path != merged:
+                    os.remove(path)
+        self._updated = {}
+        return positions
+
+
+class Completions(object):
+
+    """
+    Positions of work units of which the items are finished out of order,
+    e.g. by consumer processes that acknowledge them on a queue. The
+    producer numbers every item it hands out with issue, the consumers put
+    (key, number) acknowledgements on the queue once they are done with it.
+    A unit only advances past items that are finished together with all
+    items before them, so items that are still queued or in progress are
+    redone after a restart.
+
+    Thread safe, but not shared with other processes: create it in the
+    process that hands out the items.
+    """
+
+    def __init__(self, checkpoint, advanced=None):
+        """
+        :param checkpoint: The Checkpoint to record the positions in
+        :param advanced: Optional function, called with the list of values
+        of the items a unit advances past before the position is recorded,
+        see finish
+        """
+        self.checkpoint = checkpoint
+        self.advanced = advanced
+        self._lock = threading.Lock()
+        self._units = {}
+        self._pending = 0
+
+    def issue(self, key, after):
+        """
+        Number the next item of a work unit.
+
+        :param key: Key of the unit, see unit_key
+        :param after: Position of the unit once this item and all items
+        issued before it are finished
+        :return: Number of the item, to acknowledge it with finish
+        """
+        with self._lock:
+            unit = self._units.setdefault(key, _Progress())
+            number = unit.issued
+            unit.issued += 1
+            unit.after[number] = after
+            self._pending += 1
+            return number
+
+    def finish(self, key, number, value=None):
+        """
+        Record that an item is finished.
+
+        :param key: Key of the unit of the item
+        :param number: Number of the item, see issue
+        :param value: Optional value passed to advanced once the unit
+        advances past the item
+        """
+        with self._lock:
+            unit = self._units[key]
+            unit.finished[number] = value
+            self._pending -= 1
+            position = None
+            values = []
+            while unit.next in unit.finished:
+                value = unit.finished.pop(unit.next)
+                if value is not None:
+                    values.append(value)
+                position = unit.after.pop(unit.next)
+                unit.next += 1
+            if values and self.advanced:
+                self.advanced(values)
+            self._record(key, unit, position)
+
+    def close(self, key, position=DONE):
+        """
+        Record that all items of a work unit have been issued. The unit is
+        recorded at position once they are all finished.
+
+        :param key: Key of the unit
+        :param position: Final position of the unit, DONE by default
+        """
+        with self._lock:
+            unit = self._units.setdefault(key, _Progress())
+            unit.closed = position
+            self._record(key, unit, None)
+
+    def pending(self):
+        """ Returns the number of items issued but not finished. """
+        with self._lock:
+            return self._pending
+
+    def receive(self, acks, wait=False):
+        """
+        Finish the items acknowledged on a queue.
+
+        :param acks: Queue of (key, number) or (key, number, value) tuples
+        :param wait: Wait until no items are pending, otherwise only take
+        the acknowledgements that already arrived
+        """
+        while not wait or self.pending():
+            try:
+                ack = acks.get(wait, ACK_WAIT)
+            except Empty:
+                if wait:
+                    continue
+                return
+            self.finish(*ack)
+
+    def _record(self, key, unit, position):
+        # Called with the lock held. Records the last position reached, or
+        # the final position once the unit is closed and finished.
+        if unit.closed is not None and unit.next == unit.issued:
+            del self._units[key]
+            position = unit.closed
+        if position is DONE:
+            self.checkpoint.complete(key)
+        elif position is not None:
+            self.checkpoint.update(key, position)
+
+
+class _Progress(object):
+    # Items of a unit: numbers handed out, first one not finished, finished
+    # ones after it with their values and their positions, and the final
+    # position once closed
+    __slots__ = ('issued', 'next', 'finished', 'after', 'closed')
+
+    def __init__(self):
+        self.issued = 0
+        self.next = 0
+        self.finished = {}
+        self.after = {}
+        self.closed = None
+
+
+def _merge(a, b):
+    # Positions only advance, a completed unit stays completed
+    if a is DONE or b is DONE:
+        return DONE
+    return max(a, b)
@@ -1,3 +1,4 @@
+import json
 import math
 import logging
 from neo4j.v1 import (basic_auth, GraphDatabase, SessionError,
@@ -264,6 +265,55 @@ def store_indices_topics(digests, topics):
     return len(perform_queries(query_list, params_list)) == len(query_list)
 
 
+def _store_index_snippets_query(digest, snippets):
+    # Generates a query for storing the snippets of an index, as a JSON
+    # property, properties can't hold maps. Returns a query, params tuple,
+    # None, None if there are no snippets.
+    if not snippets:
+        return None, None
+    query = '''
+        MATCH (i:Index { digest: $digest })
+        SET i.snippets = $snippets
+    '''
+    return query, {'digest': digest, 'snippets': json.dumps(snippets)}
+
+
+def store_index_snippets(digest, snippets):
+    """
+    Stores the snippets of the city mentions in the given index, see
+    CoOccurrenceChecker.check_snippets.
+
+    Caution: the index must already exist in the database!
+
+    :param digest: The unique identifier of the index
+    :param snippets: A dictionary of city names to lists of snippets
+    :return: True iff the snippets have been successfully stored
+    """
+    query, params = _store_index_snippets_query(digest, snippets)
+    if query:
+        return perform_query(query, params) == []
+
+
+def store_indices_snippets(digests, snippets):
+    """
+    Same as store_index_snippets, but for multiple indices.
+
+    :param digests: The unique identifiers of the indices
+    :param snippets: A list of snippet dictionaries
+    :return: True iff the snippets have been successfully stored
+    """
+    query_list = list()
+    params_list = list()
+
+    for i, fn in enumerate(digests):
+        query, params = _store_index_snippets_query(fn, snippets[i])
+        if query:
+            query_list.append(query)
+            params_list.append(params)
+
+    return len(perform_queries(query_list, params_list)) == len(query_list)
+
+
 def _store_index_probabilities_query(digest, probabilities):
     # Generates a query for storing topic probabilities on an index
     # Default probabilities (0) are used if none are provided
@@ -586,11 +636,13 @@ def get_related_documents(city_a, city_b, filter_other=True, limit=300):
     """
     Retrieves a list of Common Crawl documents in which
     both city_a and city_b occur, as well as the categories these
-    documents are classified as.
+    documents are classified as, and the snippets of the mentions of both
+    cities, if they were stored, see store_index_snippets.
 
     :param city_a: Name of city A
     :param city_b: Name of city B
-    :return: A list of dictionaries containing digest and categories.
+    :return: A list of dictionaries containing digest, categories and
+    snippets.
     """
     query = '''
         MATCH (:City {{ name: $city_a }})-[:{0}]->
@@ -598,7 +650,7 @@ def get_related_documents(city_a, city_b, filter_other=True, limit=300):
         {1}
         WITH DISTINCT i
         RETURN i.digest AS digest, labels(i) AS categories,
-            properties(i) AS probabilities
+            properties(i) AS probabilities, i.snippets AS snippets
         LIMIT {2}
     '''.format(OCCURS_IN, 'WHERE NOT i:Other' if filter_other else '', limit)
 
@@ -609,9 +661,12 @@ def get_related_documents(city_a, city_b, filter_other=True, limit=300):
                       for cat in r['categories']}
         if len(categories) == 0:
             continue
+        snippets = json.loads(r['snippets']) if r['snippets'] else {}
         results.append({
             'digest': r['digest'],
-            'categories': categories
+            'categories': categories,
+            'snippets': {city: snippets[city] for city in (city_a, city_b)
+                         if city in snippets}
         })
     return results
 
@@ -619,18 +674,29 @@ def get_related_documents(city_a, city_b, filter_other=True, limit=300):
 def get_index(digest):
     """
     Returns the index as dictionary. Contains filename,
-    content length and offset.
+    content length, offset and source, which is None unless the index was
+    read from a WET file.
     :param digest: The unique identifier of the index
     :return: The index dictionary
     """
     query = '''
         MATCH (i:Index) WHERE i.digest = $digest
-        RETURN i.filename AS filename, i.offset AS offset,
-            i.length AS length
+        RETURN i.digest AS digest, i.filename AS filename, i.offset AS offset,
+            i.length AS length, i.source AS source
     '''
     return {**perform_query(query, {'digest': digest})[0]}
 
 
+def index_digests():
+    """
+    Returns the digests of all stored indices.
+
+    :return: A list of digests
+    """
+    query = 'MATCH (i:Index) RETURN i.digest AS digest'
+    return [r['digest'] for r in perform_query(query, access_mode='read')]
+
+
 def _get_cities():
     # Returns a list of Neo4j City objects. Tries to reuse them
     # save database hits
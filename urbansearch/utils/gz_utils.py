@@ -0,0 +1,152 @@
+import collections
+import contextlib
+import gzip
+import io
+import logging
+import mmap
+import os
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# A byte range of a gzip file, starting and ending at member boundaries.
+# The end is exclusive.
+GzRange = collections.namedtuple('GzRange', ['filename', 'start', 'end'])
+
+# Magic bytes and deflate method of a gzip member header
+MEMBER_MAGIC = b'\x1f\x8b\x08'
+# zlib window bits for data with a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Files smaller than this are never split
+MIN_RANGE_SIZE = 1048576
+CHUNK_SIZE = 65536
+
+
+def is_gz(unit):
+    """
+    Check whether a work unit is a gzip file or a range of one.
+
+    :param unit: Path to a file or a GzRange
+    :return: True iff unit is a GzRange or a path ending with .gz
+    """
+    return isinstance(unit, GzRange) or unit.endswith('.gz')
+
+
+def split_files(files, parts, min_size=MIN_RANGE_SIZE):
+    """
+    Divide gzip files made up of multiple members, like the cdx shards of
+    Common Crawl, into about parts ranges of equal size, so that a few large
+    files can be decompressed by several processes at once. Ranges start at
+    member boundaries. Files that are not gzip files are left as they are.
+
+    :param files: List of paths
+    :param parts: Number of ranges to aim for
+    :param min_size: Minimum size of a range in bytes
+    :return: List of paths and GzRanges
+    """
+    sizes = {f: os.path.getsize(f) for f in files if f.endswith('.gz')}
+    target = max(sum(sizes.values()) // max(parts, 1), min_size, 1)
+
+    units = []
+    for f in files:
+        if sizes.get(f, 0) < 2 * target:
+            units.append(f)
+        else:
+            units.extend(split_members(f, round(sizes[f] / target)))
+    return units
+
+
+def split_members(filename, parts):
+    """
+    Divide a gzip file into at most parts ranges of about equal size. Ranges
+    start at member boundaries, a file with a single member is not divided.
+
+    :param filename: Path to the gzip file
+    :param parts: Number of ranges
+    :return: List of GzRanges covering the file
+    """
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if parts < 2 or not size:
+            return [GzRange(filename, 0, size)]
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            bounds = [0]
+            for i in range(1, parts):
+                start = find_member(data, max(size * i // parts, bounds[-1]
+                                              + 1))
+                if start is None:
+                    break
+                if start > bounds[-1]:
+                    bounds.append(start)
+    bounds.append(size)
+    return [GzRange(filename, start, end)
+            for start, end in zip(bounds, bounds[1:])]
+
+
+def find_member(data, offset):
+    """
+    Find the first gzip member that starts at or after offset. Candidates
+    are found by their magic bytes and confirmed by decompressing the member
+    completely, which includes its CRC check.
+
+    :param data: Bytes-like object containing the gzip file
+    :param offset: Offset to start searching from
+    :return: Offset of the member, or None if there is none
+    """
+    pos = data.find(MEMBER_MAGIC, offset)
+    while pos != -1:
+        if _is_member(data, pos):
+            return pos
+        pos = data.find(MEMBER_MAGIC, pos + 1)
+    return None
+
+
+@contextlib.contextmanager
+def open_range(gz_range, encoding='utf-8', errors='replace'):
+    """
+    Open a range of a gzip file in text mode, for use in a with statement.
+    Members are decompressed while reading, so memory use does not grow with
+    the size of the range.
+
+    :param gz_range: A GzRange
+    :param encoding: Encoding of the uncompressed text
+    :param errors: Error handling of the text decoding
+    :return: Context manager producing a text file object
+    """
+    with open(gz_range.filename, 'rb') as f:
+        f.seek(gz_range.start)
+        size = gz_range.end - gz_range.start
+        with gzip.GzipFile(fileobj=_RangeFile(f, size)) as gz_obj:
+            yield io.TextIOWrapper(gz_obj, encoding=encoding, errors=errors)
+
+
+def _is_member(data, pos):
+    # Decompress the member at pos, valid if the end of the member is reached
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    view = memoryview(data)
+    try:
+        for start in range(pos, len(data), CHUNK_SIZE):
+            decompressor.decompress(view[start:start + CHUNK_SIZE])
+            if decompressor.eof:
+                return True
+    except zlib.error:
+        pass
+    finally:
+        view.release()
+    return False
+
+
+class _RangeFile(io.RawIOBase):
+    # Read-only file object that ends after size bytes of the wrapped file
+
+    def __init__(self, f, size):
+        self._f = f
+        self._remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self._f.readinto(memoryview(b)[:self._remaining])
+        self._remaining -= n
+        return n
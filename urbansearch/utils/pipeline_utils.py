@@ -0,0 +1,135 @@
+import time
+from ctypes import c_double, c_int, c_longlong
+from multiprocessing import Lock, Queue, Value
+
+# Put on the queue of the next stage, once per worker of that stage, when
+# all workers of a stage are done
+SENTINEL = None
+# Number of work units to aim for per worker of a task queue. Workers that
+# are done take the next unit, so the last worker finishes at most one unit
+# after the others.
+UNITS_PER_WORKER = 4
+
+
+class Stage(object):
+
+    """
+    Bookkeeping of a pipeline stage: throughput counters and the end of the
+    stage. The workers of a stage, processes or threads, take items from a
+    bounded queue and put their results on the queue of the next stage. The
+    last worker to finish puts a sentinel on that queue for every worker of
+    the next stage.
+
+    Counters are shared with forked processes, create the stage before
+    starting workers.
+    """
+
+    def __init__(self, name, workers, consumers=0):
+        """
+        :param name: Name of the stage, used in the stats
+        :param workers: Number of workers of this stage
+        :param consumers: Number of workers of the next stage, 0 if the
+        results are not consumed by a stage
+        """
+        self.name = name
+        self.workers = workers
+        self.consumers = consumers
+        self._lock = Lock()
+        self._items_in = Value(c_longlong, 0, lock=False)
+        self._items_out = Value(c_longlong, 0, lock=False)
+        self._busy = Value(c_double, 0, lock=False)
+        self._done = Value(c_int, 0, lock=False)
+        self._started = Value(c_double, time.time(), lock=False)
+        self._finished = Value(c_double, 0, lock=False)
+
+    def count(self, items_in, items_out, busy):
+        """
+        Add the work of a worker to the counters.
+
+        :param items_in: Number of items taken
+        :param items_out: Number of results produced
+        :param busy: Seconds spent on the items, excluding waits on queues
+        """
+        with self._lock:
+            self._items_in.value += items_in
+            self._items_out.value += items_out
+            self._busy.value += busy
+
+    def finish(self, queue):
+        """
+        Signal that a worker of this stage is done. The last worker puts a
+        sentinel on queue for every worker of the next stage.
+
+        :param queue: Queue of the next stage
+        """
+        with self._lock:
+            self._done.value += 1
+            last = self._done.value == self.workers
+            if last:
+                self._finished.value = time.time()
+        if last:
+            for _ in range(self.consumers):
+                queue.put(SENTINEL)
+
+    def stats(self):
+        """
+        Returns the counters of the stage. The busy fraction is the part of
+        the time its workers spent working instead of waiting on queues, the
+        stage with the highest fraction is the bottleneck.
+
+        :return: Dictionary with the numbers of workers, items taken and
+        results produced, the items per second and the busy fraction
+        """
+        with self._lock:
+            end = self._finished.value or time.time()
+            elapsed = max(end - self._started.value, 1e-9)
+            return {'workers': self.workers,
+                    'in': self._items_in.value,
+                    'out': self._items_out.value,
+                    'per_sec': self._items_in.value / elapsed,
+                    'busy': self._busy.value / (elapsed * self.workers)}
+
+
+def iter_queue(queue):
+    """
+    Take items from the queue of a stage until a sentinel arrives.
+
+    :param queue: Queue of the stage
+    :return: Generator of items
+    """
+    while True:
+        item = queue.get()
+        if item is SENTINEL:
+            return
+        yield item
+
+
+def task_queue(units, workers):
+    """
+    Create a task queue from which workers take work units until they are
+    all done, instead of dividing the units up front. The units are followed
+    by a sentinel for every worker.
+
+    :param units: Work units, e.g. paths or gz_utils.GzRanges
+    :param workers: Number of workers taking from the queue
+    :return: multiprocessing.Queue, pass it to the workers when creating
+    them
+    """
+    tasks = Queue()
+    for unit in units:
+        tasks.put(unit)
+    for _ in range(workers):
+        tasks.put(SENTINEL)
+    return tasks
+
+
+def iter_tasks(tasks):
+    """
+    Iterate the work units of a worker.
+
+    :param tasks: A task queue, see task_queue, or a list of work units
+    :return: Iterator of work units
+    """
+    if hasattr(tasks, 'get'):
+        return iter_queue(tasks)
+    return iter(tasks)
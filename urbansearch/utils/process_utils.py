@@ -16,18 +16,14 @@ def divide_files(files, parts):
     """
     if (not files and parts <= 0) or len(files) <= 0:
         return None
-    files_len = len(files)
-    if parts > files_len:
-        part_len = 1
-    else:
-        part_len = files_len // parts
-    # Divide all files in 'equal' parts
-    div_files = [files[i * part_len:part_len * (i + 1)]
-                 for i in range(parts)]
-
-    # If number of data entries is odd, append last file to last list
-    if files_len % 2 != 0:
-        div_files[-1] += [files[-1]]
+    part_len, remainder = divmod(len(files), parts)
+    # The last parts get one file of the remainder each
+    div_files = []
+    start = 0
+    for i in range(parts):
+        end = start + part_len + (i >= parts - remainder)
+        div_files.append(files[start:end])
+        start = end
 
     return div_files
 
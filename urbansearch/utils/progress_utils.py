@@ -9,6 +9,8 @@ import statistics
 from multiprocessing import Lock, Value
 from ctypes import c_int
 
+from urbansearch.utils import shard_utils
+
 counter = Value(c_int)  # defaults to 0
 ind_counter = Value(c_int)
 
@@ -29,18 +31,21 @@ def _total_index_count(directory):
 
     for file in files:
         if file.endswith('.gz'):
-            with gzip.GzipFile(file) as gz_obj:
-                for l in gz_obj.read().decode('utf-8').split('\n'):
-                    lines += 1
+            # Stream the lines, the decompressed file may not fit in memory
+            with gzip.open(file, 'rb') as gz_obj:
+                lines += sum(1 for _ in gz_obj)
     return lines
 
 
 def _total_file_count(directory):
-    # Count total files in directory
+    # Count total files in directory, and the records in shards
     files = 0
     try:
         for _file in os.scandir(directory):
-            if _file.is_file():
+            if shard_utils.is_shard(_file.name):
+                files += shard_utils.count_records(_file.path)
+            elif (_file.is_file() and
+                  not _file.name.endswith(shard_utils.INDEX_EXT)):
                 files += 1
     except OSError as e:
         LOGGER.error("Counting total files failed with: {0}".format(e))
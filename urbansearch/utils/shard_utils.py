@@ -0,0 +1,261 @@
+import gzip
+import json
+import logging
+import os
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SHARD_EXT = '.shard'
+INDEX_EXT = '.idx'
+# Uncompressed size in bytes at which a block of records is written
+BLOCK_SIZE = 1 << 20
+# Size in bytes at which a writer continues in a new shard
+SHARD_SIZE = 1 << 30
+
+
+def shard_paths(directory):
+    """
+    Returns the paths of the shards in a directory, in order of name.
+
+    :param directory: Directory containing shards
+    :return: List of paths
+    """
+    return sorted(_file.path for _file in os.scandir(directory)
+                  if _file.is_file() and _file.name.endswith(SHARD_EXT))
+
+
+def is_shard(path):
+    """
+    Check whether a file is a shard.
+
+    :param path: Path of the file
+    :return: True iff the file is a shard
+    """
+    return path.endswith(SHARD_EXT)
+
+
+def count_records(path):
+    """
+    Returns the number of records in a shard, counted in its index.
+
+    :param path: Path of the shard
+    :return: The number of records
+    """
+    try:
+        with open(path + INDEX_EXT, 'rb') as f:
+            return sum(1 for _ in f)
+    except OSError:
+        return 0
+
+
+class ShardWriter(object):
+
+    """
+    Appends index, text records to shards: files of compressed blocks of
+    records, which are gzip members, so a shard can be read with zcat as
+    well. In a block, every record is a line with a JSON header, holding
+    the index and the size of the text in bytes, followed by the text.
+
+    Every shard has a sidecar index, with a line per record with its digest,
+    the offset and length of its block, its position in the block and its
+    labels, e.g. categories. Lines are added once a block is written, a
+    block without index lines is the unfinished end of a shard.
+
+    Shards are never rewritten, a writer continues after the shards with
+    the same name that exist already. Records that are not written in a
+    block yet are lost if the writer isn't closed.
+    """
+
+    def __init__(self, directory, name, block_size=BLOCK_SIZE,
+                 shard_size=SHARD_SIZE):
+        """
+        :param directory: Directory to write the shards to
+        :param name: Name of the writer, shards are named name-n.shard.
+        Writers in different processes need different names.
+        :param block_size: Uncompressed size in bytes at which a block is
+        written
+        :param shard_size: Size in bytes at which a new shard is started
+        """
+        self.directory = directory
+        self.name = name
+        self.block_size = block_size
+        self.shard_size = shard_size
+        self._number = self._next_number()
+        self._shard = None
+        self._index = None
+        self._block = []
+        self._block_size = 0
+        self._entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, index, text, labels=()):
+        """
+        Add a record, the block is written once it reaches the block size.
+
+        :param index: Index in JSON format
+        :param text: Text of the index
+        :param labels: Labels of the record, stored in the index of the
+        shard as well. Labels can't contain commas or tabs.
+        """
+        body = text.encode('utf-8', errors='replace')
+        header = {'index': index, 'size': len(body)}
+        if labels:
+            header['labels'] = list(labels)
+        header = json.dumps(header).encode()
+        self._entries.append((index.get('digest', ''), self._block_size,
+                              ','.join(labels)))
+        self._block += [header, b'\n', body]
+        self._block_size += len(header) + 1 + len(body)
+        if self._block_size >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        """ Write the records added so far as a block. """
+        if not self._entries:
+            return
+        if self._shard is None:
+            self._open()
+
+        data = gzip.compress(b''.join(self._block))
+        offset = self._shard.tell()
+        self._shard.write(data)
+        self._shard.flush()
+        self._index.write(''.join(
+            '{0}\t{1}\t{2}\t{3}\t{4}\n'.format(digest, offset, len(data),
+                                                position, labels)
+            for digest, position, labels in self._entries))
+        self._index.flush()
+        self._block = []
+        self._block_size = 0
+        self._entries = []
+
+        if self._shard.tell() >= self.shard_size:
+            self._close_shard()
+            self._number += 1
+
+    def close(self):
+        """ Write the last block and close the shard. """
+        self.flush()
+        self._close_shard()
+
+    def _open(self):
+        path = os.path.join(self.directory, '{0}-{1}{2}'.format(
+            self.name, self._number, SHARD_EXT))
+        self._shard = open(path, 'ab')
+        self._index = open(path + INDEX_EXT, 'a')
+
+    def _close_shard(self):
+        if self._shard is not None:
+            self._shard.close()
+            self._index.close()
+            self._shard = None
+            self._index = None
+
+    def _next_number(self):
+        # Number after the highest number of the shards of this writer
+        prefix = self.name + '-'
+        numbers = [name[len(prefix):-len(SHARD_EXT)]
+                   for name in os.listdir(self.directory)
+                   if name.startswith(prefix) and name.endswith(SHARD_EXT)]
+        numbers = [int(n) for n in numbers if n.isdigit()]
+        return max(numbers) + 1 if numbers else 0
+
+
+class ShardReader(object):
+
+    """
+    Reads the records of a shard written by a ShardWriter, sequentially or
+    by digest. The index of the shard is loaded on the first lookup.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the shard
+        """
+        self.path = path
+        self._entries = None
+
+    def __iter__(self):
+        """
+        Iterate the records of the shard in order of writing.
+
+        :return: Generator of index, text tuples
+        """
+        try:
+            with gzip.open(self.path, 'rb') as f:
+                while True:
+                    record = _read_record(f)
+                    if record is None:
+                        return
+                    yield record
+        except (EOFError, OSError, zlib.error) as e:
+            # The last block was not written completely
+            logger.error('Shard {0} ends in a broken block: {1}'
+                         .format(self.path, e))
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def entries(self):
+        """
+        Digests of the records in the shard, mapped to the offset and length
+        of their block, their position in the block and their labels.
+        """
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.path + INDEX_EXT, 'r') as f:
+                    for line in f:
+                        digest, offset, length, position, labels = \
+                            line.rstrip('\n').split('\t')
+                        self._entries[digest] = (
+                            int(offset), int(length), int(position),
+                            tuple(labels.split(',')) if labels else ())
+            except (OSError, ValueError) as e:
+                logger.error('Could not read index of shard {0}: {1}'
+                             .format(self.path, e))
+        return self._entries
+
+    def digests(self):
+        """
+        Returns the digests of the records in the shard.
+
+        :return: List of digests
+        """
+        return list(self.entries)
+
+    def get(self, digest):
+        """
+        Read the record with the given digest, decompressing its block only.
+
+        :param digest: Digest of the index of the record
+        :return: Index, text tuple, or None if the shard has no such record
+        """
+        entry = self.entries.get(digest)
+        if entry is None:
+            return None
+        offset, length, position, _ = entry
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            block = zlib.decompress(f.read(length), 16 + zlib.MAX_WBITS)
+        end = block.index(b'\n', position)
+        header = json.loads(block[position:end].decode())
+        body = block[end + 1:end + 1 + header['size']]
+        return header['index'], body.decode('utf-8', errors='replace')
+
+
+def _read_record(f):
+    # Next index, text tuple of a decompressed shard, None at the end
+    line = f.readline()
+    if not line:
+        return None
+    header = json.loads(line.decode())
+    body = f.read(header['size'])
+    return header['index'], body.decode('utf-8', errors='replace')
@@ -0,0 +1,136 @@
+import bisect
+import itertools
+import logging
+import os
+import random
+
+import config
+from urbansearch.utils import shard_utils
+
+logger = logging.getLogger(__name__)
+
+
+def from_config():
+    """
+    Creates the document store in the directory configured in
+    classification.document_store.
+
+    :return: A DocumentStore, or None if no directory is configured
+    """
+    directory = config.get('classification', 'document_store')
+    return DocumentStore(directory) if directory else None
+
+
+class DocumentStore(object):
+
+    """
+    Local store of documents, the texts of indices together with their
+    categories, kept in the shards of a directory, see shard_utils. The
+    indices of the shards are loaded on the first lookup and map every
+    digest to its block, so fetching a document or a random document of a
+    category takes a single read of a block.
+
+    Documents written after the first lookup are found after reload.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory of the shards
+        """
+        self.directory = directory
+        self._readers = None
+        self._locations = {}
+        self._categories = {}
+
+    def __len__(self):
+        self._load()
+        return len(self._locations)
+
+    def __contains__(self, digest):
+        self._load()
+        return digest in self._locations
+
+    def writer(self, name):
+        """
+        Returns a writer of documents to the store. Add documents with
+        write(index, text, categories) and close the writer when done.
+
+        :param name: Name of the writer, unique for every process
+        :return: A shard_utils.ShardWriter
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        return shard_utils.ShardWriter(
+            self.directory, name, config.get('gathering', 'shard_block_size'),
+            config.get('gathering', 'shard_size'))
+
+    def get(self, digest):
+        """
+        Returns a stored document.
+
+        :param digest: The unique identifier of the index
+        :return: Index, text, categories tuple, or None if the document is
+        not stored
+        """
+        self._load()
+        reader = self._locations.get(digest)
+        if reader is None:
+            return None
+        index, text = reader.get(digest)
+        return index, text, reader.entries[digest][3]
+
+    def random(self, categories=None):
+        """
+        Returns a random document of the given categories. Documents with
+        several of the categories are more likely to be picked.
+
+        :param categories: Names of categories, None for all documents
+        :return: Index, text, categories tuple, or None if no document has
+        one of the categories
+        """
+        self._load()
+        if categories is None:
+            digests = [list(self._locations)]
+        else:
+            digests = [self._categories[c] for c in categories
+                       if c in self._categories]
+        # Pick a category weighted by its number of documents
+        totals = list(itertools.accumulate(len(d) for d in digests))
+        if not totals or not totals[-1]:
+            return None
+        n = random.randrange(totals[-1])
+        i = bisect.bisect_right(totals, n)
+        return self.get(digests[i][n - (totals[i - 1] if i else 0)])
+
+    def counts(self):
+        """
+        Returns the number of stored documents per category.
+
+        :return: Dictionary with category names as keys
+        """
+        self._load()
+        return {c: len(digests) for c, digests in self._categories.items()}
+
+    def reload(self):
+        """ Load the indices of the shards again. """
+        self._readers = None
+        self._load()
+
+    def _load(self):
+        if self._readers is not None:
+            return
+        try:
+            paths = shard_utils.shard_paths(self.directory)
+        except OSError as e:
+            logger.error('Could not load document store {0}: {1}'
+                         .format(self.directory, e))
+            paths = []
+        self._readers = [shard_utils.ShardReader(path) for path in paths]
+        self._locations = {}
+        self._categories = {}
+        for reader in self._readers:
+            for digest, entry in reader.entries.items():
+                self._locations[digest] = reader
+                for category in entry[3]:
+                    self._categories.setdefault(category, []).append(digest)
+        logger.info('Loaded {0} documents from {1}'
+                    .format(len(self._locations), self.directory))
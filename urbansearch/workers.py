@@ -3,14 +3,15 @@ import os
 import logging
 import time
 from queue import Empty
-from multiprocessing import Process, Event
+from multiprocessing import Process, Event, Queue
 from ast import literal_eval
 
 import config
-from urbansearch.gathering import gathering
+from urbansearch.gathering import gathering, wet
 from urbansearch.filtering import cooccurrence
 from urbansearch.clustering import classifytext, text_preprocessor
-from urbansearch.utils import db_utils, progress_utils
+from urbansearch.utils import (checkpoint_utils, db_utils, pipeline_utils,
+                               progress_utils, shard_utils)
 producers_done = Event()
 file_producers_done = Event()
 ic_rel_producers_done = Event()
@@ -24,12 +25,38 @@ class Workers(object):
     Worker class. Contains workers and functions to run workers.
     """
 
-    def __init__(self):
+    def __init__(self, fetcher=None, checkpoint=None, dedup=None,
+                 store=None, snippet_width=0):
+        """
+        Initialises the workers.
+
+        :param fetcher: Optional fetcher.AsyncFetcher. If provided, the
+        classifying worker downloads the queued indices concurrently.
+        :param checkpoint: Optional checkpoint_utils.Checkpoint. If provided,
+        the file reading worker records its progress and resumes from it.
+        The file classifying workers acknowledge the tuples they are done
+        with on the acks queue.
+        :param dedup: Optional dedup.DigestFilter. If provided, the WET
+        reading workers skip records with a digest seen before.
+        :param store: Optional store_utils.DocumentStore. If provided, the
+        classifying workers add the classified documents to it.
+        :param snippet_width: Characters of context on either side of the
+        city mentions captured by the file classifying workers, see
+        CoOccurrenceChecker.check_snippets. 0 captures no snippets. The
+        classifying worker stores the snippets captured by the indices
+        selector instead, see IndicesSelector.
+        """
         self.pd = gathering.PageDownloader()
+        self.fetcher = fetcher
         self.ct = classifytext.ClassifyText()
         self.co = cooccurrence.CoOccurrenceChecker()
         self.prepr = text_preprocessor.PreProcessor()
         self.commit = config.get('neo4j', 'commit_threshold')
+        self.checkpoint = checkpoint
+        self.acks = Queue() if checkpoint else None
+        self.dedup = dedup
+        self.store = store
+        self.snippet_width = snippet_width
 
     def run_classifying_workers(self, no_of_workers, queue, threshold,
                                 **kwargs):
@@ -43,14 +70,19 @@ class Workers(object):
         higher than threshold the label is added.
         :join: Wait for workers to be done and join. Default is True.
         parameter
+        :acks: Passed in kwargs. Queues of the indices selector to
+        acknowledge the classified indices on, see
+        IndicesSelector.run_workers
         """
         func = self.classifying_worker
+        args = (queue, threshold, kwargs.get('to_db', False),
+                kwargs.get('progress', False))
         if kwargs.get('pre_downloaded', False):
             func = self.classifying_from_files_worker
+        else:
+            args += (kwargs.get('acks'),)
 
-        workers = [Process(target=func, args=(queue, threshold,
-                                              kwargs.get('to_db', False),
-                                              kwargs.get('progress', False)))
+        workers = [Process(target=func, args=args)
                    for i in range(no_of_workers)]
 
         for worker in workers:
@@ -65,54 +97,116 @@ class Workers(object):
         else:
             return workers
 
-    def classifying_worker(self, queue, threshold, to_db, progress=False):
+    def classifying_worker(self, queue, threshold, to_db, progress=False,
+                           acks=None):
         """ Classifying worker that classifies relevant indices from a queue.
         Can output to database. Worker stops if queue is Empty and received
         signal that the producers that fill the queue are done. See function
         set_producers_done()
 
-        :queue: Queue containing indices
+        Indices with an acknowledgement are acknowledged once their results
+        are stored in the database, or right away if not to_db. Results are
+        also stored whenever the queue stays empty, so the producers waiting
+        for the acknowledgements can finish.
+
+        :queue: Queue containing index, co-occurrences tuples, with the
+        snippets of the mentions and an acknowledgement if there are any,
+        see IndicesSelector.worker
         :to_db: Output index and category to database
+        :acks: Queues of the indices selector to put the acknowledgements on
         """
         global producers_done
 
+        documents = self._store_writer()
         indices = list()
         digests = list()
         occurrences = list()
         probabilities = list()
         topics_list = list()
+        snippets_list = list()
+        data_lists = [indices, digests, occurrences, probabilities,
+                      topics_list, snippets_list]
+
+        # Acknowledgements of the indices of which the results are not
+        # stored in the database yet
+        unacked = list()
 
         while not queue.empty() or not producers_done.is_set():
             try:
-                index, co_occ = queue.get(block=True, timeout=5)
+                batch = self._next_batch(queue)
+            except Empty:
+                if unacked:
+                    self._store_pending_db(data_lists)
+                    self._acknowledge(unacked, acks)
+                continue
+
+            for (index, co_occ, *rest), txt in self._batch_texts(batch):
+                snippets = rest[0] if rest else None
+                if len(rest) > 1:
+                    unacked.append(rest[1])
                 if progress:
                     with progress_utils.counter_lock:
                         progress_utils.counter.value += 1
-                txt = self.pd.index_to_txt(index)
                 prob = self.ct.probability_per_category(txt,
                                                         self.prepr.pre_process)
                 topics = self.ct.categories_above_threshold(prob, threshold)
+                if documents:
+                    documents.write(index, txt, topics)
 
                 if to_db:
                     self._store_indices_db(index, indices)
                     digests.append(index.get('digest', None))
 
-                    self._store_info_db(digests, co_occ, occurrences,
+                    self._store_info_db(digests, (co_occ, occurrences),
                                         db_utils.store_occurrences)
-                    self._store_info_db(digests, prob, probabilities,
+                    self._store_info_db(digests, (prob, probabilities),
                                         db_utils.store_indices_probabilities)
-                    self._store_info_db(digests, topics, topics_list,
+                    self._store_info_db(digests, (topics, topics_list),
                                         db_utils.store_indices_topics)
+                    self._store_info_db(digests, (snippets, snippets_list),
+                                        db_utils.store_indices_snippets)
 
                     if len(digests) >= self.commit:
                         digests.clear()
-            except Empty:
-                pass
+                        self._acknowledge(unacked, acks)
+                else:
+                    self._acknowledge(unacked, acks)
+        if documents:
+            documents.close()
         if to_db:
             LOGGER.info('Storing classification')
-            self._final_store_db(indices, digests, occurrences, probabilities,
-                                 topics_list)
+            self._final_store_db(data_lists)
             LOGGER.info('Done storing classification')
+        self._acknowledge(unacked, acks)
+
+    def _next_batch(self, queue):
+        # Block for one item. With an asynchronous fetcher, also take the
+        # items that are already queued so they can be downloaded at once.
+        batch = [queue.get(block=True, timeout=5)]
+        if self.fetcher:
+            try:
+                while len(batch) < self.fetcher.max_in_flight:
+                    batch.append(queue.get_nowait())
+            except Empty:
+                pass
+        return batch
+
+    def _store_writer(self):
+        # Writer of classified documents of this process, if there's a store
+        if self.store:
+            return self.store.writer('C{0}'.format(os.getpid()))
+        return None
+
+    def _batch_texts(self, batch):
+        # Yields queue item, text tuples for a batch of queue items
+        if self.fetcher:
+            items = {id(item[0]): item for item in batch}
+            for index, data in self.fetcher.fetch_iter(item[0]
+                                                       for item in batch):
+                yield items[id(index)], self.pd.warc_html_to_text(data)
+        else:
+            for item in batch:
+                yield item, self.pd.index_to_txt(item[0])
 
     def classifying_from_files_worker(self, queue, threshold, to_db=False,
                                       progress=False):
@@ -122,48 +216,94 @@ class Workers(object):
         reading producers that fill the queue are done. See function
         set_file_producers_done()
 
+        Items with an acknowledgement are acknowledged as in
+        classifying_worker.
+
         :queue: Queue containing indices and text
         :to_db: Output index and category to database
         """
         global file_producers_done
 
+        documents = self._store_writer()
         indices = list()
         digests = list()
         occurrences = list()
         probabilities = list()
         topics_list = list()
+        snippets_list = list()
+        data_lists = [indices, digests, occurrences, probabilities,
+                      topics_list, snippets_list]
+
+        # Acknowledgements of the items of which the results are not stored
+        # in the database yet
+        unacked = list()
 
         while not queue.empty() or not file_producers_done.is_set():
             try:
-                index, txt = queue.get(block=True, timeout=5)
-                if progress:
-                    with progress_utils.counter_lock:
-                        progress_utils.counter.value += 1
-                co_occ = self.co.check(txt)
-                if not co_occ:
-                    continue
-                prob = self.ct.probability_per_category(txt,
-                                                        self.prepr.pre_process)
-                topics = self.ct.categories_above_threshold(prob, threshold)
-                if to_db:
-                    self._store_indices_db(index, indices)
-                    digests.append(index.get('digest', None))
-
-                    self._store_info_db(digests, (co_occ, occurrences),
-                                        db_utils.store_occurrences)
-                    self._store_info_db(digests, (prob, probabilities),
-                                        db_utils.store_indices_probabilities)
-                    self._store_info_db(digests, (topics, topics_list),
-                                        db_utils.store_indices_topics)
-
-                    if len(digests) >= self.commit:
-                        digests.clear()
+                index, txt, *ack = queue.get(block=True, timeout=5)
             except Empty:
-                pass
+                if unacked:
+                    self._store_pending_db(data_lists)
+                    self._acknowledge(unacked)
+                continue
+            unacked.extend(ack)
+            if progress:
+                with progress_utils.counter_lock:
+                    progress_utils.counter.value += 1
+            if self.snippet_width:
+                co_occ, snippets = self.co.check_snippets(
+                    txt, self.snippet_width)
+            else:
+                co_occ, snippets = self.co.check(txt), None
+            if co_occ:
+                prob = self.ct.probability_per_category(
+                    txt, self.prepr.pre_process)
+                topics = self.ct.categories_above_threshold(prob, threshold)
+                if documents:
+                    documents.write(index, txt, topics)
+            if co_occ and to_db:
+                self._store_indices_db(index, indices)
+                digests.append(index.get('digest', None))
+
+                self._store_info_db(digests, (co_occ, occurrences),
+                                    db_utils.store_occurrences)
+                self._store_info_db(digests, (prob, probabilities),
+                                    db_utils.store_indices_probabilities)
+                self._store_info_db(digests, (topics, topics_list),
+                                    db_utils.store_indices_topics)
+                self._store_info_db(digests, (snippets, snippets_list),
+                                    db_utils.store_indices_snippets)
+
+                if len(digests) >= self.commit:
+                    digests.clear()
+                    self._acknowledge(unacked)
+            elif not to_db:
+                self._acknowledge(unacked)
+        if documents:
+            documents.close()
         if to_db:
-            data_lists = [indices, digests, occurrences, probabilities,
-                          topics_list]
             self._final_store_db(data_lists)
+        self._acknowledge(unacked)
+
+    def _acknowledge(self, unacked, acks=None):
+        # Tell the producers that the items of unacked are done: the file
+        # reading worker, or the indices selector workers of acks, on the
+        # queue the first element of an acknowledgement routes to
+        for ack in unacked:
+            if acks is None:
+                self.acks.put(ack)
+            else:
+                acks[ack[0]].put(ack[1:])
+        unacked.clear()
+
+    def _store_pending_db(self, data_lists):
+        # Store the results that are not stored yet, e.g. to acknowledge
+        # them while the queue is empty
+        if not any(data_lists):
+            return
+        self._final_store_db(data_lists)
+        for data_list in data_lists:
+            data_list.clear()
 
     def _store_indices_db(self, index, indices, final=False):
         if index and indices is not None:
@@ -202,6 +342,7 @@ class Workers(object):
         occurrences = data_lists[2]
         probabilities = data_lists[3]
         topics_list = data_lists[4]
+        snippets_list = data_lists[5] if len(data_lists) > 5 else None
 
         # When done with queue but not above threshold still push to DB
         LOGGER.info('Final storing')
@@ -215,6 +356,8 @@ class Workers(object):
         LOGGER.info('Final storing probabilities done')
         self._store_info_db(digests, (None, topics_list),
                             db_utils.store_indices_topics, final=True)
+        self._store_info_db(digests, (None, snippets_list),
+                            db_utils.store_indices_snippets, final=True)
         LOGGER.info('Final storing done')
 
     def run_read_files_worker(self, directory, queue, join=True):
@@ -248,21 +391,119 @@ class Workers(object):
         of every file should contain the index. Worker separates first line
         and parses to dict. Tuple of index and text is added to queue.
 
+        Shards written by a shard_utils.ShardWriter are read record by
+        record, their index files are skipped.
+
+        Files are read in order of name. If a checkpoint is configured, the
+        files read before a restart are skipped, see checkpoint_utils. The
+        classifying workers acknowledge every tuple once its results are
+        stored, and the checkpoint only advances past files of which all
+        tuples are acknowledged. The worker waits for these
+        acknowledgements before it is done.
+
         :directory: Source directory containing files
         :queue: Queue to add the tuples to
         """
-        for file in os.scandir(directory):
-            if file.is_file():
-                with open(file.path, 'r', errors='replace') as f:
-                    text = f.readlines()
-                    try:
-                        index = literal_eval(text.pop(0).strip())
-                        queue.put((index, '\n'.join(text)), block=True)
-                    except IndexError:
-                        LOGGER.error('File {0} is not classifyable'
-                                     .format(file.path))
+        files = sorted((f for f in os.scandir(directory) if f.is_file() and
+                        not f.name.endswith(shard_utils.INDEX_EXT)),
+                       key=lambda f: f.name)
+        completions = None
+        position = 0
+        if self.checkpoint:
+            completions = checkpoint_utils.Completions(self.checkpoint)
+            position = self.checkpoint.position(directory)
+        for n, file in enumerate(files[position:], position):
+            if shard_utils.is_shard(file.path):
+                # A record is the last of its file once the next is read
+                previous = None
+                for record in shard_utils.ShardReader(file.path):
+                    if previous is not None:
+                        self._put_read(queue, previous, directory, n,
+                                       completions)
+                    previous = tuple(record)
+                if previous is not None:
+                    self._put_read(queue, previous, directory, n + 1,
+                                   completions)
+                continue
+            with open(file.path, 'r', errors='replace') as f:
+                text = f.readlines()
+                try:
+                    index = literal_eval(text.pop(0).strip())
+                    self._put_read(queue, (index, '\n'.join(text)),
+                                   directory, n + 1, completions)
+                except IndexError:
+                    LOGGER.error('File {0} is not classifyable'
+                                 .format(file.path))
+        if completions:
+            completions.close(directory, len(files))
+            completions.receive(self.acks, wait=True)
+            self.checkpoint.flush()
         LOGGER.info('File reading worker done.')
 
+    def _put_read(self, queue, item, key, after, completions):
+        # Queue an index, text tuple read from a file. With a checkpoint, the
+        # tuple gets an acknowledgement, the files before after are done
+        # once it and the tuples before it are acknowledged.
+        if completions:
+            item += ((key, completions.issue(key, after)),)
+            completions.receive(self.acks)
+        queue.put(item, block=True)
+
+    def run_read_wet_workers(self, num_workers, files, queue, join=True,
+                             root=None):
+        """ Run workers to read the text records of WET files. Output index,
+        text tuples of the records that may contain a co-occurrence to the
+        queue, to be classified by classifying_from_files_worker.
+
+        :num_workers: Number of workers that will run
+        :files: Paths to WET files or GzRanges of them
+        :queue: Queue to add the tuples to
+        :join: Wait for workers to finish in this function or return them
+        :root: Directory the filenames of the indices are relative to, see
+        wet.WetReader
+        :return: List of multiprocessing.Process if join = False
+        """
+        tasks = pipeline_utils.task_queue(files, num_workers)
+        workers = [Process(target=self.read_wet_worker,
+                           args=(tasks, queue, root))
+                   for _ in range(num_workers)]
+
+        for worker in workers:
+            worker.start()
+
+        LOGGER.info("WET reading workers started")
+
+        if join:
+            for worker in workers:
+                worker.join()
+        else:
+            return workers
+
+    def read_wet_worker(self, files, queue, root=None):
+        """ Read the text records of WET files and output them to the queue.
+        Records of which the text can't contain a co-occurrence are skipped,
+        see CoOccurrenceChecker.may_cooccur, as well as records with a digest
+        seen before if a digest filter is configured. The digests of the
+        records are remembered once they are queued or skipped.
+
+        :files: Paths to WET files or GzRanges of them, or a task queue of
+        them, see pipeline_utils.task_queue
+        :queue: Queue to add the index, text tuples to
+        :root: Directory the filenames of the indices are relative to
+        """
+        reader = wet.WetReader(root=root)
+        for file in pipeline_utils.iter_tasks(files):
+            for index, text in reader.iter_records(file):
+                if self.dedup and self.dedup.seen(index['digest']):
+                    continue
+                if self.co.may_cooccur(text):
+                    queue.put((index, text), block=True)
+                if self.dedup:
+                    self.dedup.add((index['digest'],))
+            if self.dedup:
+                self.dedup.commit()
+        LOGGER.info('WET reading worker done.')
+
     def run_compute_ic_rels_workers(self, num_workers, queue, join=True):
         """
         Creates workers for computing intercity relations. This method is